@@ -4,6 +4,7 @@ Performs a screening for the yearly performance of a LSC-PM with different tilt
 
 import time
 import logging
+import functools
 from pathlib import Path
 from tqdm import tqdm
 
@@ -24,12 +25,26 @@ from tqdm import tqdm
 # )
 
 import numpy as np
+import pandas as pd
 
 from pvlib.location import Location
+
 # from pvtrace import *
+from miniplant import full_simulation
+from miniplant.checkpoint import (
+    CHECKPOINT_ROWS,
+    remove_checkpoint,
+    run_with_checkpoints,
+)
+from miniplant.result_writer import ResultWriter, write_in_chunks
+from miniplant.simulation_pool import SimulationPool, pool_for_run
 from miniplant.simulation_runner import run_direct_simulation
-from miniplant.solar_data import solar_data_for_place_and_time
-from miniplant.utils import PhotonFactory
+from miniplant.solar_data import (
+    solar_data_for_place_and_time,
+    solar_data_for_tilts,
+    solar_ephemeris,
+)
+from miniplant.spectral_series import SpectralSeries
 
 RAYS_PER_SIMULATIONS = 100
 INCLUDE_DYE = True
@@ -37,84 +52,456 @@ INCLUDE_DYE = True
 logger = logging.getLogger("pvtrace").getChild("miniplant")
 
 
+def calculate_productivity_for_datapoint(
+    df,
+    tilt_angle: int,
+    num_photons: int = RAYS_PER_SIMULATIONS,
+    include_dye: bool = INCLUDE_DYE,
+    workers: int = 1,
+    pool: SimulationPool = None,
+    direct_spectrum: SpectralSeries = None,
+):
+    """
+    This function is apply()ed to the dataframe to populate it with the simulation results.
+    It takes care of setting up the simulation, and fill in the relevant fields or it terminates early if the
+    simulation is not deemed necessary (solar position below horizon or invalid surface fraction)
+
+    The spectrum is looked up in direct_spectrum, by default the one in the attrs of the solar data.
+    """
+    logger.info(f"Current date/time {df.name}")
+    if direct_spectrum is None:
+        direct_spectrum = df.attrs["direct_spectrum"]
+    # Ensure column existence
+    df["simulation_direct"] = 0
+    df["direct_reacted"] = 0
+
+    # If spectrum is not valid (close to sunset/sunrise) skip simulation. This is a SPCTRAL2 issue ;)
+    if np.count_nonzero(direct_spectrum.spectrum_at(df.name)) == 0:
+        print(f"skipping this point {df.name} due to low spectrum")
+        return df
+
+    # Create a function sampling the current solar spectrum
+    direct_photon_factory = direct_spectrum.sampler(df.name)
+
+    # Get the fraction of direct photon reacted
+    df["simulation_direct"] = run_direct_simulation(
+        tilt_angle=tilt_angle,
+        solar_azimuth=df["azimuth"],
+        solar_elevation=df["apparent_elevation"],
+        solar_spectrum_function=direct_photon_factory,
+        num_photons=num_photons,
+        workers=workers,
+        pool=pool,
+        include_dye=include_dye,
+    )
+    df["direct_reacted"] = df["simulation_direct"] * df["direct_irradiance"]
+
+    return df
+
+
 def evaluate_tilt_angle(
     tilt_angle: int,
     location: Location,
     workers: int = None,
     time_resolution: int = 1800,
+    pool: SimulationPool = None,
+    parallel_timesteps: bool = False,
+    solar_data: pd.DataFrame = None,
+    checkpoint_rows: int = None,
+    resume: bool = False,
+    stream_rows: int = None,
 ):
-    """Run a simulation with the given tilt angle/location combination and save results as CSV"""
+    """
+    Run a simulation with the given tilt angle/location combination and save results as CSV
+
+    Simulations run on the provided SimulationPool, if any. Otherwise, when workers != 1 a pool with that many
+    workers is started for the whole run (workers=None means one per CPU).
+    With parallel_timesteps=True whole timesteps are distributed to the pool workers instead of the photons of
+    each simulation.
+    Precomputed solar data for this tilt angle (e.g. from solar_data_for_tilts()) can be provided as solar_data.
+    With checkpoint_rows the results are saved every checkpoint_rows time points, and with resume=True an interrupted
+    run is resumed from its checkpoint (see miniplant.checkpoint). With stream_rows the results are instead appended
+    to the CSV every stream_rows time points (see miniplant.result_writer), and resume=True skips those already there.
+    """
     logger.info(f"Starting simulation w/ tilt angle {tilt_angle}")
 
-    solar_data = solar_data_for_place_and_time(
-        location, tilt_angle, time_resolution=time_resolution
-    )
+    if solar_data is None:
+        solar_data = solar_data_for_place_and_time(
+            location, tilt_angle, time_resolution=time_resolution
+        )
 
-    def calculate_productivity_for_datapoint(df):
-        """
-        This function is apply()ed to the dataframe to populate it with the simulation results.
-        It takes care of setting up the simulation, and fill in the relevant fields or it terminates early if the
-        simulation is not deemed necessary (solar position below horizon or invalid surface fraction)
-        """
-        logger.info(f"Current date/time {df.name}")
-        # Ensure column existence
-        df["simulation_direct"] = 0
-        df["direct_reacted"] = 0
+    prefix = f"simulation_results/{location.name}/{location.name}"
+    if not INCLUDE_DYE:
+        prefix += "_no_dye"
+    target_file = Path(f"{prefix}_{np.abs(tilt_angle)}deg_results.csv")
+    # Saved CSV now include direct_irradiation_simulation_result and dni_reacted! :)
+    columns = ["apparent_elevation", "azimuth", "simulation_direct", "direct_reacted"]
+
+    start_time = time.perf_counter()
+    progress_description = f"{location.name} {tilt_angle}deg"
+    with pool_for_run(pool, workers) as run_pool:
+        if parallel_timesteps and run_pool is not None:
+            datapoint_function = functools.partial(
+                calculate_productivity_for_datapoint,
+                tilt_angle=tilt_angle,
+                num_photons=RAYS_PER_SIMULATIONS,
+                include_dye=INCLUDE_DYE,
+            )
+            spectra = dict(direct_spectrum=solar_data.attrs["direct_spectrum"])
+
+            def process(rows):
+                return run_pool.map_rows(
+                    datapoint_function,
+                    rows,
+                    desc=progress_description,
+                    spectra=spectra,
+                )
 
-        # If spectrum is not valid (close to sunset/sunrise) skip simulation. This is a SPCTRAL2 issue ;)
-        if np.count_nonzero(df["direct_spectrum"]._y) == 0:
-            print(f"skipping this point {df.name} due to low spectrum")
-            return df
+        else:
+            tqdm.pandas(
+                desc=progress_description, position=1
+            )  # Shows nice progress bar
 
-        # Create a function sampling the current solar spectrum
-        direct_photon_factory = PhotonFactory(df["direct_spectrum"])
+            def process(rows):
+                return rows.progress_apply(
+                    calculate_productivity_for_datapoint,
+                    axis=1,
+                    tilt_angle=tilt_angle,
+                    num_photons=RAYS_PER_SIMULATIONS,
+                    include_dye=INCLUDE_DYE,
+                    workers=workers,
+                    pool=run_pool,
+                )
 
-        # Get the fraction of direct photon reacted
-        df["simulation_direct"] = run_direct_simulation(
+        # Saved with the streamed results or checkpoints, only the same run is resumed
+        run_parameters = dict(
+            location=[location.name, location.latitude, location.longitude],
             tilt_angle=tilt_angle,
-            solar_azimuth=df["azimuth"],
-            solar_elevation=df["apparent_elevation"],
-            solar_spectrum_function=direct_photon_factory,
+            time_resolution=time_resolution,
             num_photons=RAYS_PER_SIMULATIONS,
-            workers=workers,
             include_dye=INCLUDE_DYE,
         )
-        df["direct_reacted"] = df["simulation_direct"] * df["direct_irradiance"]
+        if stream_rows is not None:
+            with ResultWriter(
+                target_file, columns, resume=resume, parameters=run_parameters
+            ) as writer:
+                write_in_chunks(process, solar_data, writer, stream_rows)
+            results = None
+        elif checkpoint_rows is None and not resume:
+            results = process(solar_data)
+        else:
+            results = run_with_checkpoints(
+                process,
+                solar_data,
+                target_file,
+                run_parameters,
+                rows_per_checkpoint=checkpoint_rows or CHECKPOINT_ROWS,
+                resume=resume,
+            )
+    print(f"Simulation ended in {(time.perf_counter() - start_time) / 60:.1f} minutes!")
 
-        return df
+    if results is not None:
+        target_file.parent.mkdir(parents=True, exist_ok=True)
+        results.to_csv(target_file, columns=columns)
+        remove_checkpoint(target_file)
 
-    start_time = time.perf_counter()
-    tqdm.pandas(
-        desc=f"{location.name} {tilt_angle}deg", position=1
-    )  # Shows nice progress bar
-    results = solar_data.progress_apply(calculate_productivity_for_datapoint, axis=1)
-    print(f"Simulation ended in {(time.perf_counter() - start_time) / 60:.1f} minutes!")
 
-    prefix = f"simulation_results/{location.name}/{location.name}"
-    if not INCLUDE_DYE:
-        prefix += "_no_dye"
-    target_file = Path(f"{prefix}_{np.abs(tilt_angle)}deg_results.csv")
+def yearly_reacted(
+    tilt_angle: float,
+    location: Location,
+    time_resolution: int = 1800,
+    num_photons: int = RAYS_PER_SIMULATIONS,
+    include_dye: bool = INCLUDE_DYE,
+    pool: SimulationPool = None,
+    include_diffuse: bool = True,
+    ephemeris: pd.DataFrame = None,
+) -> tuple[float, float]:
+    """
+    Yearly amount of photons reacted (mol, direct and diffuse light) at the given tilt angle and location
 
-    target_file.parent.mkdir(parents=True, exist_ok=True)
-    # Saved CSV now include direct_irradiation_simulation_result and dni_reacted! :)
-    results.to_csv(
-        target_file,
-        columns=(
-            "apparent_elevation",
-            "azimuth",
-            "simulation_direct",
-            "direct_reacted",
-        ),
+    The irradiance of each time point is integrated over time_resolution, so the totals of different time resolutions
+    are comparable: coarse time resolutions give cheap estimates.
+
+    :param pool: SimulationPool to run the time points on, serial run if None
+    :param include_diffuse: with False only direct light is simulated, as in evaluate_tilt_angle()
+    :param ephemeris: solar_ephemeris() for this location and time resolution, shared by the tilt angles evaluated
+    :return: yearly amount reacted and its uncertainty (root sum of squares of the time point uncertainties, see
+        SimulationResult.reacted_uncertainty)
+    """
+    solar_data = solar_data_for_tilts(
+        location, [tilt_angle], time_resolution, ephemeris=ephemeris
+    )[tilt_angle]
+    light_sources = ["direct", "diffuse"] if include_diffuse else ["direct"]
+    if not include_diffuse:
+        solar_data["simulation_diffuse"] = 0.0
+    datapoint_function = functools.partial(
+        full_simulation.calculate_productivity_for_datapoint,
+        tilt_angle=tilt_angle,
+        num_photons_per_simulation=num_photons,
+        include_dye=include_dye,
+        trace_diffuse=include_diffuse,
+        extra_columns=("uncertainty",),
+    )
+    spectra = {
+        f"{kind}_spectrum": solar_data.attrs[f"{kind}_spectrum"]
+        for kind in light_sources
+    }
+    description = f"{location.name} {tilt_angle:.1f}deg"
+    if pool is None:
+        tqdm.pandas(desc=description)
+        results = solar_data.progress_apply(datapoint_function, axis=1, **spectra)
+    else:
+        results = pool.map_rows(
+            datapoint_function, solar_data, desc=description, spectra=spectra
+        )
+
+    if results.empty:
+        return 0.0, 0.0
+    reacted = sum(results[f"{kind}_reacted"].sum() for kind in light_sources)
+    uncertainty = np.sqrt(
+        sum(
+            (results[f"{kind}_reacted_uncertainty"] ** 2).sum()
+            for kind in light_sources
+        )
+    )
+    return reacted, uncertainty
+
+
+class TiltOptimum:
+    """Optimal tilt angle found by optimize_tilt_angle(), with the range of tilt angles performing as well"""
+
+    def __init__(
+        self,
+        tilt_angle: float,
+        low: float,
+        high: float,
+        reacted: float,
+        uncertainty: float,
+        evaluations: dict,
+    ):
+        """
+        :param tilt_angle: tilt angle with the largest yearly amount reacted (estimated)
+        :param low: lower end of the confidence range of the optimal tilt angle
+        :param high: higher end of the confidence range of the optimal tilt angle
+        :param reacted: largest yearly amount reacted simulated, see yearly_reacted()
+        :param uncertainty: its uncertainty
+        :param evaluations: mapping (tilt angle, time resolution) -> (yearly amount reacted, uncertainty)
+        """
+        self.tilt_angle = tilt_angle
+        self.low = low
+        self.high = high
+        self.reacted = reacted
+        self.uncertainty = uncertainty
+        self.evaluations = evaluations
+
+    def __repr__(self):
+        return (
+            f"TiltOptimum({self.tilt_angle:.1f}deg, range {self.low:.1f} -- {self.high:.1f}deg, "
+            f"{self.reacted:.4g} +/- {self.uncertainty:.2g} mol/year)"
+        )
+
+
+def _golden_section(
+    evaluate,
+    low: float,
+    high: float,
+    tolerance: float,
+    evaluations: dict,
+) -> tuple[float, float]:
+    """
+    Narrow the [low, high] bracket of the maximum of evaluate (returning value and uncertainty) by golden-section search
+
+    The search stops when the bracket is narrower than tolerance, or when the values at the two interior points are
+    within their uncertainty (the function is too flat there to tell them apart with the current photon numbers).
+    The interior points are evaluated at least once. Evaluations are cached in evaluations, keyed by tilt angle.
+    """
+
+    def cached(tilt_angle):
+        if tilt_angle not in evaluations:
+            evaluations[tilt_angle] = evaluate(tilt_angle)
+        return evaluations[tilt_angle]
+
+    inverse_golden_ratio = (np.sqrt(5) - 1) / 2
+    left = high - inverse_golden_ratio * (high - low)
+    right = low + inverse_golden_ratio * (high - low)
+    while True:
+        left_value, left_error = cached(left)
+        right_value, right_error = cached(right)
+        if high - low <= tolerance:
+            break
+        if abs(left_value - right_value) < np.hypot(left_error, right_error):
+            logger.info(
+                f"Tilt angles {left:.1f} and {right:.1f}deg cannot be told apart, stopping the search"
+            )
+            break
+        if left_value > right_value:
+            high, right = right, left
+            left = high - inverse_golden_ratio * (high - low)
+        else:
+            low, left = left, right
+            right = low + inverse_golden_ratio * (high - low)
+    return low, high
+
+
+def _confidence_range(
+    evaluations: dict, bracket: tuple[float, float], bounds: tuple[float, float]
+) -> tuple[float, float, float]:
+    """
+    Optimal tilt angle and its confidence range, from a quadratic surrogate fitted to the evaluations near the optimum
+
+    The range spans the tilt angles where the surrogate is within twice the uncertainty (of the best evaluation) of its
+    maximum.
+    If the evaluations are not concave, the best evaluated tilt angle and the search bracket are returned instead.
+    """
+    tilt_angles = np.array(list(evaluations))
+    values, errors = np.array(list(evaluations.values())).T
+    best = np.argmax(values)
+    curvature, slope, _ = np.polyfit(tilt_angles, values, 2)
+    if curvature >= 0:
+        return tilt_angles[best], *bracket
+
+    vertex = np.clip(-slope / (2 * curvature), tilt_angles.min(), tilt_angles.max())
+    # The surrogate is -curvature * d**2 below its maximum d degrees away from the vertex: that is 2 * error (the usual
+    # bound for values that cannot be told apart from the maximum) at d = sqrt(2 * error / -curvature)
+    half_width = np.sqrt(2 * errors[best] / -curvature)
+    low, high = sorted(bounds)
+    return vertex, max(low, vertex - half_width), min(high, vertex + half_width)
+
+
+def optimize_tilt_angle(
+    location: Location,
+    bounds: tuple[float, float] = None,
+    tolerance: float = 2,
+    time_resolution: int = 1800,
+    num_photons: int = RAYS_PER_SIMULATIONS,
+    coarse_time_resolution: int = 3 * 3600,
+    coarse_num_photons: int = 30,
+    coarse_tolerance: float = 10,
+    include_dye: bool = INCLUDE_DYE,
+    workers: int = None,
+    pool: SimulationPool = None,
+    include_diffuse: bool = True,
+) -> TiltOptimum:
+    """
+    Find the tilt angle with the largest yearly amount reacted at the given location, without a full sweep of angles.
+
+    A golden-section search with cheap, coarse simulations (coarse_time_resolution and coarse_num_photons) first
+    narrows the range of tilt angles to coarse_tolerance degrees. A second golden-section search with full simulations
+    (time_resolution and num_photons) then refines the optimum to tolerance degrees, or until the tilt angles compared
+    perform equally within their uncertainty. The optimum and its confidence range come from a quadratic surrogate of
+    the full simulations (see _confidence_range()): typically a handful of full simulations, plus the cheap coarse
+    ones, instead of one per angle of a sweep.
+
+    The objective is the yearly amount reacted from direct and diffuse light (see yearly_reacted()), while the
+    sweeps of evaluate_tilt_angle() (plotted by simulation_results/Angle_optimization_plot.py) only simulate direct
+    light: use include_diffuse=False for the optimum of that same objective.
+
+    :param bounds: range of tilt angles searched, by default 0 to 60 degrees towards the equator (i.e. negative tilt
+        angles in the southern hemisphere)
+    :param workers: number of workers of the pool started for the search, if no SimulationPool is provided
+        (None means one per CPU)
+    """
+    if bounds is None:
+        bounds = (0, 60) if location.latitude >= 0 else (-60, 0)
+    low, high = sorted(bounds)
+
+    # Solar position and clear-sky spectra are calculated once for all the tilt angles evaluated
+    coarse_ephemeris = solar_ephemeris(location, coarse_time_resolution)
+    ephemeris = solar_ephemeris(location, time_resolution)
+
+    coarse_evaluations, evaluations = {}, {}
+    with pool_for_run(pool, workers) as run_pool:
+        low, high = _golden_section(
+            lambda tilt_angle: yearly_reacted(
+                tilt_angle,
+                location,
+                coarse_time_resolution,
+                coarse_num_photons,
+                include_dye,
+                run_pool,
+                include_diffuse,
+                coarse_ephemeris,
+            ),
+            low,
+            high,
+            max(coarse_tolerance, tolerance),
+            coarse_evaluations,
+        )
+        logger.info(
+            f"Coarse search bracketed the optimum in {low:.1f} -- {high:.1f}deg"
+        )
+
+        def simulate(tilt_angle):
+            return yearly_reacted(
+                tilt_angle,
+                location,
+                time_resolution,
+                num_photons,
+                include_dye,
+                run_pool,
+                include_diffuse,
+                ephemeris,
+            )
+
+        low, high = _golden_section(simulate, low, high, tolerance, evaluations)
+        if len(evaluations) < 3:
+            # A third point, for the surrogate
+            middle = (low + high) / 2
+            evaluations[middle] = simulate(middle)
+
+    tilt_angle, low, high = _confidence_range(evaluations, (low, high), bounds)
+    best = max(evaluations, key=lambda tilt: evaluations[tilt][0])
+    reacted, uncertainty = evaluations[best]
+    return TiltOptimum(
+        tilt_angle=tilt_angle,
+        low=low,
+        high=high,
+        reacted=reacted,
+        uncertainty=uncertainty,
+        evaluations={
+            **{
+                (tilt, coarse_time_resolution): value
+                for tilt, value in coarse_evaluations.items()
+            },
+            **{(tilt, time_resolution): value for tilt, value in evaluations.items()},
+        },
     )
 
 
 if __name__ == "__main__":
+    import argparse
+
     from miniplant.locations import TOWNSVILLE
 
+    parser = argparse.ArgumentParser(
+        description="Yearly productivity of the reactor at different tilt angles"
+    )
+    parser.add_argument(
+        "--optimize",
+        action="store_true",
+        help="search the optimal tilt angle (see optimize_tilt_angle()) instead of sweeping the tilt angles",
+    )
+    args = parser.parse_args()
+
     site = TOWNSVILLE
 
-    tilt_range = list(range(0, -40, -5))
-    for tilt in tilt_range:
-        evaluate_tilt_angle(
-            tilt_angle=tilt, location=site, workers=12, time_resolution=1800
+    if args.optimize:
+        with SimulationPool(workers=12) as simulation_pool:
+            optimum = optimize_tilt_angle(site, bounds=(0, -40), pool=simulation_pool)
+        print(optimum)
+    else:
+        tilt_range = list(range(0, -40, -5))
+        # Solar position and spectra are calculated once for all the tilt angles
+        solar_data_per_tilt = solar_data_for_tilts(
+            site, tilt_range, time_resolution=1800
         )
+        with SimulationPool(workers=12) as simulation_pool:
+            for tilt in tilt_range:
+                evaluate_tilt_angle(
+                    tilt_angle=tilt,
+                    location=site,
+                    time_resolution=1800,
+                    pool=simulation_pool,
+                    parallel_timesteps=True,
+                    solar_data=solar_data_per_tilt[tilt],
+                )
@@ -0,0 +1,296 @@
+"""
+Angular and spectral response of the reactor to direct light.
+
+The fraction of direct photons reacted only depends on the incidence direction in the reactor frame and on their
+wavelength, not on where (location), when (time) or how (tilt) the reactor is. So it can be ray-traced once per reactor
+configuration on a grid of incidence angles x wavelengths, and then interpolated for each time point of any simulation.
+"""
+import functools
+import json
+import logging
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+from scipy.interpolate import RegularGridInterpolator
+from tqdm import tqdm
+
+from miniplant.scene_creator import reactor_configuration
+from miniplant.simulation_pool import SimulationPool, pool_for_run
+from miniplant.simulation_runner import run_direct_simulation
+from miniplant.solar_data import simulation_wavelengths
+from miniplant.spectral_series import SpectralSeries
+from miniplant.utils import FixedWavelength, tilt_rotation_matrix
+
+logger = logging.getLogger("pvtrace").getChild("miniplant")
+
+# Default grid: polar angle from the reactor normal and azimuth in the reactor plane (degrees)
+POLAR_ANGLES = np.array([0, 10, 20, 30, 40, 50, 60, 70, 80, 89], dtype=float)
+AZIMUTH_ANGLES = np.arange(0, 360, 45, dtype=float)
+
+
+def reactor_frame_angles(
+    tilt_angle: float, solar_elevation, solar_azimuth
+) -> tuple[np.ndarray, np.ndarray]:
+    """
+    Direction of the sun in the frame of a reactor with the given tilt angle
+
+    :return: polar angle from the reactor normal (i.e. the angle of incidence) and azimuth in the reactor plane, both
+        in degrees. For an horizontal reactor these are the solar zenith and 180 - solar azimuth.
+    """
+    # Same solar vector as in DirectPhotonGenerator (pvtrace.material.utils.spherical_to_cart)
+    theta = np.radians(90 - np.asarray(solar_elevation, dtype=float))
+    phi = np.radians(180 - np.asarray(solar_azimuth, dtype=float))
+    solar_vector = np.stack(
+        (np.sin(theta) * np.cos(phi), np.sin(theta) * np.sin(phi), np.cos(theta)),
+        axis=-1,
+    )
+    # The reactor (and light positions) are rotated by tilt_rotation_matrix, so apply the inverse rotation
+    reactor_vector = solar_vector @ tilt_rotation_matrix(tilt_angle)
+
+    polar = np.degrees(np.arccos(np.clip(reactor_vector[..., 2], -1, 1)))
+    azimuth = np.degrees(np.arctan2(reactor_vector[..., 1], reactor_vector[..., 0]))
+    return polar, np.mod(azimuth, 360)
+
+
+class AngularResponseTable:
+    """
+    Fraction of direct photons reacted on a (polar angle x azimuth x wavelength) grid, see build_angular_response().
+    """
+
+    def __init__(
+        self,
+        polar_angles,
+        azimuth_angles,
+        wavelengths,
+        efficiency,
+        num_photons: int = None,
+        reactor_configuration: dict = None,
+    ):
+        """
+        :param polar_angles: angles of incidence from the reactor normal (degrees, ascending)
+        :param azimuth_angles: azimuth angles in the reactor plane (degrees, ascending in [0, 360))
+        :param wavelengths: wavelengths in nm (ascending)
+        :param efficiency: (polar angles x azimuth angles x wavelengths) array of reacted photon fractions
+        :param num_photons: photons traced per grid point
+        :param reactor_configuration: scene template parameters used to trace the table (e.g. include_dye)
+        """
+        self.polar_angles = np.asarray(polar_angles, dtype=float)
+        self.azimuth_angles = np.asarray(azimuth_angles, dtype=float)
+        self.wavelengths = np.asarray(wavelengths, dtype=float)
+        self.efficiency = np.asarray(efficiency, dtype=float)
+        self.num_photons = num_photons
+        self.reactor_configuration = reactor_configuration or {}
+
+        shape = (
+            len(self.polar_angles),
+            len(self.azimuth_angles),
+            len(self.wavelengths),
+        )
+        if self.efficiency.shape != shape:
+            raise ValueError(
+                f"Efficiency shape {self.efficiency.shape} does not match the grid {shape}!"
+            )
+
+        # Azimuth is periodic: repeat the first azimuth at +360 degrees to interpolate across 0
+        self._interpolator = RegularGridInterpolator(
+            (
+                self.polar_angles,
+                np.append(self.azimuth_angles, self.azimuth_angles[0] + 360),
+                self.wavelengths,
+            ),
+            np.concatenate((self.efficiency, self.efficiency[:, :1, :]), axis=1),
+        )
+
+    def save(self, path) -> None:
+        """Save the table as (compressed) npz file"""
+        np.savez_compressed(
+            path,
+            polar_angles=self.polar_angles,
+            azimuth_angles=self.azimuth_angles,
+            wavelengths=self.wavelengths,
+            efficiency=self.efficiency,
+            metadata=json.dumps(
+                {
+                    "num_photons": self.num_photons,
+                    "reactor_configuration": self.reactor_configuration,
+                }
+            ),
+        )
+
+    @classmethod
+    def load(cls, path) -> "AngularResponseTable":
+        """Load a table saved with save()"""
+        with np.load(path) as data:
+            metadata = json.loads(str(data["metadata"]))
+            return cls(
+                data["polar_angles"],
+                data["azimuth_angles"],
+                data["wavelengths"],
+                data["efficiency"],
+                **metadata,
+            )
+
+    def check_reactor_configuration(self, **template_kwargs) -> None:
+        """
+        Raise ValueError if the table was traced for another reactor configuration than the given one
+
+        :param template_kwargs: reactor parameters of the run, as accepted by get_scene_template() (e.g. include_dye)
+        """
+        expected = reactor_configuration(**template_kwargs)
+        traced = reactor_configuration(**self.reactor_configuration)
+        mismatched = sorted(key for key in expected if expected[key] != traced[key])
+        if mismatched:
+            differences = ", ".join(
+                f"{key}={traced[key]} instead of {expected[key]}" for key in mismatched
+            )
+            raise ValueError(
+                f"Angular response table traced for another reactor: {differences}!"
+            )
+
+    def efficiency_at(self, polar, azimuth, wavelengths=None) -> np.ndarray:
+        """
+        Interpolated reacted fraction for the given incidence directions (reactor frame, degrees)
+
+        :return: (directions x wavelengths) array, for the table wavelengths if none are given
+        """
+        wavelengths = self.wavelengths if wavelengths is None else wavelengths
+        polar = np.clip(np.ravel(polar), self.polar_angles[0], self.polar_angles[-1])
+        azimuth = np.mod(np.ravel(azimuth) - self.azimuth_angles[0], 360)
+        azimuth += self.azimuth_angles[0]
+        wavelengths = np.clip(
+            np.asarray(wavelengths, dtype=float),
+            self.wavelengths[0],
+            self.wavelengths[-1],
+        )
+
+        points = np.empty((len(polar), len(wavelengths), 3))
+        points[..., 0] = polar[:, np.newaxis]
+        points[..., 1] = azimuth[:, np.newaxis]
+        points[..., 2] = wavelengths
+        return self._interpolator(points)
+
+    def direct_efficiency(
+        self,
+        solar_data: pd.DataFrame,
+        tilt_angle: float,
+        direct_spectrum: SpectralSeries = None,
+    ) -> np.ndarray:
+        """
+        Fraction of direct photons reacted at each time point of solar_data (as run_direct_simulation() would return)
+
+        The spectral response for the time point solar position is weighted with its direct spectrum (photon flux).
+
+        :param solar_data: DataFrame with apparent_elevation and azimuth, as returned by solar_data_for_place_and_time()
+        :param tilt_angle: reactor tilt angle
+        :param direct_spectrum: direct spectra of the time points, by default the one in the attrs of solar_data
+        """
+        if direct_spectrum is None:
+            direct_spectrum = solar_data.attrs["direct_spectrum"]
+        spectra = direct_spectrum.take(
+            direct_spectrum.index.get_indexer(solar_data.index)
+        )
+
+        polar, azimuth = reactor_frame_angles(
+            tilt_angle,
+            solar_data["apparent_elevation"].to_numpy(),
+            solar_data["azimuth"].to_numpy(),
+        )
+        efficiency = self.efficiency_at(polar, azimuth, spectra.wavelengths)
+
+        reacted = np.trapz(efficiency * spectra.values, spectra.wavelengths, axis=1)
+        return reacted / spectra.integrate()
+
+
+def _grid_point_efficiency(
+    grid_point: pd.Series,
+    num_photons: int,
+    template_kwargs: dict,
+    pool: SimulationPool = None,
+) -> pd.Series:
+    """This function is apply()ed to the grid DataFrame to trace the reactor response for a direction/wavelength"""
+    # With an horizontal reactor the reactor frame is the world frame (see reactor_frame_angles)
+    grid_point["efficiency"] = run_direct_simulation(
+        tilt_angle=0,
+        solar_elevation=90 - grid_point["polar_angle"],
+        solar_azimuth=180 - grid_point["azimuth_angle"],
+        solar_spectrum_function=FixedWavelength(grid_point["wavelength"]),
+        num_photons=num_photons,
+        pool=pool,
+        **template_kwargs,
+    )
+    return grid_point
+
+
+def build_angular_response(
+    polar_angles=POLAR_ANGLES,
+    azimuth_angles=AZIMUTH_ANGLES,
+    wavelengths=None,
+    num_photons: int = 200,
+    include_dye: bool = True,
+    workers: int = None,
+    pool: SimulationPool = None,
+    **template_kwargs,
+) -> AngularResponseTable:
+    """
+    Ray-trace the direct light response of the reactor on a grid of incidence directions and wavelengths
+
+    Grid points are independent simulations, distributed on the pool workers (see yearlong_simulation()).
+
+    :param polar_angles: angles of incidence from the reactor normal (degrees)
+    :param azimuth_angles: azimuth angles in the reactor plane (degrees)
+    :param wavelengths: wavelengths in nm, default to the wavelengths of the simulated solar spectra
+    :param num_photons: photons traced per grid point
+    :param include_dye: include the luminophore in the reactor
+    :param template_kwargs: other reactor parameters, as accepted by get_scene_template() (e.g. reactant_absorption)
+    """
+    wavelengths = simulation_wavelengths() if wavelengths is None else wavelengths
+    template_kwargs = dict(include_dye=include_dye, **template_kwargs)
+    grid = pd.MultiIndex.from_product(
+        (polar_angles, azimuth_angles, wavelengths),
+        names=("polar_angle", "azimuth_angle", "wavelength"),
+    ).to_frame(index=False)
+
+    logger.info(f"Building angular response table with {len(grid)} grid points")
+    progress_description = "Angular response"
+    with pool_for_run(pool, workers) as run_pool:
+        if run_pool is not None:
+            results = run_pool.map_rows(
+                functools.partial(
+                    _grid_point_efficiency,
+                    num_photons=num_photons,
+                    template_kwargs=template_kwargs,
+                ),
+                grid,
+                desc=progress_description,
+            )
+        else:
+            tqdm.pandas(desc=progress_description)
+            results = grid.progress_apply(
+                _grid_point_efficiency,
+                axis=1,
+                num_photons=num_photons,
+                template_kwargs=template_kwargs,
+            )
+
+    return AngularResponseTable(
+        polar_angles,
+        azimuth_angles,
+        wavelengths,
+        results["efficiency"]
+        .to_numpy()
+        .reshape(len(polar_angles), len(azimuth_angles), len(wavelengths)),
+        num_photons=num_photons,
+        reactor_configuration=template_kwargs,
+    )
+
+
+if __name__ == "__main__":
+    # Set loggers
+    logging.getLogger("trimesh").disabled = True
+    logging.getLogger("shapely.geos").disabled = True
+    logging.getLogger("pvtrace").setLevel(logging.WARNING)
+
+    for dye in (True, False):
+        table = build_angular_response(include_dye=dye, workers=12)
+        table.save(Path(f"angular_response{'' if dye else '_no_dye'}.npz"))
@@ -0,0 +1,27 @@
+"""
+Benchmark of photon emission: rays generated one at a time (pvtrace Scene.emit) vs. in a single batch per light
+source (miniplant.utils.emit_photons), for direct and diffuse light.
+"""
+import timeit
+
+from miniplant.scene_creator import create_diffuse_scene, create_direct_scene
+from miniplant.utils import emit_photons
+
+TILT_ANGLE = 40
+NUM_PHOTONS = 10000
+
+
+if __name__ == "__main__":
+    print(f"Emission of {NUM_PHOTONS} photons")
+    for kind, scene_factory in (
+        ("direct", lambda: create_direct_scene(tilt_angle=TILT_ANGLE)),
+        ("diffuse", lambda: create_diffuse_scene(tilt_angle=TILT_ANGLE)),
+    ):
+        scene = scene_factory()
+        before = timeit.timeit(
+            lambda scene=scene: list(scene.emit(NUM_PHOTONS)), number=1
+        )
+        after = timeit.timeit(
+            lambda scene=scene: list(emit_photons(scene, NUM_PHOTONS)), number=1
+        )
+        print(f"  {kind:8s} one at a time: {before:6.3f} s   batch: {after:6.3f} s")
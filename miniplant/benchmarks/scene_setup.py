@@ -0,0 +1,59 @@
+"""
+Benchmark of the per-timestep scene setup cost: full scene graph rebuilt for every timestep (as it used to be) vs.
+reactor geometry cached in a ReactorSceneTemplate with only the light source swapped, both through the template and
+through the public create_direct_scene()/create_diffuse_scene().
+"""
+import timeit
+
+from miniplant.scene_creator import (
+    _create_scene_common,
+    _diffuse_light_node,
+    _direct_light_node,
+    create_diffuse_scene,
+    create_direct_scene,
+    get_scene_template,
+)
+
+TILT_ANGLE = 40
+REPETITIONS = 50
+
+
+def rebuild_scenes():
+    """One timestep worth of setup without template: a direct and a diffuse scene built from scratch"""
+    _create_scene_common(
+        TILT_ANGLE, _direct_light_node(TILT_ANGLE, 50, 180, lambda: 555)
+    )
+    _create_scene_common(TILT_ANGLE, _diffuse_light_node(TILT_ANGLE, lambda: 555))
+
+
+def reuse_template():
+    """One timestep worth of setup with the cached scene template"""
+    template = get_scene_template(TILT_ANGLE)
+    template.direct_scene(solar_elevation=50, solar_azimuth=180)
+    template.diffuse_scene()
+
+
+def public_scenes():
+    """One timestep worth of setup with the public scene constructors (cached template behind them)"""
+    create_direct_scene(tilt_angle=TILT_ANGLE, solar_elevation=50, solar_azimuth=180)
+    create_diffuse_scene(tilt_angle=TILT_ANGLE)
+
+
+if __name__ == "__main__":
+    get_scene_template(
+        TILT_ANGLE
+    )  # Template is built once per run, exclude it from the timing
+
+    before = timeit.timeit(rebuild_scenes, number=REPETITIONS) / REPETITIONS
+    after = timeit.timeit(reuse_template, number=REPETITIONS) / REPETITIONS
+    public = timeit.timeit(public_scenes, number=REPETITIONS) / REPETITIONS
+
+    print(
+        f"Scene setup per timestep (direct + diffuse), average over {REPETITIONS} runs"
+    )
+    print(f"  rebuild every timestep: {before * 1e3:8.3f} ms")
+    print(f"  reuse scene template:   {after * 1e3:8.3f} ms")
+    print(f"  create_*_scene():       {public * 1e3:8.3f} ms")
+    print(
+        f"  speed-up:               {before / after:8.1f}x (template), {before / public:.1f}x (create_*_scene)"
+    )
@@ -0,0 +1,284 @@
+"""
+Campaigns of yearlong simulations (e.g. several tilt angles at several sites, with and without dye) from a JSON spec,
+run with the miniplant console command:
+
+    $ miniplant campaign.json --workers 12
+
+Example of campaign spec:
+
+    {
+        "output_dir": "campaign_results",
+        "time_resolution": 1800,
+        "studies": [
+            {"sites": ["Eindhoven", "Townsville"], "tilts": [0, 20, 40], "include_dye": [true, false]},
+            {
+                "sites": [{"name": "Amsterdam", "latitude": 52.37, "longitude": 4.90, "tz": "Europe/Amsterdam"}],
+                "tilts": [30],
+                "total_photons": 1000000
+            },
+            {"name": "with_ground", "sites": ["Eindhoven"], "tilts": [40], "include_ground": true}
+        ]
+    }
+
+Sites are either names from locations.LOCATIONS or custom coordinates (as accepted by pvlib Location). Top-level keys
+apply to all the studies (a spec without "studies" is a single study), other keys are passed to yearlong_simulation()
+(e.g. num_photons_per_simulation, total_photons, include_ground, time_range).
+
+Results are saved in output_dir/site/site_tilt_results.csv, or in output_dir/name/site/... for studies with a "name".
+Studies simulating the same site, tilt angle and dye (e.g. with different options) need different names: campaigns
+where two jobs would write the same results file are rejected.
+
+All the jobs share a single pool of workers, to which each job distributes its time points. Solar data are calculated
+once per site, for all its tilt angles. Jobs whose results file already exists are skipped, interrupted jobs are
+resumed (see miniplant.checkpoint).
+"""
+import argparse
+import inspect
+import json
+import logging
+from pathlib import Path
+
+from pvlib.location import Location
+
+from miniplant.checkpoint import CHECKPOINT_ROWS, checkpoint_file
+from miniplant.full_simulation import yearlong_simulation
+from miniplant.locations import LOCATIONS
+from miniplant.result_writer import is_complete
+from miniplant.simulation_pool import SimulationPool
+from miniplant.solar_data import solar_data_for_tilts
+
+DEFAULT_OUTPUT_DIR = "campaign_results"
+
+# yearlong_simulation() parameters set by the campaign itself
+_JOB_PARAMETERS = {
+    "tilt_angle",
+    "location",
+    "include_dye",
+    "target_file",
+    "workers",
+    "pool",
+    "parallel_timesteps",
+    "solar_data",
+    "resume",
+    "time_resolution",
+    "time_range",
+}
+
+logger = logging.getLogger("pvtrace").getChild("miniplant")
+
+
+def site_from_spec(site: str | dict) -> Location:
+    """Location from its name (one of locations.LOCATIONS) or from its coordinates"""
+    if isinstance(site, dict):
+        return Location(**site)
+
+    for location in LOCATIONS:
+        if location.name.lower() == site.lower():
+            return location
+    known_sites = ", ".join(sorted(location.name for location in LOCATIONS))
+    raise ValueError(f"Unknown site {site}! Known sites are: {known_sites}")
+
+
+class CampaignJob:
+    """A yearlong simulation of a campaign: site, tilt angle, dye and other yearlong_simulation() options"""
+
+    def __init__(
+        self,
+        site: Location,
+        tilt_angle: int,
+        include_dye: bool,
+        target_file: Path,
+        time_resolution: int = 1800,
+        time_range=None,
+        options: dict = None,
+    ):
+        self.site = site
+        self.tilt_angle = tilt_angle
+        self.include_dye = include_dye
+        self.target_file = target_file
+        self.time_resolution = time_resolution
+        self.time_range = tuple(time_range) if time_range else None
+        self.options = options or {}
+
+    def __repr__(self):
+        dye = "with dye" if self.include_dye else "without dye"
+        return f"CampaignJob({self.site.name} {self.tilt_angle}deg {dye} -> {self.target_file})"
+
+    @property
+    def solar_data_key(self) -> tuple:
+        """Jobs with the same key share their solar data (same site and time points)"""
+        site = self.site
+        return (
+            site.name,
+            site.latitude,
+            site.longitude,
+            str(site.tz),
+            site.altitude,
+            self.time_resolution,
+            self.time_range,
+        )
+
+    def is_done(self) -> bool:
+        """
+        Whether the job results are already saved. Streamed results (stream_rows option) may be partial: they are
+        saved once marked complete, otherwise the job is run again, skipping the time points already saved.
+        """
+        if "stream_rows" in self.options:
+            return is_complete(self.target_file)
+        return (
+            self.target_file.exists() and not checkpoint_file(self.target_file).exists()
+        )
+
+    def run(self, pool: SimulationPool = None, solar_data=None):
+        """Run the simulation, resuming it if interrupted"""
+        options = dict(self.options)
+        if "stream_rows" not in options:
+            options.setdefault("checkpoint_rows", CHECKPOINT_ROWS)
+        yearlong_simulation(
+            self.tilt_angle,
+            self.site,
+            include_dye=self.include_dye,
+            target_file=self.target_file,
+            pool=pool,
+            parallel_timesteps=True,
+            solar_data=solar_data,
+            resume=True,
+            time_resolution=self.time_resolution,
+            time_range=self.time_range,
+            **options,
+        )
+
+
+def campaign_jobs(spec: dict) -> list[CampaignJob]:
+    """All the jobs of a campaign spec (see module docstring)"""
+    valid_options = set(inspect.signature(yearlong_simulation).parameters)
+    defaults = {key: value for key, value in spec.items() if key != "studies"}
+
+    jobs = []
+    for study in spec.get("studies", [{}]):
+        study = {**defaults, **study}
+        try:
+            sites = [site_from_spec(site) for site in study.pop("sites")]
+            tilts = study.pop("tilts")
+        except KeyError as missing:
+            raise ValueError(
+                f"Missing {missing} in campaign study {study}!"
+            ) from missing
+        output_dir = Path(study.pop("output_dir", DEFAULT_OUTPUT_DIR))
+        if "name" in study:
+            output_dir = output_dir / study.pop("name")
+        include_dye = study.pop("include_dye", True)
+        time_resolution = study.pop("time_resolution", 1800)
+        time_range = study.pop("time_range", None)
+
+        invalid = set(study) - (valid_options - _JOB_PARAMETERS)
+        if invalid:
+            raise ValueError(f"Invalid options in campaign study: {sorted(invalid)}")
+
+        for site in sites:
+            for tilt_angle in tilts:
+                for dye in (
+                    include_dye if isinstance(include_dye, list) else [include_dye]
+                ):
+                    suffix = "" if dye else "_no_dye"
+                    jobs.append(
+                        CampaignJob(
+                            site,
+                            tilt_angle,
+                            dye,
+                            output_dir
+                            / site.name
+                            / f"{site.name}{suffix}_{tilt_angle}deg_results.csv",
+                            time_resolution=time_resolution,
+                            time_range=time_range,
+                            options=study,
+                        )
+                    )
+
+    target_files = [job.target_file for job in jobs]
+    duplicates = sorted(
+        {str(path) for path in target_files if target_files.count(path) > 1}
+    )
+    if duplicates:
+        raise ValueError(
+            f"Several campaign jobs would write {', '.join(duplicates)}, give their studies different names!"
+        )
+    return jobs
+
+
+def run_campaign(
+    spec: dict, workers: int = None, dry_run: bool = False
+) -> list[CampaignJob]:
+    """
+    Run the jobs of a campaign spec not done yet, on a pool with workers processes (workers=None means one per CPU)
+
+    :param dry_run: do not run anything, only return the jobs to be run
+    :return: jobs run
+    """
+    jobs = campaign_jobs(spec)
+    pending = [job for job in jobs if not job.is_done()]
+    logger.info(
+        f"Campaign with {len(jobs)} jobs, {len(jobs) - len(pending)} already done"
+    )
+    if dry_run or not pending:
+        return pending
+
+    jobs_per_solar_data = {}
+    for job in pending:
+        jobs_per_solar_data.setdefault(job.solar_data_key, []).append(job)
+
+    with SimulationPool(workers) as pool:
+        for site_jobs in jobs_per_solar_data.values():
+            first_job = site_jobs[0]
+            start, end = first_job.time_range or (None, None)
+            solar_data = solar_data_for_tilts(
+                first_job.site,
+                sorted({job.tilt_angle for job in site_jobs}),
+                first_job.time_resolution,
+                start=start,
+                end=end,
+            )
+            for job in site_jobs:
+                print(f"Now running {job}")
+                job.run(pool=pool, solar_data=solar_data[job.tilt_angle])
+    return pending
+
+
+def main(argv: list[str] = None):
+    """Entry point of the miniplant console command"""
+    parser = argparse.ArgumentParser(
+        prog="miniplant",
+        description="Run a campaign of yearlong LSC-PM reactor simulations, see miniplant.campaign for the spec",
+    )
+    parser.add_argument("spec", type=Path, help="campaign spec, JSON file")
+    parser.add_argument(
+        "-w", "--workers", type=int, help="worker processes (default: one per CPU)"
+    )
+    parser.add_argument(
+        "-n", "--dry-run", action="store_true", help="only list the jobs to be run"
+    )
+    parser.add_argument(
+        "-v", "--verbose", action="store_true", help="print more log messages"
+    )
+    args = parser.parse_args(argv)
+
+    # Set loggers (no output needed for progress bar to work!)
+    logging.basicConfig()
+    logging.getLogger("trimesh").disabled = True
+    logging.getLogger("shapely.geos").disabled = True
+    logging.getLogger("pvtrace").setLevel(
+        logging.INFO if args.verbose else logging.WARNING
+    )
+
+    spec = json.loads(args.spec.read_text())
+    jobs = run_campaign(spec, workers=args.workers, dry_run=args.dry_run)
+    if args.dry_run:
+        for job in jobs:
+            print(job)
+        print(f"{len(jobs)} jobs to be run")
+    else:
+        print(f"{len(jobs)} jobs completed")
+
+
+if __name__ == "__main__":
+    main()
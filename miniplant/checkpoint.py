@@ -0,0 +1,94 @@
+"""
+Checkpoints of long simulation runs (e.g. yearlong_simulation()), so that an interrupted run can be resumed.
+
+The results of the time points completed so far are periodically saved (HDF5) in a sidecar file next to the results
+file. As for the solar data cache, the checkpoint is written under a temporary name and then atomically moved in
+place, so that a crash while saving never leaves a corrupted checkpoint. Resumed runs skip the time points already in
+the checkpoint and return the results in the original order, as an uninterrupted run would.
+"""
+import logging
+import os
+from pathlib import Path
+from typing import Callable
+
+import pandas as pd
+
+# Default number of time points simulated between checkpoints
+CHECKPOINT_ROWS = 200
+
+logger = logging.getLogger("pvtrace").getChild("miniplant")
+
+
+def checkpoint_file(target_file: Path) -> Path:
+    """Checkpoint file of the run whose results are saved in target_file"""
+    target_file = Path(target_file)
+    return target_file.with_name(f"{target_file.name}.checkpoint.h5")
+
+
+def load_checkpoint(path: Path, parameters: dict) -> pd.DataFrame | None:
+    """
+    Results saved in the checkpoint, None if there is no checkpoint
+
+    :param parameters: parameters of the run (JSON-serializable dict), which must match those of the checkpoint
+    """
+    if not path.exists():
+        return None
+
+    with pd.HDFStore(path, mode="r") as store:
+        if store.get_storer("results").attrs.parameters != parameters:
+            raise ValueError(
+                f"Checkpoint {path} is from a run with different parameters, remove it to start over!"
+            )
+        return store["results"]
+
+
+def save_checkpoint(path: Path, parameters: dict, results: pd.DataFrame) -> None:
+    """Save the results of the time points completed so far"""
+    temporary_path = path.with_name(f"{path.stem}.{os.getpid()}.tmp")
+    path.parent.mkdir(parents=True, exist_ok=True)
+    with pd.HDFStore(temporary_path, mode="w") as store:
+        store.put("results", results, format="fixed")
+        store.get_storer("results").attrs.parameters = parameters
+    os.replace(temporary_path, path)
+    logger.debug(f"Saved checkpoint {path} with {len(results)} time points")
+
+
+def run_with_checkpoints(
+    process: Callable[[pd.DataFrame], pd.DataFrame],
+    data: pd.DataFrame,
+    target_file: Path,
+    parameters: dict,
+    rows_per_checkpoint: int = CHECKPOINT_ROWS,
+    resume: bool = False,
+) -> pd.DataFrame:
+    """
+    Process the time points in data in chunks, saving a checkpoint after each of them
+
+    :param process: function returning the results for a DataFrame of time points, e.g. applying
+        calculate_productivity_for_datapoint() to its rows
+    :param target_file: file where the results will be saved, the checkpoint is saved next to it
+    :param parameters: parameters of the run (JSON-serializable dict), saved in the checkpoint
+    :param resume: skip the time points already in the checkpoint, if any. Otherwise, the run starts over.
+    :return: results of all the time points, in the same order as data
+    """
+    path = checkpoint_file(target_file)
+    completed = load_checkpoint(path, parameters) if resume else None
+    if completed is None:
+        done, pending = [], data
+    else:
+        logger.info(f"Resuming from {path}: {len(completed)} time points completed")
+        done, pending = [completed], data.loc[~data.index.isin(completed.index)]
+
+    if pending.empty and not done:
+        return process(pending)
+
+    for start in range(0, len(pending), rows_per_checkpoint):
+        done.append(process(pending.iloc[start : start + rows_per_checkpoint]))
+        save_checkpoint(path, parameters, pd.concat(done))
+
+    return pd.concat(done).loc[data.index]
+
+
+def remove_checkpoint(target_file: Path) -> None:
+    """Remove the checkpoint of a run, once its results are saved"""
+    checkpoint_file(target_file).unlink(missing_ok=True)
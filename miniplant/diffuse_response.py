@@ -0,0 +1,123 @@
+"""
+Spectral response of the reactor to diffuse light.
+
+Diffuse photons are emitted isotropically (IsotropicPhotonGenerator), so the fraction reacted only depends on the
+reactor (tilt angle, dye, geometry) and on the photon wavelength, not on the time point. The wavelength-resolved
+efficiency is ray-traced once per reactor configuration (and cached on disk), then the efficiency for the diffuse
+spectrum of each time point is a weighted average of it (see SpectralEfficiency.fold()).
+"""
+import logging
+import os
+
+import numpy as np
+import pandas as pd
+
+from miniplant import solar_cache
+from miniplant.scene_creator import reactor_configuration
+from miniplant.simulation_pool import SimulationPool
+from miniplant.simulation_runner import run_wavelength_resolved_simulation
+from miniplant.spectral_data import spectrum_hash
+from miniplant.spectral_efficiency import WAVELENGTH_BINS, SpectralEfficiency
+from miniplant.spectral_series import SpectralSeries
+
+logger = logging.getLogger("pvtrace").getChild("miniplant")
+
+# Photons traced to characterize the diffuse response (about 600 per 10 nm bin). This takes a few minutes (e.g. about
+# 4 minutes on 2 workers), once per reactor configuration as the response is cached.
+DIFFUSE_RESPONSE_PHOTONS = 20000
+
+
+def build_diffuse_response(
+    tilt_angle: float,
+    include_dye: bool = True,
+    num_photons: int = DIFFUSE_RESPONSE_PHOTONS,
+    wavelength_bins=WAVELENGTH_BINS,
+    workers: int = None,
+    pool: SimulationPool = None,
+    use_cache: bool = True,
+    **template_kwargs,
+) -> SpectralEfficiency:
+    """
+    Ray-trace the wavelength-resolved diffuse light efficiency of the reactor with the given tilt angle
+
+    Responses are cached on disk by reactor configuration, including the content of its spectra (a spectrum registered
+    again with other data gets a new response). Building a response with the default number of photons takes a few
+    minutes: fewer photons give a cheaper, noisier response.
+
+    :param tilt_angle: reactor tilt angle
+    :param include_dye: include the luminophore in the reactor
+    :param num_photons: photons traced, spread evenly over the wavelength bins (see DIFFUSE_RESPONSE_PHOTONS)
+    :param wavelength_bins: wavelength bin edges in nm
+    :param workers: number of workers, if no SimulationPool is provided (None means one per CPU)
+    :param use_cache: load the response from the on-disk cache (see miniplant.solar_cache) and save new ones in it
+    :param template_kwargs: other reactor parameters, as accepted by get_scene_template() (e.g. reactant_absorption)
+    """
+    configuration = reactor_configuration(include_dye=include_dye, **template_kwargs)
+    parameters = dict(
+        tilt_angle=tilt_angle,
+        num_photons=num_photons,
+        wavelength_bins=np.asarray(wavelength_bins, dtype=float).tolist(),
+        spectra={
+            name: spectrum_hash(configuration[name])
+            for name in ("dye_absorption", "dye_emission", "reactant_absorption")
+        },
+        **configuration,
+    )
+    path = solar_cache.cache_file(parameters, prefix="diffuse_response", suffix=".npz")
+    if use_cache and path.exists():
+        try:
+            response = SpectralEfficiency.load(path)
+        except (OSError, KeyError, ValueError) as exception:
+            logger.warning(
+                f"Cannot read diffuse response cache file {path}: {exception}"
+            )
+        else:
+            logger.debug(f"Loaded diffuse response from cache file {path}")
+            return response
+
+    logger.info(f"Building diffuse response for tilt angle {tilt_angle}")
+    response = run_wavelength_resolved_simulation(
+        "diffuse",
+        tilt_angle=tilt_angle,
+        num_photons=num_photons,
+        wavelength_bins=wavelength_bins,
+        workers=workers,
+        include_dye=include_dye,
+        pool=pool,
+        **template_kwargs,
+    )
+
+    if use_cache:
+        # Written under a temporary name and moved in place, as for cached solar data
+        temporary_path = path.with_name(f"{path.stem}.{os.getpid()}.tmp")
+        try:
+            path.parent.mkdir(parents=True, exist_ok=True)
+            with open(temporary_path, "wb") as file:
+                response.save(file)
+            os.replace(temporary_path, path)
+        except OSError as exception:
+            logger.warning(
+                f"Cannot write diffuse response cache file {path}: {exception}"
+            )
+            temporary_path.unlink(missing_ok=True)
+    return response
+
+
+def diffuse_efficiency(
+    response: SpectralEfficiency,
+    solar_data: pd.DataFrame,
+    diffuse_spectrum: SpectralSeries = None,
+) -> np.ndarray:
+    """
+    Fraction of diffuse photons reacted at each time point of solar_data (as run_diffuse_simulation() would return)
+
+    :param response: diffuse response of the reactor, see build_diffuse_response()
+    :param solar_data: DataFrame as returned by solar_data_for_place_and_time()
+    :param diffuse_spectrum: diffuse spectra of the time points, by default the one in the attrs of solar_data
+    """
+    if diffuse_spectrum is None:
+        diffuse_spectrum = solar_data.attrs["diffuse_spectrum"]
+    spectra = diffuse_spectrum.take(
+        diffuse_spectrum.index.get_indexer(solar_data.index)
+    )
+    return response.fold(spectra)
@@ -1,6 +1,3 @@
-import io
-
-import pandas as pd
 import numpy as np
 
 from pvtrace import (
@@ -8,9 +5,6 @@ from pvtrace import (
     Sphere,
     Material,
     Absorber,
-    Luminophore,
-    isotropic,
-    Reactor,
     Cylinder,
     Box,
     Scene,
@@ -22,14 +16,12 @@ from meshcat.animation import Animation, AnimationFrameVisualizer
 import meshcat
 
 from miniplant.scene_creator import (
-    LR305_ABS_DATAFILE,
-    LR305_EMS_DATAFILE,
     PMMA_RI,
-    MB_ABS_DATAFILE,
     INCH,
     PFA_RI,
     ACN_RI,
 )
+from miniplant.spectral_data import get_luminophore, get_reactor_material
 from miniplant.utils import MyLight, IsotropicPhotonGenerator
 
 
@@ -57,16 +49,7 @@ light_source = Node(
 # LSC-PM matrix
 matrix_component = [
     Absorber(coefficient=0.1),  # PMMA background absorption
-    Luminophore(
-        coefficient=pd.read_csv(
-            io.BytesIO(LR305_ABS_DATAFILE), encoding="utf8", sep="\t"
-        ).values,
-        emission=pd.read_csv(
-            io.BytesIO(LR305_EMS_DATAFILE), encoding="utf8", sep="\t"
-        ).values,
-        quantum_yield=0.95,
-        phase_function=isotropic,
-    ),
+    get_luminophore(),
 ]
 
 # LSC object
@@ -91,10 +74,7 @@ capillary = []
 r_mix = []
 
 # Reaction Mixture absorption
-reaction_absorption_coefficient = pd.read_csv(
-    io.BytesIO(MB_ABS_DATAFILE), encoding="utf8", sep="\t"
-).values
-reaction_mixture_material = Reactor(reaction_absorption_coefficient)
+reaction_mixture_material = get_reactor_material()
 
 # Create PFA 1/8" capillaries and their reaction mixture
 for capillary_num in range(16):
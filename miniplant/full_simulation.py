@@ -5,6 +5,7 @@ Output in Einstein absorbed.
 
 import time
 import logging
+import functools
 from pathlib import Path
 from tqdm import tqdm
 
@@ -24,25 +25,305 @@ from tqdm import tqdm
 # )  # use logging.DEBUG for more printouts
 
 
-import numpy as np
-
+import pandas as pd
 from pvlib.location import Location
 
-from miniplant.scene_creator import REACTOR_AREA_IN_M2
-from miniplant.simulation_runner import run_direct_simulation, run_diffuse_simulation
+from miniplant.angular_response import AngularResponseTable
+from miniplant.checkpoint import (
+    CHECKPOINT_ROWS,
+    remove_checkpoint,
+    run_with_checkpoints,
+)
+from miniplant.diffuse_response import build_diffuse_response, diffuse_efficiency
+from miniplant.result_writer import ResultWriter, write_in_chunks
+from miniplant.scene_creator import NUM_CAPILLARIES, REACTOR_AREA_IN_M2
+from miniplant.simulation_pool import SimulationPool, pool_for_run
+from miniplant.simulation_result import LOSS_EVENTS, SimulationResult
+from miniplant.simulation_runner import (
+    run_adaptive_simulation,
+    run_combined_simulation,
+    run_direct_simulation,
+    run_diffuse_simulation,
+    split_photon_budget,
+)
 from miniplant.solar_data import solar_data_for_place_and_time
+from miniplant.spectral_efficiency import SpectralEfficiency
+from miniplant.spectral_series import SpectralSeries
 
 logger = logging.getLogger("pvtrace").getChild("miniplant")
 
 
-class PhotonFactory:
-    """Create a callable sampling the current solar spectrum"""
+# Optional groups of result columns for each ray-traced light source, see source_columns()
+EXTRA_COLUMNS = ("uncertainty", "losses", "capillaries")
+
+
+def source_columns(kind: str, extra_columns=()) -> list[str]:
+    """
+    Optional result columns of a ray-traced light source (e.g. "direct"), for the given groups of EXTRA_COLUMNS:
+    "uncertainty" for the photons traced and the uncertainties on the fraction and amount reacted, "losses" for the
+    fraction of photons lost per final event (see simulation_result.LOSS_EVENTS) and "capillaries" for the number of
+    photons absorbed by each capillary. They all come from the same photons, at no extra tracing cost.
+    """
+    columns = []
+    if "uncertainty" in extra_columns:
+        columns += [
+            f"{kind}_photons",
+            f"simulation_{kind}_uncertainty",
+            f"{kind}_reacted_uncertainty",
+        ]
+    if "losses" in extra_columns:
+        columns += [f"{kind}_{event.name.lower()}_fraction" for event in LOSS_EVENTS]
+    if "capillaries" in extra_columns:
+        columns += [
+            f"{kind}_capillary_{capillary}" for capillary in range(NUM_CAPILLARIES)
+        ]
+    return columns
+
+
+def _source_values(
+    kind: str, result: SimulationResult, irradiance: float, extra_columns=()
+) -> dict:
+    """Fraction reacted of a ray-traced light source and its optional columns (see source_columns())"""
+    values = {f"simulation_{kind}": result.reacted_fraction}
+    if "uncertainty" in extra_columns:
+        values[f"{kind}_photons"] = result.num_photons
+        values[f"simulation_{kind}_uncertainty"] = result.reacted_uncertainty
+        values[f"{kind}_reacted_uncertainty"] = (
+            result.reacted_uncertainty * irradiance * REACTOR_AREA_IN_M2
+        )
+    if "losses" in extra_columns:
+        for event, fraction in result.event_fractions().items():
+            values[f"{kind}_{event}_fraction"] = fraction
+    if "capillaries" in extra_columns:
+        for capillary, count in enumerate(result.capillary_counts()):
+            values[f"{kind}_capillary_{capillary}"] = count
+    return values
+
+
+def result_columns(
+    traced_sources, include_ground: bool = False, extra_columns=()
+) -> list[str]:
+    """Columns saved by yearlong_simulation(): the same as ever, plus the optional ones of each traced light source"""
+    columns = [
+        "apparent_elevation",
+        "azimuth",
+        "simulation_direct",
+        "direct_reacted",
+        "simulation_diffuse",
+        "diffuse_reacted",
+    ]
+    if include_ground:
+        columns += ["simulation_ground", "ground_reacted"]
+    for kind in traced_sources:
+        columns += source_columns(kind, extra_columns)
+    return columns
+
+
+def _trace_light_sources(
+    light_sources: dict,
+    irradiances: dict,
+    photons: dict,
+    tilt_angle: int,
+    include_dye: bool,
+    workers: int = 1,
+    pool: SimulationPool = None,
+    single_pass: bool = False,
+    target_uncertainty: float = None,
+    batch_photons: int = None,
+    max_photons: int = None,
+) -> dict[str, SimulationResult]:
+    """
+    Trace the light sources of a time point, each with its number of photons (sources without photons are not traced)
+    or adaptively with a target_uncertainty, see calculate_productivity_for_datapoint().
+
+    :return: the SimulationResult of each light source
+    """
+    simulation_options = dict(
+        tilt_angle=tilt_angle, workers=workers, pool=pool, include_dye=include_dye
+    )
+    if target_uncertainty is not None:
+        return run_adaptive_simulation(
+            light_sources,
+            weights={
+                kind: irradiance * REACTOR_AREA_IN_M2
+                for kind, irradiance in irradiances.items()
+            },
+            target_uncertainty=target_uncertainty,
+            batch_photons=batch_photons,
+            max_photons=max_photons,
+            **simulation_options,
+        )
+    if single_pass and light_sources:
+        return run_combined_simulation(
+            light_sources,
+            irradiances=irradiances,
+            num_photons=sum(photons.values()),
+            full_result=True,
+            **simulation_options,
+        )
+
+    results = {kind: SimulationResult() for kind in light_sources}
+    for kind, light_source in light_sources.items():
+        if not photons[kind]:
+            continue
+        if kind == "direct":
+            result = run_direct_simulation(
+                num_photons=photons[kind],
+                full_result=True,
+                **light_source,
+                **simulation_options,
+            )
+        elif kind == "diffuse":
+            result = run_diffuse_simulation(
+                num_photons=photons[kind],
+                full_result=True,
+                **light_source,
+                **simulation_options,
+            )
+        else:
+            # Other light sources (i.e. ground-reflected) only have a combined simulation
+            result = run_combined_simulation(
+                {kind: light_source},
+                irradiances={kind: irradiances[kind]},
+                num_photons=photons[kind],
+                full_result=True,
+                **simulation_options,
+            )[kind]
+        results[kind] += result
+    return results
+
+
+def calculate_productivity_for_datapoint(
+    df,
+    tilt_angle: int,
+    num_photons_per_simulation: int,
+    include_dye: bool,
+    workers: int = 1,
+    pool: SimulationPool = None,
+    direct_spectrum: SpectralSeries = None,
+    diffuse_spectrum: SpectralSeries = None,
+    trace_direct: bool = True,
+    trace_diffuse: bool = True,
+    ground_spectrum: SpectralSeries = None,
+    include_ground: bool = False,
+    single_pass: bool = False,
+    extra_columns=(),
+    target_uncertainty: float = None,
+    max_photons_per_timestep: int = None,
+):
+    """
+    This function is apply()ed to the dataframe to populate it with the simulation results.
+    It takes care of setting up the simulation, and fill in the relevant fields or it terminates early if the
+    simulation is not deemed necessary (solar position below horizon or invalid surface fraction)
+
+    Spectra default to those in the attrs of the solar data. Light sources not traced (trace_direct/trace_diffuse
+    False) keep the efficiency already in their simulation_* field. See yearlong_simulation() for the other options,
+    and source_columns() for the extra_columns groups.
+    """
+    logger.info(f"Current date/time {df.name}")
+    if trace_direct and direct_spectrum is None:
+        direct_spectrum = df.attrs["direct_spectrum"]
+    if trace_diffuse and diffuse_spectrum is None:
+        diffuse_spectrum = df.attrs["diffuse_spectrum"]
+    if include_ground and ground_spectrum is None:
+        ground_spectrum = df.attrs["ground_spectrum"]
+
+    # Light sources to be traced, with a function sampling their current spectrum
+    light_sources = {}
+    if trace_direct:
+        light_sources["direct"] = dict(
+            solar_elevation=df["apparent_elevation"],
+            solar_azimuth=df["azimuth"],
+            solar_spectrum_function=direct_spectrum.sampler(df.name),
+        )
+    if trace_diffuse:
+        light_sources["diffuse"] = dict(
+            solar_spectrum_function=diffuse_spectrum.sampler(df.name)
+        )
+    # No ground-reflected light on an horizontal reactor
+    if include_ground and df["ground_irradiance"] > 0:
+        light_sources["ground"] = dict(
+            solar_spectrum_function=ground_spectrum.sampler(df.name)
+        )
+
+    irradiances = {kind: df[f"{kind}_irradiance"] for kind in light_sources}
+    if "photon_budget" in df:
+        photons = split_photon_budget(int(df["photon_budget"]), irradiances)
+    else:
+        photons = {kind: num_photons_per_simulation for kind in light_sources}
+
+    if target_uncertainty is not None and max_photons_per_timestep is None:
+        max_photons_per_timestep = 10 * num_photons_per_simulation * len(light_sources)
+    results = _trace_light_sources(
+        light_sources,
+        irradiances,
+        photons,
+        tilt_angle=tilt_angle,
+        include_dye=include_dye,
+        workers=workers,
+        pool=pool,
+        single_pass=single_pass,
+        target_uncertainty=target_uncertainty,
+        batch_photons=num_photons_per_simulation,
+        max_photons=max_photons_per_timestep,
+    )
+
+    traced = {
+        "direct": trace_direct,
+        "diffuse": trace_diffuse,
+        "ground": include_ground,
+    }
+    for kind in (kind for kind, is_traced in traced.items() if is_traced):
+        # Sources without photons (e.g. no ground-reflected light) have empty results, i.e. all fractions are 0
+        result = results.get(kind, SimulationResult())
+        for column, value in _source_values(
+            kind, result, df[f"{kind}_irradiance"], extra_columns
+        ).items():
+            df[column] = value
+
+    df["direct_reacted"] = (
+        df["simulation_direct"] * df["direct_irradiance"] * REACTOR_AREA_IN_M2
+    )
+    df["diffuse_reacted"] = (
+        df["simulation_diffuse"] * df["diffuse_irradiance"] * REACTOR_AREA_IN_M2
+    )
+    if include_ground:
+        df["ground_reacted"] = (
+            df["simulation_ground"] * df["ground_irradiance"] * REACTOR_AREA_IN_M2
+        )
+
+    return df
+
 
-    def __init__(self, spectrum):
-        self.spectrum = spectrum
+def allocate_photon_budget(
+    solar_data: pd.DataFrame,
+    total_photons: int,
+    light_sources=("direct", "diffuse"),
+    min_photons: int = 10,
+) -> pd.Series:
+    """
+    Split a photon budget among time points proportionally to their expected contribution to the amount reacted.
 
-    def __call__(self, *args, **kwargs):
-        return self.spectrum.sample(np.random.uniform())
+    The expected contribution of a time point is the irradiance of the given light sources (times the reactor area).
+    Each time point with light gets at least min_photons, the rest of the budget is split proportionally (see
+    split_photon_budget()). Time points without light get no photons.
+
+    :return: number of photons for each time point (same index as solar_data)
+    """
+    weights = (
+        sum(solar_data[f"{kind}_irradiance"] for kind in light_sources)
+        * REACTOR_AREA_IN_M2
+    )
+    lit = weights > 0
+    extra_photons = total_photons - min_photons * lit.sum()
+    if extra_photons < 0:
+        raise ValueError(
+            f"A budget of {total_photons} photons is not enough for {lit.sum()} time points "
+            f"with at least {min_photons} photons each!"
+        )
+
+    budget = split_photon_budget(extra_photons, dict(enumerate(weights)))
+    return pd.Series(list(budget.values()), index=solar_data.index) + min_photons * lit
 
 
 def yearlong_simulation(
@@ -54,75 +335,197 @@ def yearlong_simulation(
     include_dye: bool = True,
     time_range=None,
     target_file=None,
+    pool: SimulationPool = None,
+    parallel_timesteps: bool = False,
+    angular_response: AngularResponseTable = None,
+    diffuse_response: SpectralEfficiency | bool = None,
+    include_ground: bool = False,
+    single_pass: bool = False,
+    extra_columns=(),
+    target_uncertainty: float = None,
+    max_photons_per_timestep: int = None,
+    total_photons: int = None,
+    min_photons_per_timestep: int = 10,
+    checkpoint_rows: int = None,
+    resume: bool = False,
+    stream_rows: int = None,
+    solar_data: pd.DataFrame = None,
 ):
-    logger.info(f"Starting simulation w/ tilt angle {tilt_angle}")
-
-    solar_data = solar_data_for_place_and_time(location, tilt_angle, time_resolution)
-    if time_range:
-        solar_data = solar_data.loc[time_range[0] : time_range[1]]
+    """
+    Simulate the reactor productivity over a year at the given location and tilt angle, results are saved as CSV.
 
-    def calculate_productivity_for_datapoint(df):
-        """
-        This function is apply()ed to the dataframe to populate it with the simulation results.
-        It takes care of setting up the simulation, and fill in the relevant fields or it terminates early if the
-        simulation is not deemed necessary (solar position below horizon or invalid surface fraction)
-        """
-        logger.info(f"Current date/time {df.name}")
-
-        # Create a function sampling the current solar spectrum
-        direct_photon_factory = PhotonFactory(df["direct_spectrum"])
-        diffuse_photon_factory = PhotonFactory(df["diffuse_spectrum"])
-
-        # Get the fraction of direct photon reacted
-        df["simulation_direct"] = run_direct_simulation(
-            tilt_angle=tilt_angle,
-            solar_azimuth=df["azimuth"],
-            solar_elevation=df["apparent_elevation"],
-            solar_spectrum_function=direct_photon_factory,
-            num_photons=num_photons_per_simulation,
-            workers=workers,
-            include_dye=include_dye,
+    :param time_range: (start, end) to only simulate that time range (see solar_data_for_place_and_time())
+    :param pool: SimulationPool to run on, otherwise one with workers workers is started (None means one per CPU)
+    :param parallel_timesteps: distribute whole timesteps to the pool workers, instead of the photons of each one
+    :param angular_response: AngularResponseTable to interpolate the direct light efficiency from, instead of tracing
+    :param diffuse_response: diffuse response to fold the diffuse light efficiency from (True builds or loads it)
+    :param include_ground: simulate the light reflected by the ground too
+    :param single_pass: trace all the light sources of a time point in a single scene (see run_combined_simulation())
+    :param extra_columns: optional groups of result columns to save, see source_columns()
+    :param target_uncertainty: trace photons adaptively until this uncertainty on the amount reacted per time point
+        (see run_adaptive_simulation()), the "uncertainty" columns are then saved too
+    :param total_photons: photon budget for the whole run, split by irradiance (see allocate_photon_budget())
+    :param checkpoint_rows: save a checkpoint every that many time points (see miniplant.checkpoint)
+    :param resume: skip the time points of a previous, interrupted, run with the same parameters
+    :param stream_rows: append the results to the target file (CSV or .h5) every that many time points instead
+    :param solar_data: precomputed solar data for this tilt angle (e.g. from solar_data_for_tilts())
+    """
+    if stream_rows is not None and checkpoint_rows is not None:
+        raise ValueError(
+            "Streamed results are their own checkpoint, do not set checkpoint_rows!"
         )
-        df["direct_reacted"] = (
-            df["simulation_direct"] * df["direct_irradiance"] * REACTOR_AREA_IN_M2
+    if target_uncertainty is not None and single_pass:
+        raise ValueError("Adaptive simulations cannot be run in a single pass!")
+    if target_uncertainty is not None and total_photons is not None:
+        raise ValueError("Adaptive simulations do not support a total photon budget!")
+    unknown_columns = set(extra_columns) - set(EXTRA_COLUMNS)
+    if unknown_columns:
+        raise ValueError(
+            f"Unknown extra columns {sorted(unknown_columns)}, choose from {EXTRA_COLUMNS}!"
         )
+    logger.info(f"Starting simulation w/ tilt angle {tilt_angle}")
 
-        # Get the fraction of diffuse photon reacted
-        df["simulation_diffuse"] = run_diffuse_simulation(
-            tilt_angle=tilt_angle,
-            solar_spectrum_function=diffuse_photon_factory,
-            num_photons=num_photons_per_simulation,
-            workers=workers,
-            include_dye=include_dye,
-        )
-        df["diffuse_reacted"] = (
-            df["simulation_diffuse"] * df["diffuse_irradiance"] * REACTOR_AREA_IN_M2
+    # Only the time points in time_range (start, end) are calculated, if given
+    start, end = time_range if time_range else (None, None)
+    if solar_data is None:
+        solar_data = solar_data_for_place_and_time(
+            location, tilt_angle, time_resolution, start=start, end=end
         )
+    else:
+        # Columns are added below, leave the provided data untouched (e.g. for other runs at the same tilt angle)
+        solar_data = solar_data.copy()
 
-        return df
+    trace_direct = angular_response is None
+    if not trace_direct:
+        angular_response.check_reactor_configuration(include_dye=include_dye)
+        solar_data["simulation_direct"] = angular_response.direct_efficiency(
+            solar_data, tilt_angle
+        )
 
-    start_time = time.time()
-    tqdm.pandas(desc=f"{location.name} {tilt_angle}deg")  # Shows nice progress bar
-    results = solar_data.progress_apply(calculate_productivity_for_datapoint, axis=1)
-    print(f"Simulation ended in {(time.time() - start_time) / 60:.1f} minutes!")
+    trace_diffuse = not diffuse_response
+    traced = {
+        "direct": trace_direct,
+        "diffuse": trace_diffuse,
+        "ground": include_ground,
+    }
+    traced_sources = [kind for kind, is_traced in traced.items() if is_traced]
+    if target_uncertainty is not None:
+        extra_columns = ("uncertainty", *extra_columns)
+    if total_photons is not None and traced_sources:
+        solar_data["photon_budget"] = allocate_photon_budget(
+            solar_data, total_photons, traced_sources, min_photons_per_timestep
+        )
 
     # Results will be saved in the following CSV file
     if not target_file:
         target_file = Path(
             f"full_simulation_results/{location.name}/{location.name}_{tilt_angle}deg_results.csv"
         )
-    target_file.parent.mkdir(parents=True, exist_ok=True)  # Ensure folder existence
-    results.to_csv(
-        target_file,
-        columns=(
-            "apparent_elevation",
-            "azimuth",
-            "simulation_direct",
-            "direct_reacted",
-            "simulation_diffuse",
-            "diffuse_reacted",
-        ),
-    )
+
+    columns = result_columns(traced_sources, include_ground, extra_columns)
+    if "photon_budget" in solar_data:
+        columns.append("photon_budget")
+
+    start_time = time.time()
+    progress_description = f"{location.name} {tilt_angle}deg"
+    with pool_for_run(pool, workers) as run_pool:
+        if diffuse_response is True:
+            diffuse_response = build_diffuse_response(
+                tilt_angle, include_dye=include_dye, workers=workers, pool=run_pool
+            )
+        if not trace_diffuse:
+            solar_data["simulation_diffuse"] = diffuse_efficiency(
+                diffuse_response, solar_data
+            )
+
+        if parallel_timesteps and run_pool is not None:
+            datapoint_function = functools.partial(
+                calculate_productivity_for_datapoint,
+                tilt_angle=tilt_angle,
+                num_photons_per_simulation=num_photons_per_simulation,
+                include_dye=include_dye,
+                trace_direct=trace_direct,
+                trace_diffuse=trace_diffuse,
+                include_ground=include_ground,
+                single_pass=single_pass,
+                extra_columns=extra_columns,
+                target_uncertainty=target_uncertainty,
+                max_photons_per_timestep=max_photons_per_timestep,
+            )
+            spectra = {
+                f"{kind}_spectrum": solar_data.attrs[f"{kind}_spectrum"]
+                for kind in ("direct", "diffuse", "ground")
+                if kind != "ground" or include_ground
+            }
+
+            def process(rows):
+                return run_pool.map_rows(
+                    datapoint_function,
+                    rows,
+                    desc=progress_description,
+                    spectra=spectra,
+                )
+
+        else:
+            tqdm.pandas(desc=progress_description)  # Shows nice progress bar
+
+            def process(rows):
+                return rows.progress_apply(
+                    calculate_productivity_for_datapoint,
+                    axis=1,
+                    tilt_angle=tilt_angle,
+                    num_photons_per_simulation=num_photons_per_simulation,
+                    include_dye=include_dye,
+                    workers=workers,
+                    pool=run_pool,
+                    trace_direct=trace_direct,
+                    trace_diffuse=trace_diffuse,
+                    include_ground=include_ground,
+                    single_pass=single_pass,
+                    extra_columns=extra_columns,
+                    target_uncertainty=target_uncertainty,
+                    max_photons_per_timestep=max_photons_per_timestep,
+                )
+
+        # Saved with the streamed results or checkpoints, only the same run is resumed
+        run_parameters = dict(
+            location=[location.name, location.latitude, location.longitude],
+            tilt_angle=tilt_angle,
+            time_resolution=time_resolution,
+            time_range=[str(start), str(end)],
+            num_photons_per_simulation=num_photons_per_simulation,
+            include_dye=bool(include_dye),
+            traced_sources=traced_sources,
+            single_pass=single_pass,
+            extra_columns=sorted(set(extra_columns)),
+            target_uncertainty=target_uncertainty,
+            max_photons_per_timestep=max_photons_per_timestep,
+            total_photons=total_photons,
+            min_photons_per_timestep=min_photons_per_timestep,
+        )
+        if stream_rows is not None:
+            with ResultWriter(
+                target_file, columns, resume=resume, parameters=run_parameters
+            ) as writer:
+                write_in_chunks(process, solar_data, writer, stream_rows)
+            results = None
+        elif checkpoint_rows is None and not resume:
+            results = process(solar_data)
+        else:
+            results = run_with_checkpoints(
+                process,
+                solar_data,
+                target_file,
+                run_parameters,
+                rows_per_checkpoint=checkpoint_rows or CHECKPOINT_ROWS,
+                resume=resume,
+            )
+    print(f"Simulation ended in {(time.time() - start_time) / 60:.1f} minutes!")
+
+    if results is not None:
+        target_file.parent.mkdir(parents=True, exist_ok=True)  # Ensure folder existence
+        results.to_csv(target_file, columns=columns)
+        remove_checkpoint(target_file)
 
 
 if __name__ == "__main__":
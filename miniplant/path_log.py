@@ -0,0 +1,128 @@
+"""
+Opt-in capture of photon paths, for debugging and analysis of the ray-tracing.
+
+Only a sample of the photons is kept (e.g. one every N, or the first K) and their path steps are streamed to an HDF5
+table as compact NumPy records, instead of keeping the full (Ray, Event) histories in memory. The log can then be read
+back, in full or in slices, with read_path_log() (or with any HDF5 tool: the table is /steps).
+"""
+import logging
+from pathlib import Path
+
+import numpy as np
+import tables
+
+logger = logging.getLogger("pvtrace").getChild("miniplant")
+
+# One record per path step: photon index (in tracing order), step number, event (pvtrace Event value), position,
+# direction and wavelength of the ray after the event
+PATH_STEP_DTYPE = np.dtype(
+    [
+        ("photon", np.int64),
+        ("step", np.int32),
+        ("event", np.int8),
+        ("position", np.float64, (3,)),
+        ("direction", np.float32, (3,)),
+        ("wavelength", np.float32),
+    ]
+)
+
+
+def path_steps(photon: int, history: list) -> np.ndarray:
+    """Records of a photon path, from its history (list of (Ray, Event) tuples, see follow())"""
+    steps = np.empty(len(history), dtype=PATH_STEP_DTYPE)
+    steps["photon"] = photon
+    steps["step"] = np.arange(len(history))
+    steps["event"] = [event.value for _, event in history]
+    steps["position"] = [ray.position for ray, _ in history]
+    steps["direction"] = [ray.direction for ray, _ in history]
+    steps["wavelength"] = [ray.wavelength for ray, _ in history]
+    return steps
+
+
+class PathLog:
+    """
+    Sampled photon paths, written to an HDF5 file while tracing.
+
+    Photons are numbered in tracing order over all the simulations using the same log. Use it as a context manager,
+    e.g.:
+
+        with PathLog("paths.h5", every=100) as path_log:
+            run_direct_simulation(..., path_log=path_log)
+    """
+
+    def __init__(
+        self,
+        path: str | Path,
+        every: int = 1,
+        first: int = None,
+        buffer_steps: int = 10000,
+    ):
+        """
+        :param path: HDF5 file to write (overwritten if existing)
+        :param every: keep one photon path every `every` photons
+        :param first: keep at most `first` photon paths (all the sampled ones if None)
+        :param buffer_steps: number of path steps kept in memory before writing them to disk
+        """
+        if every < 1:
+            raise ValueError(f"Path sampling interval must be positive, got {every}")
+
+        self.path = Path(path)
+        self.every = every
+        self.first = first
+        self.buffer_steps = buffer_steps
+        self.photons_seen = 0
+        self.photons_kept = 0
+        self._buffer = []
+        self._buffered_steps = 0
+        self._file = tables.open_file(self.path, mode="w")
+        self._table = self._file.create_table(
+            "/", "steps", description=PATH_STEP_DTYPE, title="Photon path steps"
+        )
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
+
+    def __repr__(self):
+        return f"PathLog({self.path}, {self.photons_kept}/{self.photons_seen} photons)"
+
+    def wants_next(self) -> bool:
+        """Whether the path of the next photon is going to be kept"""
+        if self.first is not None and self.photons_kept >= self.first:
+            return False
+        return self.photons_seen % self.every == 0
+
+    def add(self, history: list) -> None:
+        """Add a photon path (list of (Ray, Event) tuples), if sampled. Must be called for every photon traced."""
+        if self.wants_next():
+            self._buffer.append(path_steps(self.photons_seen, history))
+            self._buffered_steps += len(history)
+            self.photons_kept += 1
+            if self._buffered_steps >= self.buffer_steps:
+                self.flush()
+        self.photons_seen += 1
+
+    def flush(self) -> None:
+        """Write the buffered path steps to disk"""
+        if self._buffer:
+            self._table.append(np.concatenate(self._buffer))
+            self._table.flush()
+            self._buffer, self._buffered_steps = [], 0
+
+    def close(self) -> None:
+        """Write the remaining path steps and close the file"""
+        if not self._file.isopen:
+            return
+        self.flush()
+        self._table.attrs.every = self.every
+        self._table.attrs.photons_seen = self.photons_seen
+        self._file.close()
+        logger.debug(f"Saved {self.photons_kept} photon paths in {self.path}")
+
+
+def read_path_log(path: str | Path, start: int = None, stop: int = None) -> np.ndarray:
+    """Path steps (PATH_STEP_DTYPE records) saved by a PathLog, optionally only the rows from start to stop"""
+    with tables.open_file(path, mode="r") as file:
+        return file.root.steps.read(start, stop)
@@ -0,0 +1,99 @@
+"""
+Photon tracing keeping track of the node where each photon ends its path.
+
+follow() is the same algorithm as pvtrace.photon_tracer.follow(), but it also returns the node that absorbed the
+photon (its container at the time of the absorption event), so that absorbing surfaces (reaction mixture, PV cells...)
+can be tallied during the trace instead of with further intersection queries afterwards.
+"""
+import numpy as np
+
+from pvtrace import Event, Luminophore, Reactor, Scatterer, Scene
+from pvtrace.algorithm.photon_tracer import next_hit
+
+from miniplant.utils import emit_photons
+
+
+def follow(
+    scene: Scene, ray, maxsteps: int = 1000, maxpathlength=np.inf, emit_method="kT"
+) -> tuple[list, str | None]:
+    """
+    Trace a ray through the scene, as pvtrace.photon_tracer.follow()
+
+    :return: path history (list of (Ray, Event) tuples) and the name of the node that absorbed the photon (None if the
+        photon was not absorbed, e.g. it left the scene)
+    """
+    count = 0
+    history = [(ray, Event.GENERATE)]
+    while True:
+        count += 1
+        if count > maxsteps or ray.travelled > maxpathlength:
+            history.append((ray, Event.KILL))
+            return history, None
+
+        info = next_hit(scene, ray)
+        if info is None:
+            return history, None
+
+        hit, (container, adjacent), point, full_distance = info
+        if hit is scene.root:
+            history.append((ray.propagate(full_distance), Event.EXIT))
+            return history, None
+
+        material = container.geometry.material
+        absorbed, at_distance = material.is_absorbed(ray, full_distance)
+        if absorbed:
+            ray = ray.propagate(at_distance)
+            component = material.component(ray.wavelength)
+            if component.is_radiative(ray):
+                ray = component.emit(
+                    ray.representation(scene.root, container), method=emit_method
+                )
+                ray = ray.representation(container, scene.root)
+                if isinstance(component, Luminophore):
+                    event = Event.EMIT
+                elif isinstance(component, Scatterer):
+                    event = Event.SCATTER
+                history.append((ray, event))
+                continue
+
+            if isinstance(component, Reactor):
+                history.append((ray, Event.REACT))
+            else:
+                history.append((ray, Event.NONRADIATIVE))
+            return history, container.name
+
+        ray = ray.propagate(full_distance)
+        surface = hit.geometry.material.surface
+        ray = ray.representation(scene.root, hit)
+        if surface.is_reflected(ray, hit.geometry, container, adjacent):
+            ray = surface.reflect(ray, hit.geometry, container, adjacent)
+            event = Event.REFLECT
+        else:
+            ray = surface.transmit(ray, hit.geometry, container, adjacent)
+            event = Event.TRANSMIT
+        ray = ray.representation(hit, scene.root)
+        history.append((ray, event))
+
+
+def trace_photons(
+    scene: Scene, num_photons: int, renderer=None, path_log=None
+) -> tuple[np.ndarray, list, list]:
+    """
+    Trace num_photons photons emitted by the scene light sources
+
+    :param renderer: if given, each photon path is added to this MeshcatRenderer
+    :param path_log: if given, photon paths are added to this PathLog (which keeps only a sample of them)
+    :return: initial wavelength, final event and absorbing node name (see follow()) of each photon
+    """
+    wavelengths = np.empty(num_photons)
+    finals, nodes = [], []
+    for idx, ray in enumerate(emit_photons(scene, num_photons)):
+        wavelengths[idx] = ray.wavelength
+        history, node = follow(scene, ray)
+        finals.append(history[-1][1])
+        nodes.append(node)
+        if renderer is not None:
+            renderer.add_ray_path([step[0] for step in history])
+        if path_log is not None:
+            path_log.add(history)
+    return wavelengths, finals, nodes
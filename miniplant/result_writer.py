@@ -0,0 +1,164 @@
+"""
+Streaming writer of simulation results, appending the rows of each completed chunk of time points to the results file.
+
+Memory use stays flat for long runs (e.g. multi-year or 1-minute resolution), and partial results can be read (e.g.
+plotted) while the simulation is running. The results file doubles as checkpoint: a resumed run skips the time points
+already written. Results are saved as CSV or, for files with .h5 suffix, as an HDF5 table (key "results").
+The parameters of the run are saved with the results (in a JSON file next to a CSV), so that only the same run resumes.
+Once all the time points are written a marker file is saved next to the results, see is_complete().
+"""
+import json
+import logging
+import os
+from pathlib import Path
+from typing import Callable
+
+import pandas as pd
+
+# Default number of time points simulated before their results are written
+STREAM_ROWS = 100
+
+logger = logging.getLogger("pvtrace").getChild("miniplant")
+
+
+def parameters_file(path: Path) -> Path:
+    """JSON file with the run parameters of a CSV results file"""
+    path = Path(path)
+    return path.with_name(f"{path.name}.parameters.json")
+
+
+def complete_marker(path: Path) -> Path:
+    """Marker file saved next to a results file once all its time points are written"""
+    path = Path(path)
+    return path.with_name(f"{path.name}.complete")
+
+
+def is_complete(path: Path) -> bool:
+    """Whether the results file has all its time points, e.g. its run was not interrupted"""
+    return Path(path).exists() and complete_marker(path).exists()
+
+
+class ResultWriter:
+    """
+    Append-only results file. Use it as a context manager, e.g.:
+
+        with ResultWriter("results.csv", columns=["simulation_direct"]) as writer:
+            writer.append(results)
+    """
+
+    def __init__(
+        self,
+        path: str | Path,
+        columns: list[str],
+        resume: bool = False,
+        parameters: dict = None,
+    ):
+        """
+        :param path: results file, CSV or HDF5 (.h5 suffix)
+        :param columns: columns saved (and their order)
+        :param resume: keep the rows already in the file, otherwise the file is overwritten. The rows must come from
+            a run with the same parameters and columns, otherwise ValueError is raised.
+        :param parameters: parameters of the run (JSON-serializable dict), saved with the results
+        """
+        self.path = Path(path)
+        self.columns = list(columns)
+        # Compared with the saved ones after a JSON round trip (e.g. tuples become lists)
+        self.parameters = json.loads(
+            json.dumps(dict(parameters or {}, columns=self.columns))
+        )
+        self.is_hdf = self.path.suffix == ".h5"
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        # Until the run writes its last time points (see mark_complete())
+        complete_marker(self.path).unlink(missing_ok=True)
+        if not resume:
+            self.path.unlink(missing_ok=True)
+            parameters_file(self.path).unlink(missing_ok=True)
+        self._store = pd.HDFStore(self.path, mode="a") if self.is_hdf else None
+
+        if len(self.completed_index()) and self.saved_parameters() != self.parameters:
+            self.close()
+            raise ValueError(
+                f"Results {self.path} are from a run with different parameters, remove them to start over!"
+            )
+        if not self.is_hdf:
+            parameters_file(self.path).write_text(json.dumps(self.parameters))
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
+
+    def completed_index(self) -> pd.Index:
+        """Index (time points) of the rows already in the file"""
+        if self.is_hdf:
+            if "results" not in self._store:
+                return pd.Index([])
+            return pd.Index(self._store.select_column("results", "index"))
+        if not self.path.exists() or self.path.stat().st_size == 0:
+            return pd.Index([])
+        # Time points with different UTC offsets (e.g. summer time) are parsed in UTC
+        index = pd.read_csv(self.path, usecols=[0], index_col=0).index
+        return pd.DatetimeIndex(pd.to_datetime(index, utc=True))
+
+    def saved_parameters(self) -> dict | None:
+        """Parameters of the run that wrote the file, None if unknown"""
+        if self.is_hdf:
+            if "results" not in self._store:
+                return None
+            return getattr(self._store.get_storer("results").attrs, "parameters", None)
+        if not parameters_file(self.path).exists():
+            return None
+        return json.loads(parameters_file(self.path).read_text())
+
+    def append(self, results: pd.DataFrame) -> None:
+        """Append the results rows, with a single write that is flushed to disk"""
+        if results.empty:
+            return
+        if self.is_hdf:
+            self._store.append(
+                "results", results[self.columns].astype(float), format="table"
+            )
+            self._store.get_storer("results").attrs.parameters = self.parameters
+            self._store.flush(fsync=True)
+            return
+
+        write_header = not self.path.exists() or self.path.stat().st_size == 0
+        text = results.to_csv(columns=self.columns, header=write_header)
+        with open(self.path, "a", newline="") as file:
+            file.write(text)
+            file.flush()
+            os.fsync(file.fileno())
+
+    def mark_complete(self) -> None:
+        """Mark the results as complete, once all the time points of the run are written (see is_complete())"""
+        complete_marker(self.path).touch()
+
+    def close(self) -> None:
+        if self._store is not None and self._store.is_open:
+            self._store.close()
+
+
+def write_in_chunks(
+    process: Callable[[pd.DataFrame], pd.DataFrame],
+    data: pd.DataFrame,
+    writer: ResultWriter,
+    rows_per_chunk: int = STREAM_ROWS,
+) -> None:
+    """
+    Process the time points in data in chunks and append the results of each of them to writer.
+
+    Time points already written (e.g. by an interrupted run, see ResultWriter resume) are skipped. Once all the time
+    points are written the results are marked as complete.
+
+    :param process: function returning the results for a DataFrame of time points, e.g. applying
+        calculate_productivity_for_datapoint() to its rows
+    """
+    completed = writer.completed_index()
+    if len(completed):
+        logger.info(f"Resuming {writer.path}: {len(completed)} time points completed")
+        data = data.loc[~data.index.isin(completed)]
+
+    for start in range(0, len(data), rows_per_chunk):
+        writer.append(process(data.iloc[start : start + rows_per_chunk]))
+    writer.mark_complete()
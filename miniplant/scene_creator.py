@@ -1,8 +1,8 @@
-import io
+import functools
+import inspect
 import logging
 from typing import Callable
 
-import pandas as pd
 import numpy as np
 
 from pvtrace import (
@@ -10,36 +10,23 @@ from pvtrace import (
     Box,
     Sphere,
     Material,
-    Luminophore,
     Absorber,
     Cylinder,
-    Reactor,
-    Light,
     Scene,
 )
-from pvtrace import isotropic
-from pvtrace.material.utils import spherical_to_cart
 
 # Experimental data
+from miniplant.spectral_data import get_luminophore, get_reactor_material
 from miniplant.utils import (
     MyLight,
-    VectorInverter,
-    LightPosition,
+    DirectPhotonGenerator,
+    GroundReflectedPhotonGenerator,
     IsotropicPhotonGenerator,
+    default_wavelength,
 )
 
-import pkgutil
-
 REACTOR_AREA_IN_M2 = 0.47 * 0.47
 
-MB_ABS_DATAFILE = pkgutil.get_data(__name__, "reactor_data/MB_1M_1m_ACN.tsv")
-LR305_ABS_DATAFILE = pkgutil.get_data(
-    __name__, "reactor_data/Evonik_lr305_normalized_to_1m.tsv"
-)
-LR305_EMS_DATAFILE = pkgutil.get_data(
-    __name__, "reactor_data/Evonik_lr305_normalized_to_1m_ems.tsv"
-)
-
 # Refractive indexes
 PMMA_RI = 1.48
 PFA_RI = 1.34
@@ -48,10 +35,18 @@ ACN_RI = 1.344
 # Units
 INCH = 0.0254  # meters
 
+# Capillaries in the reactor, the reaction mixture node of each is named f"{REACTION_MIXTURE_NODE}{capillary number}"
+NUM_CAPILLARIES = 16
+REACTION_MIXTURE_NODE = "Reaction_mixture_"
 
-def _create_scene_common(tilt_angle, light_source, include_dye=None, **kwargs) -> Scene:
+# Kinds of light sources, used as source tag of their rays (see ReactorSceneTemplate.light_node())
+LIGHT_SOURCES = ("direct", "diffuse", "ground")
+
+
+def _create_reactor_geometry(tilt_angle, include_dye=None, **kwargs) -> Node:
+    """Create the world node with the (tilted) LSC-PM reactor and its capillaries, but no light source"""
     logger = logging.getLogger("pvtrace").getChild("miniplant")
-    logger.debug(f"Creating simulation scene w/ angle={tilt_angle}deg...")
+    logger.debug(f"Creating reactor geometry w/ angle={tilt_angle}deg...")
 
     # Add nodes to the scene graph
     # Let's start with world - i.e. outer bounds
@@ -60,9 +55,6 @@ def _create_scene_common(tilt_angle, light_source, include_dye=None, **kwargs) -
         geometry=Sphere(radius=10.0, material=Material(refractive_index=1.0)),
     )
 
-    # Bind the light source to the current world
-    light_source.parent = world
-
     # LSC-PM matrix
     matrix_component = [Absorber(coefficient=0.1)]  # PMMA background absorption
 
@@ -71,15 +63,9 @@ def _create_scene_common(tilt_angle, light_source, include_dye=None, **kwargs) -
 
     if include_dye:
         matrix_component.append(
-            Luminophore(
-                coefficient=pd.read_csv(
-                    io.BytesIO(LR305_ABS_DATAFILE), encoding="utf8", sep="\t"
-                ).values,
-                emission=pd.read_csv(
-                    io.BytesIO(LR305_EMS_DATAFILE), encoding="utf8", sep="\t"
-                ).values,
-                quantum_yield=0.95,
-                phase_function=isotropic,
+            get_luminophore(
+                absorption=kwargs.get("dye_absorption", "LR305_ABS"),
+                emission=kwargs.get("dye_emission", "LR305_EMS"),
             )
         )
 
@@ -210,10 +196,9 @@ def _create_scene_common(tilt_angle, light_source, include_dye=None, **kwargs) -
     r_mix = []
 
     # Reaction Mixture absorption
-    reaction_absorption_coefficient = pd.read_csv(
-        io.BytesIO(MB_ABS_DATAFILE), encoding="utf8", sep="\t"
-    ).values
-    reaction_mixture_material = Reactor(reaction_absorption_coefficient)
+    reaction_mixture_material = get_reactor_material(
+        absorption=kwargs.get("reactant_absorption", "MB_ABS")
+    )
 
     # Create PFA 1/8" capillaries and their reaction mixture
     pfa_cil = Cylinder(
@@ -228,7 +213,7 @@ def _create_scene_common(tilt_angle, light_source, include_dye=None, **kwargs) -
     pfa_cil.transparency = True
     pfa_cil.opacity = 0.5
 
-    for capillary_num in range(16):
+    for capillary_num in range(NUM_CAPILLARIES):
         capillary.append(
             Node(
                 name=f"Capillary_PFA_{capillary_num}",
@@ -250,7 +235,7 @@ def _create_scene_common(tilt_angle, light_source, include_dye=None, **kwargs) -
 
         r_mix.append(
             Node(
-                name=f"Reaction_mixture_{capillary_num}",
+                name=f"{REACTION_MIXTURE_NODE}{capillary_num}",
                 geometry=reaction_cil,
                 parent=capillary[-1],
             )
@@ -271,61 +256,248 @@ def _create_scene_common(tilt_angle, light_source, include_dye=None, **kwargs) -
         )
     )
 
-    return Scene(world)
+    return world
 
 
-def create_direct_scene(
-    tilt_angle: float = 30,
-    solar_elevation: float = 30,
-    solar_azimuth: float = 180,
-    solar_spectrum_function: Callable = lambda: 555,
+class ReactorSceneTemplate:
+    """
+    Reactor geometry built once and reused across simulations with different light sources.
+
+    The world, the LSC-PM and the capillaries do not depend on the solar position, so only the light nodes are
+    swapped when a new scene is requested. Note that the returned Scene object is always the same one: a scene
+    obtained from the template is only valid until the next light source is set.
+    """
+
+    def __init__(self, tilt_angle, include_dye=None, **kwargs):
+        self.tilt_angle = tilt_angle
+        self.world = _create_reactor_geometry(
+            tilt_angle, include_dye=include_dye, **kwargs
+        )
+        self.scene = Scene(self.world)
+        self._light_nodes = []
+
+    def scene_with_light(self, light_source: Node) -> Scene:
+        """Detach the previous light source (if any) and bind the given one to the template world"""
+        return self.scene_with_lights([light_source])
+
+    def scene_with_lights(self, light_sources: list[Node]) -> Scene:
+        """Detach the previous light sources (if any) and bind the given ones to the template world"""
+        for light_node in self._light_nodes:
+            light_node.parent = None
+        for light_node in light_sources:
+            light_node.parent = self.world
+        self._light_nodes = list(light_sources)
+        return self.scene
+
+    def light_node(self, kind: str, **light_kwargs) -> Node:
+        """
+        Light source of the given kind, its rays are tagged with the kind as source
+
+        :param kind: one of LIGHT_SOURCES, i.e. "direct", "diffuse" or "ground" (light reflected by the ground)
+        :param light_kwargs: light parameters, as accepted by direct_scene() for "direct" or diffuse_scene() otherwise
+        """
+        if kind == "direct":
+            return _direct_light_node(self.tilt_angle, name=kind, **light_kwargs)
+        if kind == "diffuse":
+            return _diffuse_light_node(self.tilt_angle, name=kind, **light_kwargs)
+        if kind == "ground":
+            return _ground_light_node(self.tilt_angle, name=kind, **light_kwargs)
+        raise ValueError(f"Unknown light source {kind}!")
+
+    def combined_scene(self, light_kwargs: dict[str, dict]) -> Scene:
+        """Scene with several light sources, given as {kind: light parameters} (see light_node())"""
+        return self.scene_with_lights(
+            [self.light_node(kind, **kwargs) for kind, kwargs in light_kwargs.items()]
+        )
+
+    def direct_scene(
+        self,
+        solar_elevation: float = 30,
+        solar_azimuth: float = 180,
+        solar_spectrum_function: Callable = default_wavelength,
+    ) -> Scene:
+        """Scene with a fixed light position and direction, to match direct irradiation"""
+        return self.scene_with_light(
+            _direct_light_node(
+                self.tilt_angle, solar_elevation, solar_azimuth, solar_spectrum_function
+            )
+        )
+
+    def diffuse_scene(
+        self, solar_spectrum_function: Callable = default_wavelength
+    ) -> Scene:
+        """Scene with a random light position, to match diffuse irradiation"""
+        return self.scene_with_light(
+            _diffuse_light_node(self.tilt_angle, solar_spectrum_function)
+        )
+
+    def ground_scene(
+        self, solar_spectrum_function: Callable = default_wavelength
+    ) -> Scene:
+        """Scene with a random light position below the horizon, to match ground-reflected irradiation"""
+        return self.scene_with_light(
+            _ground_light_node(self.tilt_angle, solar_spectrum_function)
+        )
+
+
+def get_scene_template(
+    tilt_angle: float,
     include_dye: bool = None,
-    **kwargs,
-) -> Scene:
-    """Create a scene with a fixed light position and direction, to match direct irradiation"""
+    add_bottom_PV: bool = False,
+    add_side_PV: bool = False,
+    dye_absorption: str = "LR305_ABS",
+    dye_emission: str = "LR305_EMS",
+    reactant_absorption: str = "MB_ABS",
+) -> ReactorSceneTemplate:
+    """
+    Return the (per-process) cached scene template for the given reactor configuration
+
+    Spectra are referred to by their name in the miniplant.spectral_data registry, see register_spectrum().
+    """
+    if include_dye is None:
+        include_dye = True
+    return _cached_scene_template(
+        tilt_angle,
+        bool(include_dye),
+        bool(add_bottom_PV),
+        bool(add_side_PV),
+        dye_absorption,
+        dye_emission,
+        reactant_absorption,
+    )
 
-    # Define rays direction based on solar position
-    solar_light_vector = spherical_to_cart(
-        np.deg2rad(-solar_elevation + 90), np.deg2rad(-solar_azimuth + 180)
+
+def reactor_configuration(**template_kwargs) -> dict:
+    """All the get_scene_template() parameters but the tilt angle, with their defaults for those not given"""
+    parameters = inspect.signature(get_scene_template).bind(None, **template_kwargs)
+    parameters.apply_defaults()
+    configuration = dict(parameters.arguments)
+    del configuration["tilt_angle"]
+    # The dye is included by default (include_dye=None)
+    configuration["include_dye"] = configuration["include_dye"] in (None, True)
+    return configuration
+
+
+# Reactor configurations whose template is kept (per process), e.g. a few tilt angles with and without dye
+SCENE_TEMPLATE_CACHE_SIZE = 8
+
+
+@functools.lru_cache(maxsize=SCENE_TEMPLATE_CACHE_SIZE)
+def _cached_scene_template(
+    tilt_angle,
+    include_dye,
+    add_bottom_PV,
+    add_side_PV,
+    dye_absorption,
+    dye_emission,
+    reactant_absorption,
+) -> ReactorSceneTemplate:
+    return ReactorSceneTemplate(
+        tilt_angle,
+        include_dye=include_dye,
+        add_bottom_PV=add_bottom_PV,
+        add_side_PV=add_side_PV,
+        dye_absorption=dye_absorption,
+        dye_emission=dye_emission,
+        reactant_absorption=reactant_absorption,
     )
 
-    reversed_solar_light_vector = VectorInverter(solar_light_vector)
 
-    # Create light
-    solar_light = Node(
+def _create_scene_common(tilt_angle, light_source, include_dye=None, **kwargs) -> Scene:
+    """Build a new scene from scratch (i.e. without template caching) with the given light source"""
+    template = ReactorSceneTemplate(tilt_angle, include_dye=include_dye, **kwargs)
+    return template.scene_with_light(light_source)
+
+
+def _direct_light_node(
+    tilt_angle: float,
+    solar_elevation: float = 30,
+    solar_azimuth: float = 180,
+    solar_spectrum_function: Callable = default_wavelength,
+    name: str = "Light",
+) -> Node:
+    """Light node with fixed direction, pointing from the solar position towards the reactor"""
+    return Node(
         name="Solar Light",
-        light=Light(
+        light=MyLight(
             wavelength=solar_spectrum_function,
-            direction=reversed_solar_light_vector,
-            position=LightPosition(tilt_angle=tilt_angle),
+            position_and_direction=DirectPhotonGenerator(
+                tilt_angle, solar_elevation, solar_azimuth
+            ),
+            name=name,
         ),
         parent=None,
     )
-    solar_light.translate(solar_light_vector)
-
-    return _create_scene_common(
-        tilt_angle=tilt_angle,
-        light_source=solar_light,
-        include_dye=include_dye,
-        **kwargs,
-    )
-
 
-def create_diffuse_scene(
-    tilt_angle: float = 30,
-    solar_spectrum_function: Callable = lambda: 555,
-    include_dye: bool = None,
-):
-    """Create a scene with a random light position, to match diffuse irradiation"""
 
-    solar_light = Node(
+def _diffuse_light_node(
+    tilt_angle: float,
+    solar_spectrum_function: Callable = default_wavelength,
+    name: str = "Light",
+) -> Node:
+    """Light node with random position and direction, hitting the reactor front face"""
+    return Node(
         name="Solar Light",
         light=MyLight(
             wavelength=solar_spectrum_function,
             position_and_direction=IsotropicPhotonGenerator(tilt_angle),
+            name=name,
         ),
         parent=None,
     )
-    return _create_scene_common(
-        tilt_angle=tilt_angle, light_source=solar_light, include_dye=include_dye
+
+
+def _ground_light_node(
+    tilt_angle: float,
+    solar_spectrum_function: Callable = default_wavelength,
+    name: str = "Light",
+) -> Node:
+    """Light node with random position and direction from below the horizon, hitting the reactor front face"""
+    return Node(
+        name="Ground Light",
+        light=MyLight(
+            wavelength=solar_spectrum_function,
+            position_and_direction=GroundReflectedPhotonGenerator(tilt_angle),
+            name=name,
+        ),
+        parent=None,
     )
+
+
+def create_direct_scene(
+    tilt_angle: float = 30,
+    solar_elevation: float = 30,
+    solar_azimuth: float = 180,
+    solar_spectrum_function: Callable = default_wavelength,
+    include_dye: bool = None,
+    **kwargs,
+) -> Scene:
+    """
+    Create a scene with a fixed light position and direction, to match direct irradiation
+
+    The reactor geometry is the cached one of get_scene_template(), with the light swapped in: each call returns a new
+    Scene object, but it is only valid until the next scene with the same reactor configuration is created.
+    """
+    template = get_scene_template(tilt_angle, include_dye, **kwargs)
+    template.direct_scene(
+        solar_elevation=solar_elevation,
+        solar_azimuth=solar_azimuth,
+        solar_spectrum_function=solar_spectrum_function,
+    )
+    return Scene(template.world)
+
+
+def create_diffuse_scene(
+    tilt_angle: float = 30,
+    solar_spectrum_function: Callable = default_wavelength,
+    include_dye: bool = None,
+    **kwargs,
+) -> Scene:
+    """
+    Create a scene with a random light position, to match diffuse irradiation
+
+    The reactor geometry is the cached one of get_scene_template(), see create_direct_scene().
+    """
+    template = get_scene_template(tilt_angle, include_dye, **kwargs)
+    template.diffuse_scene(solar_spectrum_function=solar_spectrum_function)
+    return Scene(template.world)
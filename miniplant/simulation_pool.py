@@ -0,0 +1,239 @@
+"""
+Long-lived process pool to run many small simulations (e.g. one per timestep) without spawning a new pool and pickling
+the whole scene every time. Each worker keeps its scene templates cached, so only light parameters and photon counts
+are sent with each task.
+"""
+import contextlib
+import logging
+import os
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+import pandas as pd
+from tqdm import tqdm
+
+from miniplant.photon_tracing import follow, trace_photons
+from miniplant.scene_creator import get_scene_template
+from miniplant.simulation_result import SimulationResult
+from miniplant.spectral_series import SpectralSeries
+from miniplant.utils import emit_photons_per_source
+
+logger = logging.getLogger("pvtrace").getChild("miniplant")
+
+
+def _init_worker():
+    """Workers forked from the same parent share its random state: reseed them to get independent photons"""
+    np.random.seed()
+
+
+def simulate_photons(
+    kind: str, num_photons: int, template_kwargs: dict, light_kwargs: dict
+) -> tuple[np.ndarray, list, list]:
+    """
+    Trace num_photons in the (process-cached) scene template. Used by pool workers, or directly for serial runs.
+
+    :return: initial wavelength, final event and absorbing node name of each photon, see trace_photons()
+    """
+    scene = get_scene_template(**template_kwargs).combined_scene({kind: light_kwargs})
+    return trace_photons(scene, num_photons)
+
+
+def simulate_sources(
+    photons_per_source: dict[str, int],
+    template_kwargs: dict,
+    light_kwargs: dict[str, dict],
+) -> dict[str, SimulationResult]:
+    """
+    Trace the photons of several light sources in a single scene (see ReactorSceneTemplate.combined_scene()).
+
+    :param photons_per_source: number of photons for each light source kind ("direct", "diffuse" or "ground")
+    :param template_kwargs: reactor configuration, as accepted by get_scene_template()
+    :param light_kwargs: light parameters for each light source kind
+    :return: simulation result for each light source kind
+    """
+    scene = get_scene_template(**template_kwargs).combined_scene(light_kwargs)
+
+    finals = {kind: [] for kind in light_kwargs}
+    nodes = {kind: [] for kind in light_kwargs}
+    for ray in emit_photons_per_source(scene, photons_per_source):
+        history, node = follow(scene, ray)
+        finals[ray.source].append(history[-1][1])
+        nodes[ray.source].append(node)
+    return {
+        kind: SimulationResult.from_photons(finals[kind], nodes[kind])
+        for kind in light_kwargs
+    }
+
+
+def _apply_to_rows(function, rows: pd.DataFrame, spectra: dict) -> list:
+    """Apply function to every row of a chunk, passing it the spectra of the chunk time points. Used by pool workers."""
+    return [function(row, **spectra) for _, row in rows.iterrows()]
+
+
+def _split_photons(num_photons: int, workers: int) -> list[int]:
+    """Photons per worker, as even as possible"""
+    return [
+        num_photons // workers + (1 if worker < num_photons % workers else 0)
+        for worker in range(workers)
+    ]
+
+
+class SimulationPool:
+    """
+    Pool of worker processes reused for all the simulations of a run.
+
+    Use it as a context manager, e.g.:
+
+        with SimulationPool(workers=12) as pool:
+            run_direct_simulation(..., pool=pool)
+    """
+
+    def __init__(self, workers: int = None):
+        self.workers = workers if workers else os.cpu_count()
+        self._executor = ProcessPoolExecutor(
+            max_workers=self.workers, initializer=_init_worker
+        )
+        logger.debug(f"Started simulation pool with {self.workers} workers")
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
+
+    def close(self):
+        """Terminate the worker processes"""
+        self._executor.shutdown()
+
+    def simulate(
+        self,
+        kind: str,
+        num_photons: int,
+        template_kwargs: dict,
+        light_kwargs: dict,
+        with_wavelengths: bool = False,
+    ):
+        """
+        Split the photons among the workers and return the combined SimulationResult
+
+        :param kind: light source kind, i.e. "direct", "diffuse" or "ground"
+        :param num_photons: total number of photons to trace
+        :param template_kwargs: reactor configuration, as accepted by get_scene_template()
+        :param light_kwargs: light source parameters, as accepted by ReactorSceneTemplate.direct_scene()/diffuse_scene()
+        :param with_wavelengths: return the initial wavelength and final event of each photon instead, as
+            (wavelengths, finals) tuple
+        """
+        chunks = _split_photons(num_photons, min(self.workers, num_photons))
+        futures = [
+            self._executor.submit(
+                simulate_photons, kind, chunk, template_kwargs, light_kwargs
+            )
+            for chunk in chunks
+        ]
+
+        wavelengths, finals, nodes = [], [], []
+        for future in futures:
+            chunk_wavelengths, chunk_finals, chunk_nodes = future.result()
+            wavelengths.append(chunk_wavelengths)
+            finals.extend(chunk_finals)
+            nodes.extend(chunk_nodes)
+
+        if with_wavelengths:
+            return np.concatenate(wavelengths) if wavelengths else np.empty(0), finals
+        return SimulationResult.from_photons(finals, nodes)
+
+    def simulate_sources(
+        self,
+        photons_per_source: dict[str, int],
+        template_kwargs: dict,
+        light_kwargs: dict[str, dict],
+    ) -> dict[str, SimulationResult]:
+        """
+        Split the photons of each light source among the workers, all the sources are traced in a single dispatch.
+        See simulate_sources() for parameters and return value.
+        """
+        total_photons = sum(photons_per_source.values())
+        workers = max(1, min(self.workers, total_photons))
+        chunks = {
+            kind: _split_photons(num_photons, workers)
+            for kind, num_photons in photons_per_source.items()
+        }
+        futures = [
+            self._executor.submit(
+                simulate_sources,
+                {kind: chunk[worker] for kind, chunk in chunks.items()},
+                template_kwargs,
+                light_kwargs,
+            )
+            for worker in range(workers)
+        ]
+
+        results = {kind: SimulationResult() for kind in light_kwargs}
+        for future in futures:
+            for kind, result in future.result().items():
+                results[kind] += result
+        return results
+
+    def map_rows(
+        self,
+        function,
+        dataframe: pd.DataFrame,
+        desc: str = None,
+        chunksize: int = None,
+        spectra: dict[str, SpectralSeries] = None,
+    ) -> pd.DataFrame:
+        """
+        Apply function to every row of dataframe on the pool workers (i.e. like DataFrame.apply with axis=1)
+
+        Rows are independent timesteps, so each of them is processed by a single worker. The function (and the rows)
+        must be picklable, e.g. a module-level function or a functools.partial of it. Results keep the row order.
+        Rows are sent without the DataFrame attrs.
+
+        :param spectra: keyword arguments of function with the spectra of the time points (e.g. direct_spectrum).
+            Each chunk of rows is sent with the spectra of its own time points only, not with those of the whole run.
+        """
+        if dataframe.empty:
+            return dataframe.copy()
+
+        if chunksize is None:
+            # A few chunks per worker, for load balancing while keeping IPC overhead low
+            chunksize = max(1, len(dataframe) // (self.workers * 4))
+        spectra = spectra or {}
+
+        # DataFrame.attrs (e.g. solar spectra) would be pickled with every chunk: only the needed spectra are sent
+        dataframe = dataframe.copy(deep=False)
+        dataframe.attrs = {}
+        futures = []
+        for start in range(0, len(dataframe), chunksize):
+            rows = dataframe.iloc[start : start + chunksize]
+            chunk_spectra = {
+                name: series.take([series.position(time) for time in rows.index])
+                for name, series in spectra.items()
+            }
+            futures.append(
+                self._executor.submit(_apply_to_rows, function, rows, chunk_spectra)
+            )
+
+        results = []
+        with tqdm(total=len(dataframe), desc=desc) as progress:
+            for future in futures:
+                chunk_results = future.result()
+                results.extend(chunk_results)
+                progress.update(len(chunk_results))
+
+        results = pd.DataFrame(results).infer_objects()
+        results.index.name = dataframe.index.name
+        return results
+
+
+@contextlib.contextmanager
+def pool_for_run(pool: SimulationPool = None, workers: int = None):
+    """
+    Yield the pool to be used for a run: the provided one, None for single-worker runs or a new one (closed at the end)
+    """
+    if pool is not None or workers == 1:
+        yield pool
+        return
+
+    with SimulationPool(workers) as new_pool:
+        yield new_pool
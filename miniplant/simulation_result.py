@@ -0,0 +1,135 @@
+"""
+Tallies of a simulation: photons per final event and per absorbing node, as counted while tracing.
+"""
+import collections
+import math
+
+from pvtrace import Event
+from scipy.stats import norm
+
+from miniplant.scene_creator import NUM_CAPILLARIES, REACTION_MIXTURE_NODE
+
+# Names of the PV nodes optionally added to the scene, see _create_reactor_geometry()
+BOTTOM_PV = "bottomPV"
+SIDE_PV = ("sidePV1", "sidePV2", "sidePV3", "sidePV4")
+
+# Final events of photons not reacted: escaped from the scene, absorbed without reaction, or traced for too long
+LOSS_EVENTS = (Event.EXIT, Event.NONRADIATIVE, Event.KILL)
+
+# Confidence level of the intervals on the photon fractions
+CONFIDENCE_LEVEL = 0.95
+
+
+class SimulationResult:
+    """
+    Number of photons traced, per final event (e.g. Event.REACT) and per absorbing node (by name).
+
+    Results of partial simulations (e.g. from different pool workers) are combined by adding them, so the result is the
+    same whatever the number of workers.
+    """
+
+    def __init__(self, num_photons: int = 0, events=None, nodes=None):
+        """
+        :param num_photons: number of photons traced
+        :param events: mapping final event -> number of photons
+        :param nodes: mapping absorbing node name -> number of photons absorbed there
+        """
+        self.num_photons = num_photons
+        self.events = collections.Counter(events or {})
+        self.nodes = collections.Counter(nodes or {})
+
+    @classmethod
+    def from_photons(cls, finals, nodes) -> "SimulationResult":
+        """Tally the final event and absorbing node (None if not absorbed) of each photon, see trace_photons()"""
+        return cls(
+            len(finals),
+            collections.Counter(finals),
+            collections.Counter(node for node in nodes if node is not None),
+        )
+
+    def __add__(self, other: "SimulationResult") -> "SimulationResult":
+        return SimulationResult(
+            self.num_photons + other.num_photons,
+            self.events + other.events,
+            self.nodes + other.nodes,
+        )
+
+    def __eq__(self, other):
+        if not isinstance(other, SimulationResult):
+            return NotImplemented
+        return (self.num_photons, self.events, self.nodes) == (
+            other.num_photons,
+            other.events,
+            other.nodes,
+        )
+
+    def __repr__(self):
+        events = ", ".join(
+            f"{event.name}={count}" for event, count in self.events.items()
+        )
+        return f"SimulationResult({self.num_photons} photons: {events})"
+
+    def fraction(self, event: Event) -> float:
+        """Fraction of the photons with the given final event (0 if no photons were traced)"""
+        return self.events[event] / self.num_photons if self.num_photons else 0.0
+
+    @property
+    def reacted_fraction(self) -> float:
+        """Fraction of the photons whose final event is a reaction"""
+        return self.fraction(Event.REACT)
+
+    def confidence_interval(
+        self, event: Event = Event.REACT, confidence: float = CONFIDENCE_LEVEL
+    ) -> tuple[float, float]:
+        """
+        Wilson score interval of the fraction of photons with the given final event, (0, 1) if no photons were traced.
+
+        Unlike the normal approximation it does not collapse to zero width when no (or all) photons react, e.g. with
+        few photons at low sun.
+        """
+        if not self.num_photons:
+            return 0.0, 1.0
+        z = norm.ppf(0.5 + confidence / 2)
+        n, p = self.num_photons, self.fraction(event)
+        center = (p + z**2 / (2 * n)) / (1 + z**2 / n)
+        half_width = (
+            z / (1 + z**2 / n) * math.sqrt(p * (1 - p) / n + z**2 / (4 * n**2))
+        )
+        return max(0.0, center - half_width), min(1.0, center + half_width)
+
+    def uncertainty(
+        self, event: Event = Event.REACT, confidence: float = CONFIDENCE_LEVEL
+    ) -> float:
+        """Half-width of the confidence interval of the fraction of photons with the given final event"""
+        low, high = self.confidence_interval(event, confidence)
+        return (high - low) / 2
+
+    @property
+    def reacted_uncertainty(self) -> float:
+        """Half-width of the confidence interval of the reacted fraction"""
+        return self.uncertainty(Event.REACT)
+
+    def event_fractions(self, events=LOSS_EVENTS) -> dict[str, float]:
+        """Fraction of the photons for each of the given final events, by (lowercase) event name"""
+        return {event.name.lower(): self.fraction(event) for event in events}
+
+    def capillary_counts(self) -> list[int]:
+        """Number of photons absorbed by the reaction mixture of each capillary"""
+        return [
+            self.nodes[f"{REACTION_MIXTURE_NODE}{capillary}"]
+            for capillary in range(NUM_CAPILLARIES)
+        ]
+
+    def absorbed_by(self, *node_names: str) -> int:
+        """Number of photons absorbed by any of the given nodes"""
+        return sum(self.nodes[name] for name in node_names)
+
+    @property
+    def bottom_pv_count(self) -> int:
+        """Photons absorbed by the bottom PV, if any (see add_bottom_PV in get_scene_template())"""
+        return self.absorbed_by(BOTTOM_PV)
+
+    @property
+    def side_pv_count(self) -> int:
+        """Photons absorbed by the side PVs, if any (see add_side_PV in get_scene_template())"""
+        return self.absorbed_by(*SIDE_PV)
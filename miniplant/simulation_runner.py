@@ -2,13 +2,26 @@
 Module to set up a scene to run a simulation in direct or diffuse conditions
 """
 import logging
-import collections
+import math
+
+import numpy as np
 
 from typing import Callable
 
-from pvtrace import photon_tracer, MeshcatRenderer, Event, Scene
+from pvtrace import MeshcatRenderer, Scene
 
-from miniplant.scene_creator import create_direct_scene, create_diffuse_scene
+from miniplant.path_log import PathLog
+from miniplant.photon_tracing import trace_photons
+from miniplant.scene_creator import get_scene_template
+from miniplant.simulation_pool import (
+    SimulationPool,
+    pool_for_run,
+    simulate_photons,
+    simulate_sources,
+)
+from miniplant.simulation_result import CONFIDENCE_LEVEL, SimulationResult
+from miniplant.spectral_efficiency import WAVELENGTH_BINS, SpectralEfficiency
+from miniplant.utils import SpectrumSampler, default_wavelength
 
 logger = logging.getLogger("pvtrace").getChild("miniplant")
 
@@ -17,111 +30,343 @@ def _common_simulation_runner(
     scene: Scene,
     num_photons: int = 100,
     render: bool = False,
-    workers: int = 1,
-):
+    path_log: PathLog = None,
+) -> SimulationResult:
+    """Trace the photons of the scene in this process, optionally rendering and/or logging their paths"""
     logger.debug(
         f"Starting ray-tracing with {num_photons} photons (Render is {render})"
     )
 
-    if render and workers > 1:
+    renderer = None
+    if render:
+        renderer = MeshcatRenderer(open_browser=True)
+        renderer.render(scene)
+
+    _, finals, nodes = trace_photons(
+        scene, num_photons, renderer=renderer, path_log=path_log
+    )
+    return SimulationResult.from_photons(finals, nodes)
+
+
+def _run_simulation(
+    kind: str,
+    template_kwargs: dict,
+    light_kwargs: dict,
+    num_photons: int,
+    render: bool,
+    workers: int,
+    pool: SimulationPool,
+    full_result: bool,
+    path_log: PathLog = None,
+):
+    """
+    Run a simulation with a single light source, in this process or on a pool (the provided one, or a new one with
+    workers workers): the same photon tallies are collected in both cases.
+    """
+    if render and (pool is not None or workers != 1):
         raise RuntimeError("Sorry, cannot use renderer if more than 1 worker is used!")
+    if path_log is not None and (pool is not None or workers != 1):
+        raise RuntimeError(
+            "Sorry, cannot log photon paths if more than 1 worker is used!"
+        )
 
-    bottomPV_count = 0
-    sidePV_count = 0
-    photon_path = []
-    # SINGLE-THREADED
-    if workers == 1:
-        if render:
-            renderer = MeshcatRenderer(open_browser=True)
-            renderer.render(scene)
-        finals = []
-        for ray in scene.emit(num_photons):
-            steps = photon_tracer.follow(scene, ray)
-            path, events = zip(*steps)
-            finals.append(events[-1])
-            if render:
-                renderer.add_ray_path(path)
-
-            from pvtrace.algorithm.photon_tracer import next_hit
-
-            myray = steps[-1][0]
-            intersect = next_hit(scene, myray)
-            side_PV = {"sidePV1", "sidePV2", "sidePV3", "sidePV4"}
-            if intersect and intersect[0].name == "bottomPV":
-                bottomPV_count += 1
-            if intersect and intersect[0].name in side_PV:
-                sidePV_count += 1
-
-            photon_path.append(path)
-    else:
-        if render:
-            logger.warning(
-                "Cannot use renderer in multi-threaded simulations! Set workers to 1 for single-theaded"
+    with pool_for_run(pool, workers) as run_pool:
+        if run_pool is None:
+            scene = get_scene_template(**template_kwargs).combined_scene(
+                {kind: light_kwargs}
             )
-        # MULTI-THREADED
-        results = scene.simulate(num_rays=num_photons, workers=workers)
-        finals = [photon[-1][1] for photon in results]
-
-    count_events = collections.Counter(finals)
-    reacted_fraction = count_events[Event.REACT] / num_photons
-    logger.debug(f"*** SIMULATION ENDED *** (Efficiency was {reacted_fraction:.3f})")
-    if bottomPV_count > 0:
+            result = _common_simulation_runner(scene, num_photons, render, path_log)
+        else:
+            logger.debug(
+                f"Starting ray-tracing with {num_photons} photons on a simulation pool"
+            )
+            result = run_pool.simulate(kind, num_photons, template_kwargs, light_kwargs)
+
+    logger.debug(
+        f"*** SIMULATION ENDED *** (Efficiency was {result.reacted_fraction:.3f})"
+    )
+    if result.bottom_pv_count > 0:
         logger.info(
-            f"Bottom PV absorbed {bottomPV_count} photons (i.e. {bottomPV_count/num_photons * 100 :.2f} %) "
+            f"Bottom PV absorbed {result.bottom_pv_count} photons "
+            f"(i.e. {result.bottom_pv_count/num_photons * 100 :.2f} %) "
         )
-    if sidePV_count > 0:
+    if result.side_pv_count > 0:
         logger.info(
-            f"The side PV absorbed {sidePV_count} photons (i.e. {sidePV_count / num_photons * 100 :.2f} %) "
+            f"The side PV absorbed {result.side_pv_count} photons "
+            f"(i.e. {result.side_pv_count / num_photons * 100 :.2f} %) "
         )
 
-    # This polymorphism in return type is bad, but the PV thing is only needed once and returning a list breaks things
-    if bottomPV_count > 0 or sidePV_count > 0:
-        return reacted_fraction, scene, photon_path, bottomPV_count, sidePV_count
-    return reacted_fraction
+    return result if full_result else result.reacted_fraction
 
 
 def run_direct_simulation(
     tilt_angle: int = 0,
     solar_elevation: int = 30,
     solar_azimuth: int = 180,
-    solar_spectrum_function: Callable = lambda: 555,
+    solar_spectrum_function: Callable = default_wavelength,
     num_photons: int = 100,
     render: bool = False,
     workers: int = 1,
     include_dye: bool = None,
+    pool: SimulationPool = None,
+    full_result: bool = False,
+    path_log: PathLog = None,
     **kwargs,
 ):
     """
     Create a scene for direct irradiation with the provided parameters and runs a simulation on it
+
+    If a SimulationPool is provided the simulation runs on its (persistent) workers and `workers` is ignored.
+    Returns the fraction of photons reacted, or the SimulationResult (counts per final event and absorbing node, e.g.
+    the PV cells added with add_bottom_PV/add_side_PV) with full_result=True.
+    Photon paths are saved only if a PathLog is provided (single-worker runs only), see miniplant.path_log.
     """
-    scene = create_direct_scene(
-        tilt_angle=tilt_angle,
-        solar_elevation=solar_elevation,
-        solar_azimuth=solar_azimuth,
-        solar_spectrum_function=solar_spectrum_function,
-        include_dye=include_dye,
-        **kwargs,
+    return _run_simulation(
+        "direct",
+        template_kwargs=dict(tilt_angle=tilt_angle, include_dye=include_dye, **kwargs),
+        light_kwargs=dict(
+            solar_elevation=solar_elevation,
+            solar_azimuth=solar_azimuth,
+            solar_spectrum_function=solar_spectrum_function,
+        ),
+        num_photons=num_photons,
+        render=render,
+        workers=workers,
+        pool=pool,
+        full_result=full_result,
+        path_log=path_log,
     )
-    return _common_simulation_runner(scene, num_photons, render, workers)
 
 
 def run_diffuse_simulation(
     tilt_angle: int = 0,
-    solar_spectrum_function: Callable = lambda: 555,
+    solar_spectrum_function: Callable = default_wavelength,
     num_photons: int = 100,
     render: bool = False,
     workers: int = 1,
     include_dye: bool = None,
+    pool: SimulationPool = None,
+    full_result: bool = False,
+    path_log: PathLog = None,
 ):
     """
     Create a scene for diffuse irradiation with the provided parameters and runs a simulation on it
+
+    If a SimulationPool is provided the simulation runs on its (persistent) workers and `workers` is ignored.
+    Returns the fraction of photons reacted, or the SimulationResult with full_result=True.
+    Photon paths are saved only if a PathLog is provided (single-worker runs only), see miniplant.path_log.
+    """
+    return _run_simulation(
+        "diffuse",
+        template_kwargs=dict(tilt_angle=tilt_angle, include_dye=include_dye),
+        light_kwargs=dict(solar_spectrum_function=solar_spectrum_function),
+        num_photons=num_photons,
+        render=render,
+        workers=workers,
+        pool=pool,
+        full_result=full_result,
+        path_log=path_log,
+    )
+
+
+def run_wavelength_resolved_simulation(
+    kind: str = "direct",
+    tilt_angle: int = 0,
+    solar_elevation: int = 30,
+    solar_azimuth: int = 180,
+    num_photons: int = 1000,
+    wavelength_bins=WAVELENGTH_BINS,
+    workers: int = 1,
+    include_dye: bool = None,
+    pool: SimulationPool = None,
+    **kwargs,
+) -> SpectralEfficiency:
+    """
+    Run a simulation with photons evenly spread over the wavelength bins and return the efficiency per bin.
+
+    The efficiency for any spectrum can then be calculated with SpectralEfficiency.fold(), without further ray-tracing.
+
+    :param kind: either "direct" (solar_elevation and solar_azimuth are used) or "diffuse"
+    :param wavelength_bins: wavelength bin edges in nm
+    :param kwargs: other reactor parameters, as accepted by get_scene_template()
+    """
+    wavelength_bins = np.asarray(wavelength_bins, dtype=float)
+    # Flat spectrum, with stratified sampling each bin gets (almost exactly) the same number of photons
+    broadband = SpectrumSampler((wavelength_bins[[0, -1]], np.ones(2)), stratified=True)
+    template_kwargs = dict(tilt_angle=tilt_angle, include_dye=include_dye, **kwargs)
+    if kind == "direct":
+        light_kwargs = dict(
+            solar_elevation=solar_elevation,
+            solar_azimuth=solar_azimuth,
+            solar_spectrum_function=broadband,
+        )
+    elif kind == "diffuse":
+        light_kwargs = dict(solar_spectrum_function=broadband)
+    else:
+        raise ValueError(f"Unknown simulation kind {kind}!")
+
+    logger.debug(f"Starting wavelength-resolved ray-tracing with {num_photons} photons")
+    with pool_for_run(pool, workers) as run_pool:
+        if run_pool is None:
+            wavelengths, finals, _ = simulate_photons(
+                kind, num_photons, template_kwargs, light_kwargs
+            )
+        else:
+            wavelengths, finals = run_pool.simulate(
+                kind, num_photons, template_kwargs, light_kwargs, with_wavelengths=True
+            )
+
+    return SpectralEfficiency.from_photons(wavelength_bins, wavelengths, finals)
+
+
+def split_photon_budget(
+    num_photons: int, irradiances: dict[str, float]
+) -> dict[str, int]:
+    """
+    Split num_photons among light sources proportionally to their irradiance (largest remainder method)
+
+    Each source with positive irradiance gets at least one photon (if num_photons allows), so that its efficiency can be
+    estimated. Sources without irradiance get no photons.
+    """
+    kinds = [kind for kind, irradiance in irradiances.items() if irradiance > 0]
+    budget = {kind: 0 for kind in irradiances}
+    if not kinds or num_photons <= 0:
+        return budget
+
+    weights = np.array([irradiances[kind] for kind in kinds], dtype=float)
+    shares = weights / weights.sum() * num_photons
+    photons = np.floor(shares).astype(int)
+    remainder = num_photons - photons.sum()
+    photons[np.argsort(np.floor(shares) - shares)[:remainder]] += 1
+    if num_photons >= len(kinds):
+        # Sources left without photons take them from the source with the most
+        for idx in np.flatnonzero(photons == 0):
+            photons[np.argmax(photons)] -= 1
+            photons[idx] = 1
+
+    budget.update(zip(kinds, photons.tolist(), strict=True))
+    return budget
+
+
+def run_combined_simulation(
+    light_sources: dict[str, dict],
+    irradiances: dict[str, float],
+    tilt_angle: int = 0,
+    num_photons: int = 300,
+    workers: int = 1,
+    include_dye: bool = None,
+    pool: SimulationPool = None,
+    full_result: bool = False,
+    **kwargs,
+) -> dict:
+    """
+    Trace several light sources (e.g. direct, diffuse and ground-reflected light) in a single scene and pass.
+
+    The photons are split among the sources proportionally to their irradiance, see split_photon_budget().
+
+    :param light_sources: light parameters for each light source kind ("direct", "diffuse" or "ground"), as accepted by
+        ReactorSceneTemplate.light_node()
+    :param irradiances: irradiance of each light source kind (any unit, only ratios are used)
+    :param num_photons: total number of photons traced
+    :param kwargs: other reactor parameters, as accepted by get_scene_template()
+    :return: fraction of photons reacted for each light source kind (0 for sources without photons), or their
+        SimulationResult with full_result=True
     """
-    scene = create_diffuse_scene(
-        tilt_angle=tilt_angle,
-        solar_spectrum_function=solar_spectrum_function,
-        include_dye=include_dye,
+    photons_per_source = split_photon_budget(
+        num_photons, {kind: irradiances.get(kind, 0) for kind in light_sources}
     )
-    return _common_simulation_runner(scene, num_photons, render, workers)
+    light_sources = {
+        kind: light_kwargs
+        for kind, light_kwargs in light_sources.items()
+        if photons_per_source[kind] > 0
+    }
+    template_kwargs = dict(tilt_angle=tilt_angle, include_dye=include_dye, **kwargs)
+
+    logger.debug(
+        f"Starting combined ray-tracing with {photons_per_source} photons per source"
+    )
+    with pool_for_run(pool, workers) as run_pool:
+        if run_pool is None:
+            results = simulate_sources(
+                photons_per_source, template_kwargs, light_sources
+            )
+        else:
+            results = run_pool.simulate_sources(
+                photons_per_source, template_kwargs, light_sources
+            )
+
+    results = {
+        kind: results.get(kind, SimulationResult()) for kind in photons_per_source
+    }
+    if full_result:
+        return results
+    return {kind: result.reacted_fraction for kind, result in results.items()}
+
+
+def run_adaptive_simulation(
+    light_sources: dict[str, dict],
+    weights: dict[str, float],
+    target_uncertainty: float,
+    tilt_angle: int = 0,
+    batch_photons: int = 100,
+    max_photons: int = 1000,
+    workers: int = 1,
+    include_dye: bool = None,
+    pool: SimulationPool = None,
+    confidence: float = CONFIDENCE_LEVEL,
+    **kwargs,
+) -> dict[str, SimulationResult]:
+    """
+    Trace light sources in batches of photons until the uncertainty on their weighted reacted fraction meets a target.
+
+    The uncertainty of each source is the half-width of the (Wilson) confidence interval on its reacted fraction, times
+    its weight (e.g. irradiance times reactor area, so that the uncertainty is on the amount reacted). The overall
+    uncertainty is their root sum of squares. Every source with a positive weight gets a first batch, then each batch
+    goes to the source with the largest weighted uncertainty, until the target or max_photons (in total) is reached.
+
+    :param light_sources: light parameters for each light source kind ("direct", "diffuse" or "ground"), as accepted by
+        ReactorSceneTemplate.light_node()
+    :param weights: weight of each light source kind, sources without weight are not traced
+    :param target_uncertainty: target overall uncertainty, in the units of the weights
+    :param kwargs: other reactor parameters, as accepted by get_scene_template()
+    :return: SimulationResult for each light source kind (empty for sources not traced)
+    """
+    results = {kind: SimulationResult() for kind in light_sources}
+    first_batches = [kind for kind in light_sources if weights.get(kind, 0) > 0]
+    traced = 0
+    with pool_for_run(pool, workers) as run_pool:
+        while traced < max_photons:
+            if first_batches:
+                kind = first_batches.pop(0)
+            else:
+                errors = {
+                    kind: weights[kind] * result.uncertainty(confidence=confidence)
+                    for kind, result in results.items()
+                    if result.num_photons
+                }
+                if math.sqrt(sum(error**2 for error in errors.values())) <= (
+                    target_uncertainty
+                ):
+                    break
+                kind = max(errors, key=errors.get)
+
+            photons = min(batch_photons, max_photons - traced)
+            results[kind] += run_combined_simulation(
+                {kind: light_sources[kind]},
+                irradiances={kind: 1},
+                tilt_angle=tilt_angle,
+                num_photons=photons,
+                workers=workers,
+                include_dye=include_dye,
+                pool=run_pool,
+                full_result=True,
+                **kwargs,
+            )[kind]
+            traced += photons
+
+    photons_per_source = {kind: result.num_photons for kind, result in results.items()}
+    logger.debug(f"Adaptive ray-tracing ended with {photons_per_source} photons")
+    return results
 
 
 if __name__ == "__main__":
@@ -133,10 +378,11 @@ if __name__ == "__main__":
         render=True,
         add_side_PV=True,
         num_photons=100,
+        full_result=True,
     )
 
-    bottom = res[-2]
-    side = res[-1]
+    bottom = res.bottom_pv_count
+    side = res.side_pv_count
     print(f"SIMU ENDED - bottom={bottom} side={side}")
 
     # run_direct_simulation(tilt_angle=10, render=True, workers=1, include_dye=True)
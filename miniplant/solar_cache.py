@@ -0,0 +1,108 @@
+"""
+On-disk cache (HDF5) of solar data, so that solar position and spectra are not recomputed for every simulation run.
+
+Each set of parameters (location, tilt angle, time resolution, atmosphere...) is stored in its own file, which is
+written under a temporary name and then atomically moved in place: concurrent readers never see partial files.
+The cache directory is $MINIPLANT_CACHE_DIR if set, ~/.cache/miniplant otherwise.
+"""
+import hashlib
+import json
+import logging
+import os
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+
+from miniplant.spectral_series import SpectralSeries
+
+# Increase when the content of the cached data changes, to invalidate old cache files
+CACHE_VERSION = 2
+
+logger = logging.getLogger("pvtrace").getChild("miniplant")
+
+
+def cache_dir() -> Path:
+    """Folder where cached solar data are stored"""
+    return Path(
+        os.environ.get("MINIPLANT_CACHE_DIR", Path.home() / ".cache" / "miniplant")
+    )
+
+
+def cache_file(
+    parameters: dict, prefix: str = "solar_data", suffix: str = ".h5"
+) -> Path:
+    """Cache file for the given parameters (JSON-serializable dict)"""
+    key = json.dumps({"version": CACHE_VERSION, **parameters}, sort_keys=True)
+    return (
+        cache_dir()
+        / f"{prefix}_{hashlib.sha256(key.encode()).hexdigest()[:24]}{suffix}"
+    )
+
+
+def _spectra_frame(spectral_series: SpectralSeries) -> pd.DataFrame:
+    return pd.DataFrame(
+        spectral_series.values,
+        index=spectral_series.index,
+        columns=spectral_series.wavelengths,
+    )
+
+
+def _spectra_from_frame(frame: pd.DataFrame) -> SpectralSeries:
+    return SpectralSeries(
+        frame.index,
+        frame.columns.to_numpy(dtype=float),
+        np.ascontiguousarray(frame.to_numpy(dtype=float)),
+    )
+
+
+def load_solar_data(
+    parameters: dict,
+) -> tuple[pd.DataFrame, SpectralSeries, SpectralSeries, SpectralSeries] | None:
+    """Return cached solar data, direct, diffuse and ground spectra for the given parameters, None if not cached"""
+    path = cache_file(parameters)
+    if not path.exists():
+        return None
+
+    try:
+        with pd.HDFStore(path, mode="r") as store:
+            if store.get_storer("solar_data").attrs.parameters != parameters:
+                logger.warning(f"Parameters mismatch in solar data cache file {path}")
+                return None
+            solar_data = store["solar_data"]
+            direct_spectrum = _spectra_from_frame(store["direct_spectrum"])
+            diffuse_spectrum = _spectra_from_frame(store["diffuse_spectrum"])
+            ground_spectrum = _spectra_from_frame(store["ground_spectrum"])
+    except (OSError, KeyError, AttributeError, ValueError) as exception:
+        logger.warning(f"Cannot read solar data cache file {path}: {exception}")
+        return None
+
+    logger.debug(f"Loaded solar data from cache file {path}")
+    return solar_data, direct_spectrum, diffuse_spectrum, ground_spectrum
+
+
+def store_solar_data(
+    parameters: dict,
+    solar_data: pd.DataFrame,
+    direct_spectrum: SpectralSeries,
+    diffuse_spectrum: SpectralSeries,
+    ground_spectrum: SpectralSeries,
+) -> None:
+    """Save solar data and spectra in the cache. Failures are logged and otherwise ignored."""
+    path = cache_file(parameters)
+    temporary_path = path.with_name(f"{path.stem}.{os.getpid()}.tmp")
+    try:
+        path.parent.mkdir(parents=True, exist_ok=True)
+        with pd.HDFStore(temporary_path, mode="w") as store:
+            store.put("solar_data", solar_data, format="fixed")
+            store.put("direct_spectrum", _spectra_frame(direct_spectrum))
+            store.put("diffuse_spectrum", _spectra_frame(diffuse_spectrum))
+            store.put("ground_spectrum", _spectra_frame(ground_spectrum))
+            store.get_storer("solar_data").attrs.parameters = parameters
+        os.replace(temporary_path, path)
+    except OSError as exception:
+        logger.warning(f"Cannot write solar data cache file {path}: {exception}")
+        temporary_path.unlink(missing_ok=True)
+        return
+
+    logger.debug(f"Saved solar data in cache file {path}")
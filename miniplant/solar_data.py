@@ -2,19 +2,19 @@
 Calculate solar irradiance and spectrum incident on reactor at given position/time/tilt
 """
 import datetime
+import functools
+import hashlib
 import logging
 
 import pandas as pd
 import numpy as np
-import scipy.integrate as integrate
-
-from pvtrace import Distribution
 
 from pvlib.location import Location
 from pvlib import spectrum, irradiance, atmosphere
 
 # assumptions
-from miniplant.utils import spectral_distribution_to_photon_distribution
+from miniplant import solar_cache
+from miniplant.spectral_series import SpectralSeries
 
 water_vapor_content = 0.5  # cm
 tau500 = 0.1
@@ -22,24 +22,76 @@ ozone = 0.31  # atm-cm
 albedo = 0.2
 
 
-def solar_data_for_place_and_time(
-    site: Location, tilt_angle: int, time_resolution: int = 1800
-) -> pd.DataFrame:
+# Wavelength range used in simulations (SPCTRL2 wavelengths 11-38, that is 360--690 nm)
+SIMULATION_WAVELENGTHS = slice(11, 38)
+
+# Number of time points per SPCTRL2 call, to limit memory use with fine time resolutions
+SPECTRL2_CHUNK_SIZE = 20000
+
+
+@functools.cache
+def simulation_wavelengths() -> np.ndarray:
+    """Wavelengths (nm) of the solar spectra used in simulations"""
+    wavelengths = spectrum.spectrl2(
+        0, 0, 0, albedo, 101325, 1, water_vapor_content, ozone, tau500, 1
+    )["wavelength"][SIMULATION_WAVELENGTHS]
+    wavelengths.setflags(write=False)
+    return wavelengths
+
+
+def time_points(
+    site: Location,
+    time_resolution: int = 1800,
+    start=None,
+    end=None,
+    times: pd.DatetimeIndex = None,
+) -> pd.DatetimeIndex:
     """
-    Given a Location object and a series of datetime points calculates relevant solar position and spectral distribution
+    Time points for solar data, in site local time: the given times or every time_resolution seconds from start to end
 
     :param site: pvlib.location.Location object
-    :param tilt_angle: reactor tilt angle, used to calculate angle of incidence
     :param time_resolution: time resolution for time points, in seconds. Default to 30 min.
-    :return: a pd.DataFrame with all the relevant results
+    :param start: first time point (inclusive), naive values are in site local time. Default to 1st Jan 2020.
+    :param end: last time point (inclusive), naive values are in site local time. Default to 1st Jan 2021.
+    :param times: explicit time points, instead of start -- end every time_resolution seconds
     """
-    # Create time points to simulate over a one-year period with the given time resolution
-    datetime_points = pd.date_range(
-        start=datetime.datetime(2020, 1, 1),
-        end=datetime.datetime(2021, 1, 1),
-        freq=f"{time_resolution}S",
-        tz=site.tz,
+    if times is not None:
+        times = pd.DatetimeIndex(times)
+        if times.tz is None:
+            return times.tz_localize(site.tz)
+        return times.tz_convert(site.tz)
+
+    start = pd.Timestamp(datetime.datetime(2020, 1, 1) if start is None else start)
+    end = pd.Timestamp(datetime.datetime(2021, 1, 1) if end is None else end)
+    start = (
+        start.tz_localize(site.tz) if start.tz is None else start.tz_convert(site.tz)
     )
+    end = end.tz_localize(site.tz) if end.tz is None else end.tz_convert(site.tz)
+    return pd.date_range(start=start, end=end, freq=f"{time_resolution}S")
+
+
+def solar_ephemeris(
+    site: Location,
+    time_resolution: int = 1800,
+    start=None,
+    end=None,
+    times: pd.DatetimeIndex = None,
+) -> pd.DataFrame:
+    """
+    Tilt-independent solar data: solar position, air mass and SPCTRL2 clear-sky spectra for the time points with the
+    sun above the horizon. Compute it once per site and use it with solar_spectra_for_tilts() for any tilt angle.
+
+    :param site: pvlib.location.Location object
+    :param time_resolution: time resolution for time points (and integration time of spectra), in seconds.
+    :param start: first time point (inclusive), naive values are in site local time. Default to 1st Jan 2020.
+    :param end: last time point (inclusive), naive values are in site local time. Default to 1st Jan 2021.
+    :param times: explicit time points, instead of start -- end every time_resolution seconds
+    :return: a pd.DataFrame with solar position and air mass. Direct normal, diffuse horizontal and extraterrestrial
+        spectra (W/m^2/nm, simulation wavelengths only) are stored as SpectralSeries in its attrs under the
+        "dni_spectrum", "dhi_spectrum" and "dni_extra_spectrum" keys, the time resolution under "time_resolution".
+    """
+    # Create time points to simulate (by default over a one-year period) with the given time resolution
+    datetime_points = time_points(site, time_resolution, start, end, times)
 
     # Pressure based on site altitude
     pressure = atmosphere.alt2pres(site.altitude)
@@ -51,83 +103,293 @@ def solar_data_for_place_and_time(
     relative_airmass: pd.DataFrame = site.get_airmass(
         times=datetime_points, solar_position=sol_pos
     )
-    solar_data = pd.concat([sol_pos, relative_airmass], axis=1)
-    # print(solar_data.columns)
+    ephemeris = pd.concat([sol_pos, relative_airmass], axis=1)
+    # print(ephemeris.columns)
     # ['apparent_zenith', 'zenith', 'apparent_elevation', 'elevation',
     #        'azimuth', 'equation_of_time', 'airmass_relative', 'airmass_absolute']
 
-    def calculate_spectrum(df):
-        """Calculate diffuse and direct spectra for every time point at the given location and tilt angle"""
-        df["aoi"] = irradiance.aoi(
-            surface_tilt=tilt_angle,
-            surface_azimuth=180,
-            solar_zenith=df["apparent_zenith"],
-            solar_azimuth=df["azimuth"],
-        )
+    # Filter date-time point where the sun is above the horizon. Guess why ;)
+    ephemeris.query("apparent_elevation>0", inplace=True)
 
-        # Use SPCTRAL2 model for irradiance on tilted surface
+    # SPCTRL2 clear-sky spectra, in chunks to limit memory use. The tilt and the angle of incidence only affect the
+    # plane of array values, that are calculated for each tilt angle in plane_of_array_spectra()
+    spectra = {"dni": [], "dhi": [], "dni_extra": []}
+    wavelengths = None
+    for chunk in range(0, len(ephemeris), SPECTRL2_CHUNK_SIZE):
+        rows = slice(chunk, chunk + SPECTRL2_CHUNK_SIZE)
         solar_spectrum = spectrum.spectrl2(
-            apparent_zenith=df["apparent_zenith"],
-            aoi=df["aoi"],
-            surface_tilt=tilt_angle,
+            apparent_zenith=ephemeris["apparent_zenith"].to_numpy()[rows],
+            aoi=0,
+            surface_tilt=0,
             ground_albedo=albedo,
             surface_pressure=pressure,
-            relative_airmass=df["airmass_relative"],
+            relative_airmass=ephemeris["airmass_relative"].to_numpy()[rows],
             precipitable_water=water_vapor_content,
             ozone=ozone,
             aerosol_turbidity_500nm=tau500,
-            dayofyear=df.name.dayofyear,
+            dayofyear=ephemeris.index.dayofyear.to_numpy()[rows],
         )
+        wavelengths = solar_spectrum["wavelength"][SIMULATION_WAVELENGTHS]
+        for component, values in spectra.items():
+            values.append(solar_spectrum[component][SIMULATION_WAVELENGTHS].T)
 
-        """
-        PoA (plane of array) values already correct for tilt angle. This means the following:
-        
-        * Direct component is essentially DNI * pvlib.irradiance.aoi_projection() [that is dot product of solar vector
-            and surface normal. If the sun is behind the array the result is negative, we will set that to 0 see below.
-        * Diffuse component is the dhi corrected with the Hay & Davies 1980 model for sky diffuse component
-        
-        NOTE: we are neglecting the ground diffuse component here! (I_tilt = I_beam + I_sky + I_ground)
-        """
-
-        # Add solar spectra for diffuse and direct to dataframe (trimmed to UV-VIS) [in particular 11-38 is 360--690 nm]
-        try:
-            direct = Distribution(
-                solar_spectrum["wavelength"][11:38],
-                np.squeeze(solar_spectrum["poa_direct"][11:38]),
-            )
-            diffuse = Distribution(
-                solar_spectrum["wavelength"][11:38],
-                np.squeeze(solar_spectrum["poa_sky_diffuse"][11:38]),
-            )
-        except ValueError:
-            # When the sun is behind the array the sign of AoI dot product becomes negative. We skip those time point ;)
-            return df
+    if wavelengths is None:  # No time points
+        wavelengths = simulation_wavelengths()
+        for values in spectra.values():
+            values.append(np.empty((0, len(wavelengths))))
 
-        df["direct_spectrum"] = spectral_distribution_to_photon_distribution(
-            direct, integration_time=time_resolution
-        )
-        df["diffuse_spectrum"] = spectral_distribution_to_photon_distribution(
-            diffuse, integration_time=time_resolution
+    for component, values in spectra.items():
+        ephemeris.attrs[f"{component}_spectrum"] = SpectralSeries(
+            ephemeris.index, wavelengths, np.concatenate(values)
         )
+    ephemeris.attrs["time_resolution"] = time_resolution
+
+    # Logging
+    logger = logging.getLogger("pvtrace").getChild("miniplant")
+    logger.info(
+        f"Generated solar data for {site.name} [lat. {site.latitude}, long. {site.longitude}] in the time range"
+        f" {datetime_points.min().isoformat()} -- {datetime_points.max().isoformat()}"
+    )
+
+    return ephemeris
+
+
+def plane_of_array_spectra(
+    ephemeris: pd.DataFrame, tilt_angle: int
+) -> tuple[np.ndarray, np.ndarray, np.ndarray, np.ndarray]:
+    """
+    Plane of array spectra on the reactor for the given tilt angle, exactly as SPCTRL2 calculates them.
+
+    * Direct component is DNI * pvlib.irradiance.aoi_projection() [that is dot product of solar vector and surface
+        normal]. If the sun is behind the array the result is negative, this is clipped to 0.
+    * Diffuse component is the dhi corrected with the Hay & Davies 1980 model for sky diffuse component
+    * Ground component is the global horizontal irradiance reflected by the ground (albedo) towards the array
+
+    :param ephemeris: solar ephemeris, as returned by solar_ephemeris()
+    :param tilt_angle: reactor tilt angle, used to calculate angle of incidence
+    :return: angle of incidence and (time points x wavelengths) direct, sky diffuse and ground-reflected spectra in
+        W/m^2/nm
+    """
+    aoi = irradiance.aoi(
+        surface_tilt=tilt_angle,
+        surface_azimuth=180,
+        solar_zenith=ephemeris["apparent_zenith"].to_numpy(),
+        solar_azimuth=ephemeris["azimuth"].to_numpy(),
+    )
+    aoi_projection = np.maximum(np.cos(np.radians(aoi)), 0)[:, np.newaxis]
+
+    dni = ephemeris.attrs["dni_spectrum"].values
+    direct = dni * aoi_projection
+
+    # Constrain cos zenith to avoid blowup, as in SPCTRL2 and irradiance.haydavies
+    cos_zenith = np.cos(np.radians(ephemeris["apparent_zenith"].to_numpy()))
+    diffuse = irradiance.haydavies(
+        surface_tilt=tilt_angle,
+        surface_azimuth=None,
+        dhi=ephemeris.attrs["dhi_spectrum"].values,
+        dni=dni,
+        dni_extra=ephemeris.attrs["dni_extra_spectrum"].values,
+        projection_ratio=aoi_projection
+        / np.maximum(cos_zenith, 0.01745)[:, np.newaxis],
+    )
 
-        # Calculate irradiance from spectral results in the spectral range of interest for simulations (see note above)
-        df["direct_irradiance"] = integrate.trapz(
-            df["direct_spectrum"]._y, df["direct_spectrum"]._x
+    ghi = dni * cos_zenith[:, np.newaxis] + ephemeris.attrs["dhi_spectrum"].values
+    ground = irradiance.get_ground_diffuse(tilt_angle, ghi, albedo=albedo)
+
+    return aoi, direct, diffuse, ground
+
+
+def solar_spectra_for_tilts(
+    ephemeris: pd.DataFrame, tilt_angles
+) -> dict[int, tuple[pd.DataFrame, SpectralSeries, SpectralSeries, SpectralSeries]]:
+    """
+    Solar data for each of the given tilt angles, from the same (tilt-independent) ephemeris
+
+    :param ephemeris: solar ephemeris, as returned by solar_ephemeris()
+    :param tilt_angles: reactor tilt angles
+    :return: dict with, for each tilt angle, solar position and irradiance DataFrame, direct, diffuse and
+        ground-reflected photon flux spectra (same time points) as in solar_spectra_for_place_and_time()
+    """
+    time_resolution = ephemeris.attrs["time_resolution"]
+    wavelengths = ephemeris.attrs["dni_spectrum"].wavelengths
+    ephemeris_columns = ephemeris.columns
+
+    results = {}
+    for tilt_angle in tilt_angles:
+        solar_data = ephemeris[ephemeris_columns].copy()
+        solar_data.attrs = {}
+        aoi, direct, diffuse, ground = plane_of_array_spectra(ephemeris, tilt_angle)
+        solar_data["aoi"] = aoi
+
+        # Convert spectra from W/m^2/nm to mol/m^2/nm over the integration time
+        direct_spectrum = SpectralSeries.from_irradiance(
+            solar_data.index, wavelengths, direct, time_resolution
+        )
+        diffuse_spectrum = SpectralSeries.from_irradiance(
+            solar_data.index, wavelengths, diffuse, time_resolution
         )
-        df["diffuse_irradiance"] = integrate.trapz(
-            df["diffuse_spectrum"]._y, df["diffuse_spectrum"]._x
+        ground_spectrum = SpectralSeries.from_irradiance(
+            solar_data.index, wavelengths, ground, time_resolution
         )
 
-        return df
+        # Calculate irradiance from spectral results in the spectral range of interest for simulations
+        solar_data["direct_irradiance"] = direct_spectrum.integrate()
+        solar_data["diffuse_irradiance"] = diffuse_spectrum.integrate()
+        solar_data["ground_irradiance"] = ground_spectrum.integrate()
+
+        # Time points with invalid spectra (i.e. not a valid photon distribution) cannot be simulated
+        valid = np.ones(len(solar_data), dtype=bool)
+        for spectral_series in (direct_spectrum, diffuse_spectrum, ground_spectrum):
+            valid &= np.all(
+                np.isfinite(spectral_series.values) & (spectral_series.values >= 0),
+                axis=1,
+            )
+        # Time points where the irradiation is on the back of the reactor have no direct irradiance
+        valid &= solar_data["direct_irradiance"].to_numpy() > 0
+
+        results[tilt_angle] = (
+            solar_data[valid].copy(),
+            direct_spectrum.take(valid),
+            diffuse_spectrum.take(valid),
+            ground_spectrum.take(valid),
+        )
+
+    return results
+
+
+def solar_spectra_for_place_and_time(
+    site: Location,
+    tilt_angle: int,
+    time_resolution: int = 1800,
+    start=None,
+    end=None,
+    times: pd.DatetimeIndex = None,
+) -> tuple[pd.DataFrame, SpectralSeries, SpectralSeries, SpectralSeries]:
+    """
+    Like solar_data_for_place_and_time() but the spectra are returned as separate SpectralSeries
+
+    :param site: pvlib.location.Location object
+    :param tilt_angle: reactor tilt angle, used to calculate angle of incidence
+    :param time_resolution: time resolution for time points, in seconds. Default to 30 min.
+    :param start: first time point (inclusive), naive values are in site local time. Default to 1st Jan 2020.
+    :param end: last time point (inclusive), naive values are in site local time. Default to 1st Jan 2021.
+    :param times: explicit time points, instead of start -- end every time_resolution seconds
+    :return: solar position and irradiance DataFrame, direct, diffuse and ground-reflected photon flux spectra (same
+        time points)
+    """
+    ephemeris = solar_ephemeris(site, time_resolution, start, end, times)
+    return solar_spectra_for_tilts(ephemeris, [tilt_angle])[tilt_angle]
+
+
+def _cache_parameters(
+    site: Location, tilt_angle: int, time_resolution: int, times: pd.DatetimeIndex
+) -> dict:
+    """Everything the solar data depend on, used as key for the on-disk cache"""
+    return {
+        "time_points": hashlib.sha256(times.asi8.tobytes()).hexdigest(),
+        "latitude": float(site.latitude),
+        "longitude": float(site.longitude),
+        "tz": str(site.tz),
+        "altitude": float(site.altitude),
+        "tilt_angle": float(tilt_angle),
+        "time_resolution": int(time_resolution),
+        "water_vapor_content": water_vapor_content,
+        "tau500": tau500,
+        "ozone": ozone,
+        "albedo": albedo,
+    }
 
-    # Filter date-time point where the sun is above the horizon. Guess why ;)
-    solar_data.query("apparent_elevation>0", inplace=True)
 
-    # Calculate spectra (diffuse and direct incident on reactor) per each data-time point
-    solar_data = solar_data.apply(calculate_spectrum, axis=1)
+def solar_data_for_tilts(
+    site: Location,
+    tilt_angles,
+    time_resolution: int = 1800,
+    start=None,
+    end=None,
+    times: pd.DatetimeIndex = None,
+    use_cache: bool = True,
+    ephemeris: pd.DataFrame = None,
+) -> dict[int, pd.DataFrame]:
+    """
+    Solar data for many tilt angles at once: solar position and clear-sky spectra are only calculated once.
 
-    # This removes time points where the irradiation is on the back of the reactor, see ValueError caught above
-    solar_data.query("direct_irradiance>0", inplace=True)
+    :param site: pvlib.location.Location object
+    :param tilt_angles: reactor tilt angles
+    :param time_resolution: time resolution for time points, in seconds. Default to 30 min.
+    :param start: first time point (inclusive), naive values are in site local time. Default to 1st Jan 2020.
+    :param end: last time point (inclusive), naive values are in site local time. Default to 1st Jan 2021.
+    :param times: explicit time points, instead of start -- end every time_resolution seconds
+    :param use_cache: load results from the on-disk cache (see miniplant.solar_cache) and save new ones in it
+    :param ephemeris: solar_ephemeris() of the same site and time points, if already calculated (e.g. for other tilt
+        angles), used for the tilt angles not in the cache
+    :return: dict with a DataFrame per tilt angle, as returned by solar_data_for_place_and_time()
+    """
+    times = time_points(site, time_resolution, start, end, times)
+
+    results = {}
+    for tilt_angle in tilt_angles:
+        parameters = _cache_parameters(site, tilt_angle, time_resolution, times)
+        cached = solar_cache.load_solar_data(parameters) if use_cache else None
+        if cached is not None:
+            results[tilt_angle] = cached
+
+    missing_tilts = [tilt for tilt in tilt_angles if tilt not in results]
+    if missing_tilts:
+        if ephemeris is None:
+            ephemeris = solar_ephemeris(site, time_resolution, times=times)
+        for tilt_angle, computed in solar_spectra_for_tilts(
+            ephemeris, missing_tilts
+        ).items():
+            if use_cache:
+                solar_cache.store_solar_data(
+                    _cache_parameters(site, tilt_angle, time_resolution, times),
+                    *computed,
+                )
+            results[tilt_angle] = computed
+
+    solar_data_per_tilt = {}
+    for tilt_angle in tilt_angles:
+        solar_data, direct_spectrum, diffuse_spectrum, ground_spectrum = results[
+            tilt_angle
+        ]
+        solar_data.attrs["direct_spectrum"] = direct_spectrum
+        solar_data.attrs["diffuse_spectrum"] = diffuse_spectrum
+        solar_data.attrs["ground_spectrum"] = ground_spectrum
+        solar_data_per_tilt[tilt_angle] = solar_data
+    return solar_data_per_tilt
+
+
+def solar_data_for_place_and_time(
+    site: Location,
+    tilt_angle: int,
+    time_resolution: int = 1800,
+    start=None,
+    end=None,
+    times: pd.DatetimeIndex = None,
+    use_cache: bool = True,
+    export_csv: bool = False,
+) -> pd.DataFrame:
+    """
+    Given a Location object and a series of datetime points calculates relevant solar position and spectral distribution
+
+    :param site: pvlib.location.Location object
+    :param tilt_angle: reactor tilt angle, used to calculate angle of incidence
+    :param time_resolution: time resolution for time points, in seconds. Default to 30 min.
+    :param start: first time point (inclusive), naive values are in site local time. Default to 1st Jan 2020.
+    :param end: last time point (inclusive), naive values are in site local time. Default to 1st Jan 2021.
+    :param times: explicit time points, instead of start -- end every time_resolution seconds
+    :param use_cache: load results from the on-disk cache (see miniplant.solar_cache) and save new ones in it
+    :param export_csv: save solar position and irradiance in Full_data_{site.name}.csv
+    :return: a pd.DataFrame with all the relevant results. The direct, diffuse and ground-reflected spectra (photon
+        flux) are stored as SpectralSeries in its attrs, under the "direct_spectrum", "diffuse_spectrum" and
+        "ground_spectrum" keys.
+    """
+    solar_data = solar_data_for_tilts(
+        site, [tilt_angle], time_resolution, start, end, times, use_cache=use_cache
+    )[tilt_angle]
+
+    if not export_csv:
+        return solar_data
 
     # Export to CSV
     solar_data.to_csv(
@@ -142,16 +404,10 @@ def solar_data_for_place_and_time(
             "aoi",
             "direct_irradiance",
             "diffuse_irradiance",
+            "ground_irradiance",
         ),
     )
 
-    # Logging
-    logger = logging.getLogger("pvtrace").getChild("miniplant")
-    logger.info(
-        f"Generated solar data for {site.name} [lat. {site.latitude}, long. {site.longitude}] in the time range"
-        f" {datetime_points.min().isoformat()} -- {datetime_points.max().isoformat()}"
-    )
-
     return solar_data
 
 
@@ -167,7 +423,9 @@ if __name__ == "__main__":
 
     for site in LOCATIONS:
         # Calculate solar spectrum and position per every time point
-        test_df = solar_data_for_place_and_time(site, tilt[site.name], 60 * 30)
+        test_df = solar_data_for_place_and_time(
+            site, tilt[site.name], 60 * 30, export_csv=True
+        )
 
         with pd.option_context("display.max_columns", 40):
             print(test_df.describe())
@@ -0,0 +1,109 @@
+"""
+Registry of the spectral data used in the simulations, i.e. dye (LR305) absorption/emission and reaction mixture (MB)
+absorption. Every data file is parsed at most once per process and the pvtrace material components are built once.
+Spectra are also available resampled on a shared wavelength grid (WAVELENGTH_GRID), see get_resampled_spectrum().
+"""
+import functools
+import hashlib
+import io
+import pkgutil
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+
+from pvtrace import Luminophore, Reactor, isotropic
+
+# Spectra shipped with the package (absorption coefficients normalized to 1 m, emission normalized)
+BUILTIN_SPECTRA = {
+    "MB_ABS": "reactor_data/MB_1M_1m_ACN.tsv",
+    "LR305_ABS": "reactor_data/Evonik_lr305_normalized_to_1m.tsv",
+    "LR305_EMS": "reactor_data/Evonik_lr305_normalized_to_1m_ems.tsv",
+}
+
+# Shared wavelength grid (in nm) for resampled spectra
+WAVELENGTH_GRID = np.arange(250.0, 901.0, 1.0)
+
+_user_spectra = {}
+
+
+def _parse_spectrum(data: bytes) -> np.ndarray:
+    """Parse a tab-separated (wavelength, value) file into a 2-column array"""
+    return pd.read_csv(io.BytesIO(data), encoding="utf8", sep="\t").values
+
+
+def register_spectrum(name: str, spectrum) -> None:
+    """
+    Make a user-supplied spectrum available under the given name.
+
+    :param name: name used to retrieve the spectrum, e.g. in get_luminophore() or get_reactor_material()
+    :param spectrum: path to a tab-separated file (same format as the built-in ones) or a (N, 2) array-like with
+        wavelength (nm) and value columns.
+    """
+    if name in BUILTIN_SPECTRA or name in _user_spectra:
+        raise ValueError(f"A spectrum named {name} is already registered!")
+
+    if isinstance(spectrum, (str, Path)):
+        spectrum = Path(spectrum)
+        if not spectrum.exists():
+            raise FileNotFoundError(f"Spectrum file {spectrum} not found!")
+    else:
+        spectrum = np.array(spectrum, dtype=float)
+        if spectrum.ndim != 2 or spectrum.shape[1] != 2:
+            raise ValueError("Spectra must be provided as (wavelength, value) pairs!")
+        if not np.all(np.diff(spectrum[:, 0]) > 0):
+            raise ValueError("Spectrum wavelengths must be sorted and ascending!")
+    _user_spectra[name] = spectrum
+
+
+@functools.cache
+def get_spectrum(name: str) -> np.ndarray:
+    """Return the spectrum with the given name as (N, 2) array of wavelength (nm) and value. Parsed once."""
+    if name in BUILTIN_SPECTRA:
+        data = _parse_spectrum(pkgutil.get_data(__name__, BUILTIN_SPECTRA[name]))
+    elif name in _user_spectra:
+        source = _user_spectra[name]
+        data = (
+            _parse_spectrum(source.read_bytes()) if isinstance(source, Path) else source
+        )
+    else:
+        raise KeyError(f"Unknown spectrum {name}! Use register_spectrum() to add it.")
+
+    data = np.array(data, dtype=float)
+    data.setflags(write=False)  # Shared between callers
+    return data
+
+
+def spectrum_hash(name: str) -> str:
+    """Hash of the wavelengths and values of the spectrum with the given name, e.g. to key cached results on"""
+    return hashlib.sha256(get_spectrum(name).tobytes()).hexdigest()
+
+
+@functools.cache
+def get_resampled_spectrum(name: str) -> np.ndarray:
+    """Return the spectrum values linearly interpolated on WAVELENGTH_GRID (zero outside the data range)"""
+    data = get_spectrum(name)
+    resampled = np.interp(WAVELENGTH_GRID, data[:, 0], data[:, 1], left=0.0, right=0.0)
+    resampled.setflags(write=False)  # Shared between callers
+    return resampled
+
+
+@functools.cache
+def get_luminophore(
+    absorption: str = "LR305_ABS",
+    emission: str = "LR305_EMS",
+    quantum_yield: float = 0.95,
+) -> Luminophore:
+    """LSC-PM dye component, built once per (absorption, emission, quantum_yield)"""
+    return Luminophore(
+        coefficient=get_spectrum(absorption),
+        emission=get_spectrum(emission),
+        quantum_yield=quantum_yield,
+        phase_function=isotropic,
+    )
+
+
+@functools.cache
+def get_reactor_material(absorption: str = "MB_ABS") -> Reactor:
+    """Reaction mixture component, built once per absorption spectrum"""
+    return Reactor(get_spectrum(absorption))
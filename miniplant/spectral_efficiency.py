@@ -0,0 +1,149 @@
+"""
+Wavelength-resolved reactor efficiency (fraction of photons reacted per wavelength bin) and its folding with spectra.
+
+A single broadband simulation gives the efficiency per wavelength bin, then the efficiency for any spectrum (e.g. the
+solar spectrum of each time point of a year) is a weighted average, without any further ray-tracing.
+"""
+import numpy as np
+
+from pvtrace import Event
+
+from miniplant.spectral_data import WAVELENGTH_GRID, get_resampled_spectrum
+from miniplant.spectral_series import SpectralSeries
+
+# Wavelength bins (nm) covering the solar spectra used in simulations (see solar_data.SIMULATION_WAVELENGTHS)
+WAVELENGTH_BINS = np.arange(360.0, 691.0, 10.0)
+
+
+def folding_matrix(wavelengths, bin_edges) -> np.ndarray:
+    """
+    (bins x wavelengths) matrix M such that M @ spectrum is the integral of the spectrum over each bin.
+
+    The spectrum is linearly interpolated between its wavelengths (as for pvtrace.Distribution), so integrals are exact.
+    """
+    wavelengths = np.asarray(wavelengths, dtype=float)
+    bin_edges = np.asarray(bin_edges, dtype=float)
+    if bin_edges[0] < wavelengths[0] or bin_edges[-1] > wavelengths[-1]:
+        raise ValueError(
+            "Wavelength bins must be within the spectrum wavelength range!"
+        )
+
+    # Integration points: spectrum wavelengths and bin edges, the spectrum is linear in between
+    points = np.union1d(
+        wavelengths[(wavelengths >= bin_edges[0]) & (wavelengths <= bin_edges[-1])],
+        bin_edges,
+    )
+    # Spectrum values at the integration points as linear combination of the values at the spectrum wavelengths
+    interpolation = np.column_stack(
+        [np.interp(points, wavelengths, unit) for unit in np.identity(len(wavelengths))]
+    )
+
+    # Trapezoidal rule weights for the integration points in each bin
+    weights = np.zeros((len(bin_edges) - 1, len(points)))
+    for idx, (low, high) in enumerate(zip(bin_edges[:-1], bin_edges[1:], strict=True)):
+        in_bin = np.flatnonzero((points >= low) & (points <= high))
+        widths = np.diff(points[in_bin])
+        weights[idx, in_bin[:-1]] += widths / 2
+        weights[idx, in_bin[1:]] += widths / 2
+
+    return weights @ interpolation
+
+
+class SpectralEfficiency:
+    """Photons emitted and reacted per wavelength bin, from one or more wavelength-resolved simulations"""
+
+    def __init__(self, bin_edges, emitted, reacted):
+        """
+        :param bin_edges: wavelength bin edges in nm (ascending)
+        :param emitted: number of photons emitted per bin
+        :param reacted: number of photons reacted per bin
+        """
+        self.bin_edges = np.asarray(bin_edges, dtype=float)
+        self.emitted = np.asarray(emitted, dtype=int)
+        self.reacted = np.asarray(reacted, dtype=int)
+
+        if not len(self.emitted) == len(self.reacted) == len(self.bin_edges) - 1:
+            raise ValueError("Photon counts must be provided for each wavelength bin!")
+
+    @classmethod
+    def from_photons(cls, bin_edges, wavelengths, finals) -> "SpectralEfficiency":
+        """Tally photons by (initial) wavelength and final event"""
+        bin_edges = np.asarray(bin_edges, dtype=float)
+        bins = np.clip(np.digitize(wavelengths, bin_edges) - 1, 0, len(bin_edges) - 2)
+        reacted = np.fromiter(
+            (event == Event.REACT for event in finals), dtype=bool, count=len(finals)
+        )
+        return cls(
+            bin_edges,
+            np.bincount(bins, minlength=len(bin_edges) - 1),
+            np.bincount(bins[reacted], minlength=len(bin_edges) - 1),
+        )
+
+    def __add__(self, other: "SpectralEfficiency") -> "SpectralEfficiency":
+        if not np.array_equal(self.bin_edges, other.bin_edges):
+            raise ValueError(
+                "Cannot combine efficiencies with different wavelength bins!"
+            )
+        return SpectralEfficiency(
+            self.bin_edges, self.emitted + other.emitted, self.reacted + other.reacted
+        )
+
+    def __repr__(self):
+        return (
+            f"SpectralEfficiency({len(self.bin_edges) - 1} bins {self.bin_edges[0]:g}--{self.bin_edges[-1]:g} nm, "
+            f"{self.emitted.sum()} photons)"
+        )
+
+    def save(self, path) -> None:
+        """Save the photon counts as npz file"""
+        np.savez(
+            path, bin_edges=self.bin_edges, emitted=self.emitted, reacted=self.reacted
+        )
+
+    @classmethod
+    def load(cls, path) -> "SpectralEfficiency":
+        """Load photon counts saved with save()"""
+        with np.load(path) as data:
+            return cls(data["bin_edges"], data["emitted"], data["reacted"])
+
+    @property
+    def bin_centers(self) -> np.ndarray:
+        return (self.bin_edges[:-1] + self.bin_edges[1:]) / 2
+
+    @property
+    def efficiency(self) -> np.ndarray:
+        """Fraction of photons reacted per bin (NaN for bins without photons)"""
+        with np.errstate(divide="ignore", invalid="ignore"):
+            return self.reacted / self.emitted
+
+    def fold(self, spectra) -> np.ndarray:
+        """
+        Fraction of photons reacted for the given spectra (e.g. photon flux), i.e. efficiency averaged over each
+        spectrum
+
+        :param spectra: SpectralSeries, (wavelengths, values) pair, values can be one spectrum or
+            (spectra x wavelengths), or the name of a spectrum in the miniplant.spectral_data registry
+        :return: reacted fraction for each spectrum (float for a single spectrum)
+        """
+        if isinstance(spectra, str):
+            wavelengths, values = WAVELENGTH_GRID, get_resampled_spectrum(spectra)
+        elif isinstance(spectra, SpectralSeries):
+            wavelengths, values = spectra.wavelengths, spectra.values
+        else:
+            wavelengths, values = spectra
+            values = np.asarray(values, dtype=float)
+
+        photons_per_bin = values @ folding_matrix(wavelengths, self.bin_edges).T
+        no_photons = self.emitted == 0
+        if np.any(photons_per_bin[..., no_photons] > 0):
+            raise ValueError(
+                "No photons were simulated in some of the wavelength bins!"
+            )
+
+        efficiency = np.where(no_photons, 0, self.efficiency)
+        return photons_per_bin @ efficiency / photons_per_bin.sum(axis=-1)
+
+
+def fold_efficiency(efficiency: SpectralEfficiency, spectra) -> np.ndarray:
+    """Fraction of photons reacted for each of the spectra, see SpectralEfficiency.fold()"""
+    return efficiency.fold(spectra)
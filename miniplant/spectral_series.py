@@ -0,0 +1,93 @@
+"""
+Time series of spectra (e.g. the solar spectrum incident on the reactor at every time point of a year) stored as a
+single contiguous array with a shared wavelength axis, instead of one pvtrace.Distribution per time point.
+"""
+import numpy as np
+import pandas as pd
+import scipy.integrate as integrate
+
+from pvtrace import Distribution
+
+from miniplant.utils import SpectrumSampler, irradiance_to_photon_flux
+
+
+class SpectralSeries:
+    """
+    Spectra on a shared wavelength axis, one per time point, as (time points x wavelengths) array.
+
+    Indexing by position (or timestamp via at()) returns a lazily built pvtrace.Distribution for that time point,
+    while slicing (by position or by time with between()) returns a new SpectralSeries viewing the same data.
+    """
+
+    def __init__(self, index: pd.DatetimeIndex, wavelengths, values):
+        """
+        :param index: time points, one per row of values
+        :param wavelengths: wavelengths in nm (ascending)
+        :param values: (time points x wavelengths) array, e.g. photon flux in mol/m^2/nm
+        """
+        self.index = pd.DatetimeIndex(index)
+        self.wavelengths = np.asarray(wavelengths, dtype=float)
+        self.values = np.asarray(values, dtype=float)
+
+        if self.values.shape != (len(self.index), len(self.wavelengths)):
+            raise ValueError(
+                f"Spectra shape {self.values.shape} does not match {len(self.index)} time points and "
+                f"{len(self.wavelengths)} wavelengths!"
+            )
+
+    @classmethod
+    def from_irradiance(
+        cls, index: pd.DatetimeIndex, wavelengths, irradiance, integration_time=1800
+    ) -> "SpectralSeries":
+        """Photon flux series (mol/m^2/nm) from spectral irradiance (W/m^2/nm) integrated over integration_time"""
+        wavelengths = np.asarray(wavelengths, dtype=float)
+        photon_flux = (
+            irradiance_to_photon_flux(np.asarray(irradiance, dtype=float), wavelengths)
+            * integration_time
+        )
+        return cls(index, wavelengths, photon_flux)
+
+    def __len__(self):
+        return len(self.index)
+
+    def __getitem__(self, item):
+        if isinstance(item, slice):
+            return SpectralSeries(self.index[item], self.wavelengths, self.values[item])
+        return Distribution(self.wavelengths, self.values[item])
+
+    def __deepcopy__(self, memo):
+        # pandas copies DataFrame.attrs (where solar data keep their spectra) along with the frame: share the arrays
+        return self
+
+    def __repr__(self):
+        return f"SpectralSeries({len(self)} time points x {len(self.wavelengths)} wavelengths)"
+
+    def position(self, timestamp) -> int:
+        """Row of the spectrum at the given time point"""
+        return self.index.get_loc(pd.Timestamp(timestamp))
+
+    def spectrum_at(self, timestamp) -> np.ndarray:
+        """Spectrum values at the given time point (a view, do not modify)"""
+        return self.values[self.position(timestamp)]
+
+    def at(self, timestamp) -> Distribution:
+        """pvtrace Distribution of the spectrum at the given time point"""
+        return self[self.position(timestamp)]
+
+    def sampler(self, timestamp, stratified: bool = False) -> SpectrumSampler:
+        """Wavelength sampler for the spectrum at the given time point (e.g. to be used as solar_spectrum_function)"""
+        return SpectrumSampler(
+            (self.wavelengths, self.spectrum_at(timestamp)), stratified=stratified
+        )
+
+    def between(self, start=None, end=None) -> "SpectralSeries":
+        """Spectra in the time range start -- end (both included, like DataFrame.loc), without copying them"""
+        return self[self.index.slice_indexer(start, end)]
+
+    def take(self, mask) -> "SpectralSeries":
+        """Spectra for the time points selected by a boolean mask or by positions (copied)"""
+        return SpectralSeries(self.index[mask], self.wavelengths, self.values[mask])
+
+    def integrate(self) -> np.ndarray:
+        """Integral of each spectrum over wavelength (trapezoidal rule), e.g. the photon flux in mol/m^2"""
+        return integrate.trapz(self.values, self.wavelengths, axis=1)
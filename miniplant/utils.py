@@ -1,14 +1,16 @@
 """
 Module with a function to convert spectra from W * m^-2 * nm^-1 to umol * m^-2 * s^-1
 """
-from typing import Iterator
+import functools
+from typing import Callable, Iterator
 
 import numpy as np
-from pvlib import irradiance
 from pvtrace.geometry.transformations import rotation_matrix
 from pvtrace.material.utils import spherical_to_cart
 from scipy.constants import Planck, speed_of_light, Avogadro
-from pvtrace import Distribution, Ray, Light, rectangular_mask
+from pvtrace import Distribution, Ray, Light, Scene, rectangular_mask
+
+from miniplant.spectral_data import WAVELENGTH_GRID, get_resampled_spectrum
 
 
 def photon_energy(wavelength):
@@ -27,27 +29,103 @@ def spectral_distribution_to_photon_distribution(
     distribution: Distribution, integration_time=1800
 ):
     """Given a pvtrace Distribution in W/m^2 converts it into photon flux (units from W to moles!)"""
-    photon_flux = []
+    photon_flux = (
+        irradiance_to_photon_flux(distribution._y, distribution._x) * integration_time
+    )
+    return Distribution(distribution._x, photon_flux)
 
-    for wavelength, intensity in zip(distribution._x, distribution._y):
-        photon_flux.append(
-            irradiance_to_photon_flux(intensity, wavelength) * integration_time
-        )
-    return Distribution(distribution._x, np.array(photon_flux))
+
+def default_wavelength(*args, **kwargs):
+    """Monochromatic green photons (555 nm). Module-level function (unlike a lambda) so it can be pickled."""
+    return 555
+
+
+class FixedWavelength:
+    """
+    Monochromatic light of the given wavelength (nm), usable as solar_spectrum_function (picklable, unlike lambdas)
+    """
+
+    def __init__(self, wavelength: float):
+        self.wavelength = float(wavelength)
+
+    def __call__(self, *args, **kwargs):
+        return self.wavelength
+
+    def batch(self, size: int) -> np.ndarray:
+        """Return size (identical) wavelengths at once"""
+        return np.full(size, self.wavelength)
 
 
-class PhotonFactory:
-    """Create a callable sampling the current solar spectrum"""
+@functools.lru_cache(maxsize=1024)
+def _inverse_cdf_table(wavelengths: bytes, values: bytes):
+    """Wavelengths and normalized cumulative distribution of a spectrum, shared between identical spectra"""
+    x = np.frombuffer(wavelengths)
+    y = np.frombuffer(values)
+    # Same (trapezoidal) cumulative distribution as pvtrace.Distribution, so samples are distributed alike
+    cdf = np.concatenate(([0.0], np.cumsum((y[:-1] + y[1:]) * 0.5)))
+    return x, cdf / cdf[-1]
 
-    def __init__(self, spectrum):
-        self.spectrum = spectrum
+
+class SpectrumSampler:
+    """
+    Callable sampling wavelengths from a spectrum, e.g. the current solar spectrum (drop-in solar_spectrum_function).
+
+    The cumulative distribution table is built once per spectrum (and shared between identical spectra), so that any
+    number of wavelengths can be drawn with a single np.interp call via batch(). With stratified=True batch() draws
+    one random number per equal-probability stratum, reducing the variance of the sampled spectrum.
+    """
+
+    def __init__(self, spectrum, stratified: bool = False):
+        """
+        :param spectrum: a pvtrace.Distribution, a (wavelengths, values) pair of array-like or the name of a spectrum
+            in the miniplant.spectral_data registry (sampled on the shared WAVELENGTH_GRID)
+        :param stratified: use stratified sampling in batch()
+        """
+        if isinstance(spectrum, str):
+            wavelengths, values = WAVELENGTH_GRID, get_resampled_spectrum(spectrum)
+        elif isinstance(spectrum, Distribution):
+            wavelengths, values = spectrum._x, spectrum._y
+        else:
+            wavelengths, values = spectrum
+        self.wavelengths, self.cdf = _inverse_cdf_table(
+            np.asarray(wavelengths, dtype=float).tobytes(),
+            np.asarray(values, dtype=float).tobytes(),
+        )
+        self.stratified = stratified
 
     def __call__(self, *args, **kwargs):
-        return self.spectrum.sample(np.random.uniform())
+        return float(np.interp(np.random.uniform(), self.cdf, self.wavelengths))
+
+    def batch(self, size: int) -> np.ndarray:
+        """Sample size wavelengths at once"""
+        if self.stratified:
+            probability = (
+                np.random.permutation(size) + np.random.uniform(size=size)
+            ) / size
+        else:
+            probability = np.random.uniform(size=size)
+        return np.interp(probability, self.cdf, self.wavelengths)
+
+
+# Create a callable sampling the current solar spectrum
+PhotonFactory = SpectrumSampler
+
+
+def sample_wavelengths(wavelength: Callable, size: int) -> np.ndarray:
+    """
+    Draw size wavelengths from a wavelength callable, in a single vectorized call if it provides a batch() method
+    """
+    if hasattr(wavelength, "batch"):
+        return np.broadcast_to(np.asarray(wavelength.batch(size), dtype=float), size)
+    return np.fromiter((wavelength() for _ in range(size)), dtype=float, count=size)
 
 
 class MyLight(Light):
-    """Modified pvtrace.Light object"""
+    """
+    Modified pvtrace.Light object, with position and direction generated together.
+
+    If the position_and_direction generator provides a batch() method, all the rays requested are generated at once.
+    """
 
     def __init__(self, wavelength=None, position_and_direction=None, name="Light"):
         self.wavelength = wavelength
@@ -57,23 +135,68 @@ class MyLight(Light):
     def emit(self, num_rays=None) -> Iterator[Ray]:
         if num_rays is None or num_rays == 0:
             return
-        count = 0
-        while True:
-            count += 1
-            if num_rays is not None and count > num_rays:
-                break
-
-            try:
-                position, direction = self.position_direction()
-                ray = Ray(
-                    wavelength=self.wavelength(),
-                    position=position,
-                    direction=direction,
+
+        if hasattr(self.position_direction, "batch"):
+            positions, directions = self.position_direction.batch(num_rays)
+            wavelengths = sample_wavelengths(self.wavelength, num_rays)
+            for position, direction, wavelength in zip(
+                positions.tolist(),
+                directions.tolist(),
+                wavelengths.tolist(),
+                strict=True,
+            ):
+                yield Ray(
+                    wavelength=wavelength,
+                    position=tuple(position),
+                    direction=tuple(direction),
                     source=self.name,
                 )
-            except Exception:
-                raise
-            yield ray
+            return
+
+        for _ in range(num_rays):
+            position, direction = self.position_direction()
+            yield Ray(
+                wavelength=self.wavelength(),
+                position=position,
+                direction=direction,
+                source=self.name,
+            )
+
+
+def emit_photons(scene: Scene, num_photons: int) -> Iterator[Ray]:
+    """
+    Like pvtrace Scene.emit(), but each light node generates all its rays in a single call instead of one at a time.
+
+    Rays are returned in the world coordinate system. Light sources share the photons as in Scene.emit().
+    """
+    lights = scene.light_nodes
+    for idx, light in enumerate(lights):
+        num_rays = num_photons // len(lights) + (
+            1 if idx < num_photons % len(lights) else 0
+        )
+        yield from _emit_in_world_frame(scene, light, num_rays)
+
+
+def emit_photons_per_source(
+    scene: Scene, photons_per_source: dict[str, int]
+) -> Iterator[Ray]:
+    """
+    Like emit_photons(), but with the number of photons of each light source given by its name (i.e. the ray source)
+    """
+    for light in scene.light_nodes:
+        yield from _emit_in_world_frame(
+            scene, light, photons_per_source.get(light.light.name, 0)
+        )
+
+
+def _emit_in_world_frame(scene: Scene, light, num_rays: int) -> Iterator[Ray]:
+    world = scene.root
+    if np.allclose(light.transformation_to(world), np.identity(4)):
+        # Light node in the world frame: no need to transform each ray
+        yield from light.emit(num_rays)
+    else:
+        for ray in light.emit(num_rays):
+            yield ray.representation(light, world)
 
 
 class VectorInverter:
@@ -84,44 +207,152 @@ class VectorInverter:
         return tuple(-value for value in self.vector)
 
 
+@functools.cache
+def tilt_rotation_matrix(tilt_angle: float) -> np.ndarray:
+    """Rotation matrix (3x3) bringing points on the horizontal reactor plane onto the tilted reactor plane"""
+    matrix = np.linalg.inv(rotation_matrix(np.radians(-tilt_angle), (0, 1, 0)))[
+        0:3, 0:3
+    ]
+    matrix.setflags(write=False)
+    return matrix
+
+
 class LightPosition:
+    """Random position on the reactor front face"""
+
     def __init__(self, tilt_angle):
         self.tilt_angle = tilt_angle
-        pass
+        self.matrix = tilt_rotation_matrix(tilt_angle)
 
     def __call__(self, *args, **kwargs):
         position = rectangular_mask(0.47 / 2, 0.47 / 2)
-        matrix = np.linalg.inv(rotation_matrix(np.radians(-self.tilt_angle), (0, 1, 0)))
+        return tuple(np.dot(self.matrix, position))
 
-        homogeneous_pt = np.ones(4)
-        homogeneous_pt[0:3] = position
-        new_pt = np.dot(matrix, homogeneous_pt)[0:3]
-        return tuple(new_pt)
+    def batch(self, size: int) -> np.ndarray:
+        """Return size random positions as (size, 3) array"""
+        positions = np.zeros((size, 3))
+        positions[:, 0:2] = np.random.uniform(-0.47 / 2, 0.47 / 2, size=(size, 2))
+        return positions @ self.matrix.T
 
 
-def create_diffuse_photon(tilt_angle: int = 30) -> np.ndarray:
-    # Keep on generating random photons until they hit the front face of the reactor (not the back)
-    # This is correct because poa_diffuse already takes into account the tilt angle! ;)
+class DirectPhotonGenerator:
+    """
+    Position and direction of direct light photons: parallel to the solar vector and hitting the reactor front face.
+    Photons start 1 m away from the reactor surface, in the direction of the sun.
+    """
+
+    def __init__(self, tilt_angle, solar_elevation, solar_azimuth):
+        self.solar_light_vector = np.array(
+            spherical_to_cart(
+                np.deg2rad(-solar_elevation + 90), np.deg2rad(-solar_azimuth + 180)
+            )
+        )
+        self.base_position_generator = LightPosition(tilt_angle)
+
+    def __call__(self, *args, **kwargs):
+        position = np.array(self.base_position_generator()) + self.solar_light_vector
+        return tuple(position), tuple(-self.solar_light_vector)
+
+    def batch(self, size: int):
+        """Return positions and directions of size photons as two (size, 3) arrays"""
+        positions = self.base_position_generator.batch(size) + self.solar_light_vector
+        directions = np.broadcast_to(-self.solar_light_vector, (size, 3))
+        return positions, directions
+
+
+def _max_diffuse_zenith(tilt_angle: float, azimuth: np.ndarray) -> np.ndarray:
+    """
+    Largest zenith angle (rad) for which a direction with the given azimuth (rad) still sees the reactor front face.
+
+    The angle of incidence projection (pvlib.irradiance.aoi_projection() with surface_azimuth=0) is
+    cos(tilt)cos(zenith) + sin(tilt)sin(zenith)cos(azimuth) = R cos(zenith - delta), with
+    delta = atan2(sin(tilt)cos(azimuth), cos(tilt)), so it is positive for zenith <= delta + pi/2.
+    """
+    tilt = np.deg2rad(tilt_angle)
+    delta = np.arctan2(np.sin(tilt) * np.cos(azimuth), np.cos(tilt))
+    return np.clip(delta + np.pi / 2, 0, np.pi / 2)
+
+
+@functools.cache
+def _diffuse_azimuth_cdf(tilt_angle: float, points: int = 4097):
+    """Tabulated cumulative distribution of the azimuth of diffuse photons, for inverse transform sampling"""
+    azimuth = np.linspace(0, 2 * np.pi, points)
+    # Zenith angles are uniform in [0, max_zenith], so the azimuth probability density is proportional to max_zenith
+    density = _max_diffuse_zenith(tilt_angle, azimuth)
+    cdf = np.concatenate(([0], np.cumsum((density[1:] + density[:-1]) / 2)))
+    return azimuth, cdf / cdf[-1]
+
 
-    # Angle of Incidence projection is positive for front face and negative for back
-    aoi_projection = -1
-    while aoi_projection < 0:
-        # Get a new random point in the half-sphere
-        random_azimuth = np.random.rand() * 360
-        random_zenith = np.random.rand() * 90
-        # Test its validity
-        aoi_projection = irradiance.aoi_projection(
-            surface_tilt=tilt_angle,
-            surface_azimuth=0,
-            solar_zenith=random_zenith,
-            solar_azimuth=random_azimuth,
+def sample_diffuse_directions(tilt_angle: float, size: int) -> np.ndarray:
+    """
+    Random directions (from origin outwards) in the half-sphere above the horizon hitting the reactor front face.
+
+    Zenith and azimuth angles are uniformly distributed over the front-facing region, exactly as the rejection
+    sampling in create_diffuse_photon() used to do, but no draw is rejected: the azimuth is sampled from its
+    marginal distribution and the zenith uniformly within the valid range for that azimuth.
+    Valid for tilt angles between -90 and 90 degrees. Returns a (size, 3) array.
+    """
+    azimuth_grid, cdf = _diffuse_azimuth_cdf(tilt_angle)
+    azimuth = np.interp(np.random.rand(size), cdf, azimuth_grid)
+    zenith = np.random.rand(size) * _max_diffuse_zenith(tilt_angle, azimuth)
+
+    return np.column_stack(
+        (
+            np.sin(zenith) * np.cos(azimuth),
+            np.sin(zenith) * np.sin(azimuth),
+            np.cos(zenith),
         )
-    # Return the corresponding vector (note that the direction is from origin outwards)
-    return spherical_to_cart(
-        theta=np.deg2rad(random_zenith), phi=np.deg2rad(random_azimuth)
     )
 
 
+def _max_ground_zenith(tilt_angle: float, azimuth: np.ndarray) -> np.ndarray:
+    """Like _max_diffuse_zenith(), but for directions below the horizon (i.e. the result is at least pi/2)"""
+    tilt = np.deg2rad(tilt_angle)
+    delta = np.arctan2(np.sin(tilt) * np.cos(azimuth), np.cos(tilt))
+    return np.clip(delta + np.pi / 2, np.pi / 2, np.pi)
+
+
+@functools.cache
+def _ground_azimuth_cdf(tilt_angle: float, points: int = 4097):
+    """Tabulated cumulative distribution of the azimuth of ground-reflected photons, see _diffuse_azimuth_cdf()"""
+    azimuth = np.linspace(0, 2 * np.pi, points)
+    # Zenith angles are uniform in [pi/2, max_zenith], i.e. below the horizon and still hitting the front face
+    density = _max_ground_zenith(tilt_angle, azimuth) - np.pi / 2
+    cdf = np.concatenate(([0], np.cumsum((density[1:] + density[:-1]) / 2)))
+    if cdf[-1] == 0:
+        raise ValueError(
+            f"No ground-reflected light reaches the front face with tilt angle {tilt_angle}!"
+        )
+    return azimuth, cdf / cdf[-1]
+
+
+def sample_ground_directions(tilt_angle: float, size: int) -> np.ndarray:
+    """
+    Random directions (from origin outwards) below the horizon hitting the reactor front face, i.e. towards the ground
+    seen by a tilted reactor. Zenith and azimuth are uniformly distributed over that region, as for diffuse light in
+    sample_diffuse_directions(). Returns a (size, 3) array.
+    """
+    azimuth_grid, cdf = _ground_azimuth_cdf(tilt_angle)
+    azimuth = np.interp(np.random.rand(size), cdf, azimuth_grid)
+    zenith = np.pi / 2 + np.random.rand(size) * (
+        _max_ground_zenith(tilt_angle, azimuth) - np.pi / 2
+    )
+
+    return np.column_stack(
+        (
+            np.sin(zenith) * np.cos(azimuth),
+            np.sin(zenith) * np.sin(azimuth),
+            np.cos(zenith),
+        )
+    )
+
+
+def create_diffuse_photon(tilt_angle: int = 30) -> np.ndarray:
+    """Single random direction (from origin outwards) hitting the reactor front face, see sample_diffuse_directions"""
+    # This is correct because poa_diffuse already takes into account the tilt angle! ;)
+    return sample_diffuse_directions(tilt_angle, 1)[0]
+
+
 class IsotropicPhotonGenerator:
     """
     Creates random photon position together with its direction so that it ends up in the reactor front face.
@@ -140,3 +371,26 @@ class IsotropicPhotonGenerator:
             -value for value in direction
         )  # Reversed to point towards the reactor!
         return position, reversed_direction
+
+    def batch(self, size: int):
+        """Return positions and directions of size photons as two (size, 3) arrays"""
+        directions = sample_diffuse_directions(self.tilt_angle, size)
+        # Translate position to ensure origin is not on reactor surface, and reverse direction to point at the reactor
+        positions = self.base_position_generator.batch(size) + directions
+        return positions, -directions
+
+
+class GroundReflectedPhotonGenerator(IsotropicPhotonGenerator):
+    """
+    Like IsotropicPhotonGenerator, but photons come from the ground in front of the reactor (albedo reflected light)
+    """
+
+    def __call__(self, *args, **kwargs):
+        positions, directions = self.batch(1)
+        return tuple(positions[0]), tuple(directions[0])
+
+    def batch(self, size: int):
+        """Return positions and directions of size photons as two (size, 3) arrays"""
+        directions = sample_ground_directions(self.tilt_angle, size)
+        positions = self.base_position_generator.batch(size) + directions
+        return positions, -directions
@@ -0,0 +1,7 @@
+import pytest
+
+
+@pytest.fixture(autouse=True)
+def isolated_cache(tmp_path, monkeypatch):
+    """Keep the on-disk cache of every test in its temporary directory, instead of ~/.cache/miniplant"""
+    monkeypatch.setenv("MINIPLANT_CACHE_DIR", str(tmp_path))
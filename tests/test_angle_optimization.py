@@ -0,0 +1,61 @@
+from miniplant import angle_optimization_simulation
+import numpy as np
+import pytest
+
+from miniplant.angle_optimization_simulation import (
+    _confidence_range,
+    _golden_section,
+    optimize_tilt_angle,
+)
+from miniplant.locations import EINDHOVEN, TOWNSVILLE
+
+
+def test_golden_section():
+    evaluations = {}
+    low, high = _golden_section(
+        lambda tilt: (-((tilt - 37) ** 2), 0), 0, 60, 1, evaluations
+    )
+    assert low <= 37 <= high and high - low <= 1
+    assert len(evaluations) < 15
+
+    # Stops as soon as the interior points cannot be told apart
+    evaluations = {}
+    low, high = _golden_section(lambda tilt: (1, 0.1), 0, 60, 1, evaluations)
+    assert (low, high) == (0, 60) and len(evaluations) == 2
+
+
+def test_confidence_range():
+    # 0.01 * d**2 below the maximum d degrees away from 35: within 2 * 0.05 for d < sqrt(10)
+    evaluations = {tilt: (100 - 0.01 * (tilt - 35) ** 2, 0.05) for tilt in (25, 35, 45)}
+    tilt_angle, low, high = _confidence_range(evaluations, (25, 45), (0, 60))
+    assert tilt_angle == pytest.approx(35)
+    assert (low, high) == pytest.approx((35 - np.sqrt(10), 35 + np.sqrt(10)))
+    # Clipped to the bounds searched
+    assert _confidence_range(evaluations, (25, 45), (0, 36))[2] == 36
+
+    # Not concave: best evaluation and search bracket
+    convex = {tilt: (0.01 * (tilt - 35) ** 2, 0.05) for tilt in (25, 35, 40)}
+    assert _confidence_range(convex, (25, 40), (0, 60)) == (25, 25, 40)
+
+
+def test_optimize_tilt_angle(monkeypatch):
+    calls = []
+
+    def fake_yearly_reacted(tilt_angle, location, time_resolution, *args):
+        calls.append(time_resolution)
+        # Flat top: the uncertainty makes tilt angles within ~3 degrees of the optimum indistinguishable
+        return 100 - 0.01 * (abs(tilt_angle) - 35) ** 2, 0.05
+
+    monkeypatch.setattr(
+        angle_optimization_simulation, "yearly_reacted", fake_yearly_reacted
+    )
+    optimum = optimize_tilt_angle(EINDHOVEN, pool=None, workers=1)
+    assert optimum.low <= 35 <= optimum.high
+    assert abs(optimum.tilt_angle - 35) < optimum.high - optimum.low < 15
+    # Much fewer full simulations than a sweep of 0 -- 60 degrees in 5 degree steps
+    assert calls.count(1800) < 13 / 2
+    assert len(optimum.evaluations) == len(calls)
+
+    # Southern hemisphere: reactor facing north
+    southern = optimize_tilt_angle(TOWNSVILLE, pool=None, workers=1)
+    assert southern.low <= -35 <= southern.high
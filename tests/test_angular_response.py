@@ -0,0 +1,82 @@
+import numpy as np
+import pandas as pd
+import pytest
+from pvlib import irradiance
+
+from miniplant.angular_response import (
+    AngularResponseTable,
+    build_angular_response,
+    reactor_frame_angles,
+)
+from miniplant.spectral_series import SpectralSeries
+
+
+def test_reactor_frame_angles():
+    elevation = np.array([10.0, 45.0, 80.0, 30.0])
+    azimuth = np.array([90.0, 180.0, 250.0, 359.0])
+    for tilt in (0, 40, -10):
+        polar, _ = reactor_frame_angles(tilt, elevation, azimuth)
+        np.testing.assert_allclose(
+            polar, irradiance.aoi(tilt, 180, 90 - elevation, azimuth), atol=1e-9
+        )
+
+    polar, reactor_azimuth = reactor_frame_angles(0, elevation, azimuth)
+    np.testing.assert_allclose(reactor_azimuth, np.mod(180 - azimuth, 360))
+
+
+def test_table_interpolation(tmp_path):
+    polar_angles = [0, 45, 89]
+    azimuth_angles = [0, 90, 180, 270]
+    wavelengths = [400, 600]
+    # Efficiency linear in wavelength, independent of direction
+    efficiency = np.broadcast_to(np.array([0.2, 0.4]), (3, 4, 2))
+    table = AngularResponseTable(
+        polar_angles, azimuth_angles, wavelengths, efficiency, num_photons=1
+    )
+
+    np.testing.assert_allclose(
+        table.efficiency_at([10, 70], [350, 30], [500, 450]), [[0.3, 0.25]] * 2
+    )
+
+    table.save(tmp_path / "table.npz")
+    loaded = AngularResponseTable.load(tmp_path / "table.npz")
+    np.testing.assert_array_equal(loaded.efficiency, table.efficiency)
+
+    index = pd.date_range("2020-06-01 10:00", periods=2, freq="H", tz="UTC")
+    solar_data = pd.DataFrame(
+        {"apparent_elevation": [40.0, 60.0], "azimuth": [150.0, 200.0]}, index=index
+    )
+    spectra = SpectralSeries(index, wavelengths, [[1.0, 1.0], [1.0, 0.0]])
+    np.testing.assert_allclose(
+        table.direct_efficiency(solar_data, 30, spectra), [0.3, 0.2]
+    )
+
+
+def test_build_angular_response():
+    table = build_angular_response(
+        [0, 60], [0, 180], [450, 650], num_photons=3, workers=1
+    )
+    assert table.efficiency.shape == (2, 2, 2)
+    assert ((table.efficiency >= 0) & (table.efficiency <= 1)).all()
+    assert table.reactor_configuration == {"include_dye": True}
+
+
+def test_check_reactor_configuration():
+    table = AngularResponseTable(
+        [0, 89],
+        [0, 180],
+        [400, 600],
+        np.zeros((2, 2, 2)),
+        reactor_configuration={"include_dye": False},
+    )
+    table.check_reactor_configuration(include_dye=False)
+    with pytest.raises(ValueError, match="include_dye"):
+        table.check_reactor_configuration(include_dye=True)
+    with pytest.raises(ValueError, match="reactant_absorption"):
+        table.check_reactor_configuration(
+            include_dye=False, reactant_absorption="flat_test_dye"
+        )
+    # Tables traced with the default configuration
+    AngularResponseTable(
+        [0, 89], [0, 180], [400, 600], np.zeros((2, 2, 2))
+    ).check_reactor_configuration(include_dye=None)
@@ -0,0 +1,91 @@
+import json
+
+import pytest
+
+from miniplant.campaign import campaign_jobs, main, run_campaign
+from miniplant.locations import EINDHOVEN
+from miniplant.result_writer import complete_marker
+
+
+def test_campaign_jobs(tmp_path):
+    spec = {
+        "output_dir": str(tmp_path),
+        "num_photons_per_simulation": 50,
+        "studies": [
+            {"sites": ["Eindhoven", "townsville"], "tilts": [0, 40]},
+            {
+                "sites": [
+                    {"name": "Here", "latitude": 45, "longitude": 9, "tz": "Etc/GMT-1"}
+                ],
+                "tilts": [30],
+                "include_dye": [True, False],
+                "total_photons": 1000,
+            },
+        ],
+    }
+    jobs = campaign_jobs(spec)
+    assert len(jobs) == 6
+    assert jobs[0].site is EINDHOVEN
+    assert jobs[0].options == {"num_photons_per_simulation": 50}
+    assert jobs[-1].target_file == tmp_path / "Here" / "Here_no_dye_30deg_results.csv"
+    assert jobs[-1].options["total_photons"] == 1000
+    assert jobs[0].solar_data_key == jobs[1].solar_data_key != jobs[2].solar_data_key
+
+    with pytest.raises(ValueError, match="Unknown site"):
+        campaign_jobs({"sites": ["Atlantis"], "tilts": [0]})
+    with pytest.raises(ValueError, match="Invalid options"):
+        campaign_jobs({"sites": ["Eindhoven"], "tilts": [0], "pool": 4})
+
+
+def test_campaign_jobs_same_site_and_tilt(tmp_path):
+    spec = {
+        "output_dir": str(tmp_path),
+        "studies": [
+            {"sites": ["Eindhoven"], "tilts": [40]},
+            {"sites": ["Eindhoven"], "tilts": [40], "include_ground": True},
+        ],
+    }
+    with pytest.raises(ValueError, match="give their studies different names"):
+        campaign_jobs(spec)
+
+    spec["studies"][1]["name"] = "with_ground"
+    baseline, with_ground = campaign_jobs(spec)
+    assert (
+        baseline.target_file == tmp_path / "Eindhoven" / "Eindhoven_40deg_results.csv"
+    )
+    assert with_ground.target_file == (
+        tmp_path / "with_ground" / "Eindhoven" / "Eindhoven_40deg_results.csv"
+    )
+    assert with_ground.options == {"include_ground": True}
+
+
+def test_run_campaign(tmp_path, capsys, monkeypatch):
+    monkeypatch.setenv("MINIPLANT_CACHE_DIR", str(tmp_path / "cache"))
+    spec = {
+        "output_dir": str(tmp_path),
+        "sites": ["Eindhoven"],
+        "tilts": [20, 40],
+        "time_range": ["2020-06-01 11:00", "2020-06-01 12:00"],
+        "num_photons_per_simulation": 4,
+    }
+    spec_file = tmp_path / "campaign.json"
+    spec_file.write_text(json.dumps(spec))
+
+    main([str(spec_file), "--dry-run"])
+    assert "2 jobs to be run" in capsys.readouterr().out
+
+    jobs = run_campaign(spec, workers=2)
+    assert all(job.target_file.exists() for job in jobs) and len(jobs) == 2
+    # Jobs already done are skipped
+    assert run_campaign(spec, workers=2) == []
+
+
+def test_streamed_job_done(tmp_path):
+    spec = {"output_dir": str(tmp_path), "sites": ["Eindhoven"], "tilts": [40]}
+    job, streamed = campaign_jobs(spec) + campaign_jobs(dict(spec, stream_rows=10))
+    job.target_file.parent.mkdir(parents=True)
+    job.target_file.write_text("results")
+    assert job.is_done() and not streamed.is_done()
+
+    complete_marker(streamed.target_file).touch()
+    assert streamed.is_done()
@@ -0,0 +1,60 @@
+import pandas as pd
+import pytest
+
+from miniplant.checkpoint import (
+    checkpoint_file,
+    remove_checkpoint,
+    run_with_checkpoints,
+)
+
+
+class Interrupted(Exception):
+    pass
+
+
+def test_resume_from_checkpoint(tmp_path):
+    data = pd.DataFrame(
+        {"irradiance": range(10)},
+        index=pd.date_range("2020-06-01", periods=10, freq="h", tz="Europe/Amsterdam"),
+    )
+    target_file = tmp_path / "results.csv"
+    parameters = {"tilt_angle": 40}
+    processed = []
+
+    def process(rows):
+        processed.extend(rows.index)
+        return rows.assign(reacted=rows["irradiance"] * 0.5)
+
+    def crash_after(rows_done):
+        def process_or_crash(rows):
+            if len(processed) >= rows_done:
+                raise Interrupted
+            return process(rows)
+
+        return process_or_crash
+
+    expected = run_with_checkpoints(process, data, target_file, parameters, 3)
+    pd.testing.assert_frame_equal(
+        expected, data.assign(reacted=data["irradiance"] * 0.5)
+    )
+
+    processed.clear()
+    with pytest.raises(Interrupted):
+        run_with_checkpoints(crash_after(6), data, target_file, parameters, 3)
+    assert checkpoint_file(target_file).exists()
+
+    processed.clear()
+    resumed = run_with_checkpoints(
+        process, data, target_file, parameters, 3, resume=True
+    )
+    assert processed == list(data.index[6:])  # Completed time points are skipped
+    pd.testing.assert_frame_equal(resumed, expected)
+
+    # Checkpoints of runs with other parameters are not used
+    with pytest.raises(ValueError):
+        run_with_checkpoints(
+            process, data, target_file, {"tilt_angle": 30}, resume=True
+        )
+
+    remove_checkpoint(target_file)
+    assert not checkpoint_file(target_file).exists()
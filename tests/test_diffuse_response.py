@@ -0,0 +1,58 @@
+import numpy as np
+import pandas as pd
+
+from miniplant.diffuse_response import build_diffuse_response, diffuse_efficiency
+from miniplant.spectral_data import get_spectrum, register_spectrum
+from miniplant.spectral_efficiency import SpectralEfficiency
+from miniplant.spectral_series import SpectralSeries
+
+
+def test_build_diffuse_response(tmp_path, monkeypatch):
+    monkeypatch.setenv("MINIPLANT_CACHE_DIR", str(tmp_path))
+    response = build_diffuse_response(
+        30, num_photons=10, wavelength_bins=[360, 500, 690], workers=1
+    )
+    assert response.emitted.sum() == 10
+    assert len(list(tmp_path.glob("diffuse_response_*.npz"))) == 1
+
+    cached = build_diffuse_response(
+        30, num_photons=10, wavelength_bins=[360, 500, 690], workers=1
+    )
+    np.testing.assert_array_equal(cached.reacted, response.reacted)
+
+
+def test_diffuse_response_cache_follows_spectrum_content(tmp_path, monkeypatch):
+    monkeypatch.setenv("MINIPLANT_CACHE_DIR", str(tmp_path))
+    spectrum_file = tmp_path / "reactant.tsv"
+    spectrum_file.write_text("wavelength\tvalue\n300\t10\n800\t10\n")
+    register_spectrum("file_test_reactant", spectrum_file)
+
+    def build():
+        return build_diffuse_response(
+            30,
+            num_photons=4,
+            wavelength_bins=[360, 500, 690],
+            workers=1,
+            reactant_absorption="file_test_reactant",
+        )
+
+    build()
+    build()
+    assert len(list(tmp_path.glob("diffuse_response_*.npz"))) == 1
+
+    # Same name, new data (e.g. in a later process): the cached response is not reused
+    spectrum_file.write_text("wavelength\tvalue\n300\t1\n800\t1\n")
+    get_spectrum.cache_clear()
+    build()
+    assert len(list(tmp_path.glob("diffuse_response_*.npz"))) == 2
+
+
+def test_diffuse_efficiency():
+    response = SpectralEfficiency([400, 500, 600], emitted=[10, 10], reacted=[2, 6])
+    index = pd.date_range("2020-06-01 10:00", periods=3, freq="H", tz="UTC")
+    spectra = SpectralSeries(
+        index, [400, 500, 600], [[1.0, 1.0, 1.0], [1.0, 0.0, 0.0], [0.0, 0.0, 1.0]]
+    )
+    solar_data = pd.DataFrame({"diffuse_irradiance": [1.0, 2.0]}, index=index[[2, 0]])
+    solar_data.attrs["diffuse_spectrum"] = spectra
+    np.testing.assert_allclose(diffuse_efficiency(response, solar_data), [0.6, 0.4])
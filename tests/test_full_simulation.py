@@ -0,0 +1,73 @@
+import pandas as pd
+import pytest
+
+from miniplant.full_simulation import (
+    _trace_light_sources,
+    allocate_photon_budget,
+    result_columns,
+    source_columns,
+    yearlong_simulation,
+)
+from miniplant.locations import EINDHOVEN
+from miniplant.scene_creator import NUM_CAPILLARIES
+from miniplant.simulation_result import SimulationResult
+
+
+def test_allocate_photon_budget():
+    solar_data = pd.DataFrame(
+        {"direct_irradiance": [0, 0, 10, 30], "diffuse_irradiance": [0, 5, 10, 10]},
+        index=pd.date_range("2020-06-01 04:00", periods=4, freq="h"),
+    )
+    budget = allocate_photon_budget(solar_data, 100, min_photons=10)
+    assert (budget.index == solar_data.index).all()
+    assert budget.sum() == 100
+    assert budget.iloc[0] == 0  # No light, no photons
+    # 70 photons beyond the minimum, split 5:20:40
+    assert list(budget.iloc[1:]) == [10 + 5, 10 + 22, 10 + 43]
+
+    only_diffuse = allocate_photon_budget(solar_data, 30, ["diffuse"], min_photons=0)
+    assert list(only_diffuse) == [0, 6, 12, 12]
+
+    with pytest.raises(ValueError):
+        allocate_photon_budget(solar_data, 20, min_photons=10)
+
+
+def test_result_columns():
+    # Same columns as ever by default, extra ones only when asked for
+    assert result_columns(["direct", "diffuse"]) == [
+        "apparent_elevation",
+        "azimuth",
+        "simulation_direct",
+        "direct_reacted",
+        "simulation_diffuse",
+        "diffuse_reacted",
+    ]
+    assert source_columns("direct") == []
+    assert source_columns("direct", ["uncertainty", "losses"]) == [
+        "direct_photons",
+        "simulation_direct_uncertainty",
+        "direct_reacted_uncertainty",
+        "direct_exit_fraction",
+        "direct_nonradiative_fraction",
+        "direct_kill_fraction",
+    ]
+    columns = result_columns(["diffuse", "ground"], True, ["capillaries"])
+    assert columns[-1] == f"ground_capillary_{NUM_CAPILLARIES - 1}"
+    assert "ground_reacted" in columns and "direct_capillary_0" not in columns
+
+    with pytest.raises(ValueError):
+        yearlong_simulation(0, EINDHOVEN, extra_columns=["capilaries"])
+
+
+def test_trace_light_sources():
+    light_sources = {"direct": dict(solar_elevation=50), "diffuse": {}}
+    results = _trace_light_sources(
+        light_sources,
+        irradiances={"direct": 10, "diffuse": 0},
+        photons={"direct": 20, "diffuse": 0},
+        tilt_angle=40,
+        include_dye=True,
+    )
+    assert results["direct"].num_photons == 20
+    # Light sources without photons are not traced
+    assert results["diffuse"] == SimulationResult()
@@ -0,0 +1,28 @@
+import numpy as np
+import pytest
+from pvtrace import Event
+
+from miniplant.path_log import PathLog, read_path_log
+from miniplant.simulation_runner import run_direct_simulation
+
+
+def test_sampled_path_log(tmp_path):
+    path = tmp_path / "paths.h5"
+    with PathLog(path, every=3, first=4) as path_log:
+        run_direct_simulation(
+            tilt_angle=40, solar_elevation=50, num_photons=10, path_log=path_log
+        )
+        run_direct_simulation(
+            tilt_angle=40, solar_elevation=50, num_photons=10, path_log=path_log
+        )
+    assert path_log.photons_seen == 20 and path_log.photons_kept == 4
+
+    steps = read_path_log(path)
+    assert list(np.unique(steps["photon"])) == [0, 3, 6, 9]
+    starts = steps[steps["step"] == 0]
+    assert (starts["event"] == Event.GENERATE.value).all()
+    np.testing.assert_allclose(np.linalg.norm(steps["direction"], axis=1), 1, rtol=1e-5)
+
+    with pytest.raises(RuntimeError):
+        with PathLog(tmp_path / "other.h5") as path_log:
+            run_direct_simulation(num_photons=4, workers=2, path_log=path_log)
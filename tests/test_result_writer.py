@@ -0,0 +1,84 @@
+import pandas as pd
+import pytest
+
+from miniplant.result_writer import ResultWriter, is_complete, write_in_chunks
+
+
+@pytest.fixture
+def data():
+    return pd.DataFrame(
+        {"irradiance": [float(value) for value in range(10)]},
+        index=pd.date_range("2020-06-01", periods=10, freq="h", tz="Europe/Amsterdam"),
+    )
+
+
+def process(rows):
+    return rows.assign(reacted=rows["irradiance"] * 0.5)
+
+
+@pytest.mark.parametrize("suffix", [".csv", ".h5"])
+def test_streamed_results(tmp_path, data, suffix):
+    path = tmp_path / f"results{suffix}"
+    columns = ["reacted", "irradiance"]
+    with ResultWriter(path, columns) as writer:
+        write_in_chunks(process, data.iloc[:4], writer, rows_per_chunk=3)
+        assert len(writer.completed_index()) == 4
+
+    processed = []
+
+    def tracked_process(rows):
+        processed.extend(rows.index)
+        return process(rows)
+
+    # Resumed run: only the remaining time points are processed
+    with ResultWriter(path, columns, resume=True) as writer:
+        write_in_chunks(tracked_process, data, writer, rows_per_chunk=3)
+    assert processed == list(data.index[4:])
+
+    if suffix == ".csv":
+        expected = tmp_path / "expected.csv"
+        process(data).to_csv(expected, columns=columns)
+        assert path.read_text() == expected.read_text()
+    else:
+        pd.testing.assert_frame_equal(
+            pd.read_hdf(path, "results"), process(data)[columns], check_freq=False
+        )
+
+    # Without resume the file is overwritten
+    with ResultWriter(path, columns) as writer:
+        assert len(writer.completed_index()) == 0
+
+
+@pytest.mark.parametrize("suffix", [".csv", ".h5"])
+def test_resume_only_same_run(tmp_path, data, suffix):
+    path = tmp_path / f"results{suffix}"
+    columns = ["reacted", "irradiance"]
+    parameters = dict(tilt_angle=30, num_photons=100)
+    with ResultWriter(path, columns, parameters=parameters) as writer:
+        write_in_chunks(process, data.iloc[:4], writer)
+
+    with pytest.raises(ValueError):
+        ResultWriter(
+            path, columns, resume=True, parameters=dict(parameters, tilt_angle=40)
+        )
+    with pytest.raises(ValueError):
+        ResultWriter(path, ["reacted"], resume=True, parameters=parameters)
+    # Rows are kept, to be resumed with the right parameters
+    with ResultWriter(path, columns, resume=True, parameters=parameters) as writer:
+        assert len(writer.completed_index()) == 4
+
+
+def test_complete_marker(tmp_path, data):
+    path = tmp_path / "results.csv"
+    with ResultWriter(path, ["reacted"]) as writer:
+        writer.append(process(data.iloc[:4]))
+    # Interrupted run
+    assert not is_complete(path)
+
+    with ResultWriter(path, ["reacted"], resume=True) as writer:
+        write_in_chunks(process, data, writer)
+    assert is_complete(path)
+
+    # Resumed again, e.g. with more time points
+    with ResultWriter(path, ["reacted"], resume=True) as writer:
+        assert not is_complete(path)
@@ -2,8 +2,9 @@ from miniplant.scene_creator import (
     _create_scene_common,
     create_direct_scene,
     create_diffuse_scene,
+    get_scene_template,
 )
-from miniplant.utils import MyLight
+from miniplant.utils import DirectPhotonGenerator, MyLight
 from pvtrace import Scene, Light, Box, Luminophore
 from anytree import LevelOrderIter, Node
 
@@ -85,3 +86,28 @@ def test_create_direct_scene():
     light = scene.light_nodes.pop()
     # light is MyLight
     assert isinstance(light.light, MyLight)
+
+
+def test_scene_template_is_reused():
+    template = get_scene_template(tilt_angle=20)
+    assert get_scene_template(tilt_angle=20) is template
+
+    direct = template.direct_scene()
+    diffuse = template.diffuse_scene()
+    # Same geometry, light source swapped
+    assert direct.root is diffuse.root is template.world
+    scene_is_valid(diffuse)
+    assert isinstance(diffuse.light_nodes[0].light, MyLight)
+
+
+def test_create_scenes_share_the_template():
+    direct = create_direct_scene(tilt_angle=20)
+    scene_is_valid(direct)
+    assert isinstance(
+        direct.light_nodes[0].light.position_direction, DirectPhotonGenerator
+    )
+    diffuse = create_diffuse_scene(tilt_angle=20)
+    scene_is_valid(diffuse)
+    # Distinct scenes on the cached geometry, with the light swapped
+    assert direct is not diffuse
+    assert direct.root is diffuse.root is get_scene_template(tilt_angle=20).world
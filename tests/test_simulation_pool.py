@@ -0,0 +1,77 @@
+import numpy as np
+import pandas as pd
+
+from miniplant.simulation_pool import SimulationPool
+from miniplant.simulation_runner import run_direct_simulation, run_diffuse_simulation
+from miniplant.spectral_series import SpectralSeries
+
+
+def green_photons():
+    return 555
+
+
+def test_simulation_pool_is_reused():
+    with SimulationPool(workers=2) as pool:
+        direct = run_direct_simulation(
+            tilt_angle=40,
+            solar_elevation=50,
+            solar_azimuth=180,
+            solar_spectrum_function=green_photons,
+            num_photons=200,
+            pool=pool,
+        )
+        assert 0.20 <= direct <= 0.40
+
+        diffuse = run_diffuse_simulation(
+            solar_spectrum_function=green_photons, num_photons=100, pool=pool
+        )
+        assert 0.15 <= diffuse <= 0.40
+
+
+def test_simulation_pool_few_photons():
+    with SimulationPool(workers=4) as pool:
+        result = pool.simulate(
+            "diffuse",
+            num_photons=3,
+            template_kwargs=dict(tilt_angle=30),
+            light_kwargs=dict(solar_spectrum_function=green_photons),
+        )
+    assert result.num_photons == sum(result.events.values()) == 3
+
+
+def double_row(row):
+    row["doubled"] = row["value"] * 2
+    return row
+
+
+def test_simulation_pool_map_rows():
+    index = pd.date_range("2020-06-01", periods=10, freq="30min", tz="Europe/Amsterdam")
+    df = pd.DataFrame({"value": np.arange(10.0)}, index=index)
+
+    with SimulationPool(workers=2) as pool:
+        results = pool.map_rows(double_row, df)
+
+    # Same rows, same order, same dtypes as DataFrame.apply()
+    pd.testing.assert_frame_equal(
+        results, df.apply(double_row, axis=1), check_freq=False
+    )
+
+
+def row_spectrum_total(row, spectrum):
+    # Only the spectra of the chunk time points are sent along
+    assert len(spectrum) <= 2
+    row["total"] = spectrum.spectrum_at(row.name).sum()
+    return row
+
+
+def test_simulation_pool_map_rows_spectra():
+    index = pd.date_range("2020-06-01", periods=10, freq="30min", tz="Europe/Amsterdam")
+    df = pd.DataFrame({"value": np.arange(10.0)}, index=index)
+    spectrum = SpectralSeries(index, [400, 500], np.arange(20.0).reshape(10, 2))
+
+    with SimulationPool(workers=2) as pool:
+        results = pool.map_rows(
+            row_spectrum_total, df, chunksize=2, spectra=dict(spectrum=spectrum)
+        )
+
+    np.testing.assert_array_equal(results["total"], spectrum.values.sum(axis=1))
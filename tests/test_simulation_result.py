@@ -0,0 +1,72 @@
+from pvtrace import Event
+
+from miniplant.simulation_pool import SimulationPool
+from miniplant.simulation_result import SimulationResult
+from miniplant.simulation_runner import run_direct_simulation
+
+
+def test_simulation_result():
+    result = SimulationResult.from_photons(
+        [Event.REACT, Event.EXIT, Event.NONRADIATIVE, Event.REACT],
+        ["Reaction_mixture_3", None, "bottomPV", "Reaction_mixture_3"],
+    )
+    assert result.num_photons == 4
+    assert result.reacted_fraction == 0.5
+    assert result.fraction(Event.EXIT) == 0.25
+    assert result.nodes == {"Reaction_mixture_3": 2, "bottomPV": 1}
+    assert result.bottom_pv_count == 1 and result.side_pv_count == 0
+
+    combined = result + SimulationResult.from_photons([Event.NONRADIATIVE], ["sidePV2"])
+    assert combined.num_photons == 5
+    assert combined.side_pv_count == 1
+    assert combined.events[Event.REACT] == 2
+    assert SimulationResult().reacted_fraction == 0
+
+
+def test_same_tallies_for_any_number_of_workers():
+    kwargs = dict(tilt_angle=40, solar_elevation=50, num_photons=20, full_result=True)
+    serial = run_direct_simulation(**kwargs)
+    with SimulationPool(workers=2) as pool:
+        parallel = run_direct_simulation(pool=pool, **kwargs)
+
+    for result in (serial, parallel):
+        assert result.num_photons == sum(result.events.values()) == 20
+        # Every reacted photon was absorbed in a reaction mixture node
+        reacted_nodes = sum(
+            count
+            for node, count in result.nodes.items()
+            if node.startswith("Reaction_mixture_")
+        )
+        assert reacted_nodes >= result.events[Event.REACT]
+        assert (
+            sum(result.nodes.values())
+            == result.events[Event.REACT] + result.events[Event.NONRADIATIVE]
+        )
+
+
+def test_loss_channels_and_capillary_counts():
+    from miniplant.scene_creator import NUM_CAPILLARIES, REACTION_MIXTURE_NODE
+
+    finals = [Event.REACT, Event.REACT, Event.EXIT, Event.NONRADIATIVE]
+    nodes = [f"{REACTION_MIXTURE_NODE}0", f"{REACTION_MIXTURE_NODE}3", None, "Tube_1"]
+    result = SimulationResult.from_photons(finals, nodes)
+
+    assert result.event_fractions() == {"exit": 0.25, "nonradiative": 0.25, "kill": 0.0}
+    assert result.event_fractions([Event.REACT]) == {"react": 0.5}
+    counts = result.capillary_counts()
+    assert len(counts) == NUM_CAPILLARIES
+    assert counts[0] == counts[3] == 1 and sum(counts) == 2
+    assert SimulationResult().event_fractions()["exit"] == 0.0
+
+
+def test_confidence_interval():
+    result = SimulationResult.from_photons([Event.REACT] * 3 + [Event.EXIT] * 7, [])
+    low, high = result.confidence_interval()
+    assert low < result.reacted_fraction < high
+    # Wilson score interval for 3/10 at 95% confidence
+    assert abs(low - 0.1078) < 1e-3 and abs(high - 0.6032) < 1e-3
+    # Never zero width, even if no photon reacted
+    assert SimulationResult.from_photons([Event.EXIT] * 10, []).reacted_uncertainty > 0
+    assert SimulationResult().confidence_interval() == (0.0, 1.0)
+    larger = SimulationResult.from_photons([Event.REACT] * 30 + [Event.EXIT] * 70, [])
+    assert larger.reacted_uncertainty < result.reacted_uncertainty
@@ -1,4 +1,10 @@
-from miniplant.simulation_runner import run_direct_simulation, run_diffuse_simulation
+from miniplant.simulation_runner import (
+    run_adaptive_simulation,
+    run_combined_simulation,
+    run_direct_simulation,
+    run_diffuse_simulation,
+    split_photon_budget,
+)
 
 
 def green_photons():
@@ -31,3 +37,67 @@ def test_run_direct_simulation():
 def test_run_diffuse_simulation():
     standard = run_diffuse_simulation(solar_spectrum_function=green_photons)
     assert 0.20 <= standard <= 0.40
+
+
+def test_split_photon_budget():
+    assert split_photon_budget(100, dict(direct=700, diffuse=250, ground=50)) == dict(
+        direct=70, diffuse=25, ground=5
+    )
+    # At least one photon per source with irradiance, none without
+    assert split_photon_budget(10, dict(direct=1000, diffuse=0, ground=1)) == dict(
+        direct=9, diffuse=0, ground=1
+    )
+    assert split_photon_budget(0, dict(direct=1)) == dict(direct=0)
+
+
+def test_run_combined_simulation():
+    light_sources = dict(
+        direct=dict(
+            solar_elevation=50,
+            solar_azimuth=180,
+            solar_spectrum_function=green_photons,
+        ),
+        diffuse=dict(solar_spectrum_function=green_photons),
+        ground=dict(solar_spectrum_function=green_photons),
+    )
+    reacted = run_combined_simulation(
+        light_sources,
+        irradiances=dict(direct=3, diffuse=1, ground=0),
+        tilt_angle=40,
+        num_photons=20,
+    )
+    assert list(reacted) == ["direct", "diffuse", "ground"]
+    assert 0 <= reacted["direct"] <= 1 and 0 <= reacted["diffuse"] <= 1
+    assert reacted["ground"] == 0
+
+
+def test_run_adaptive_simulation():
+    light_sources = {
+        "direct": dict(solar_elevation=50, solar_azimuth=180),
+        "diffuse": {},
+        "ground": {},
+    }
+    weights = {"direct": 10, "diffuse": 1, "ground": 0}
+    results = run_adaptive_simulation(
+        light_sources,
+        weights,
+        target_uncertainty=0,
+        tilt_angle=40,
+        batch_photons=10,
+        max_photons=60,
+    )
+    assert sum(result.num_photons for result in results.values()) == 60
+    assert results["ground"].num_photons == 0
+    # After a first batch each, photons go where the weighted uncertainty is largest
+    assert results["direct"].num_photons > results["diffuse"].num_photons >= 10
+
+    # Loose target: one batch per light source is enough
+    results = run_adaptive_simulation(
+        light_sources,
+        weights,
+        target_uncertainty=100,
+        tilt_angle=40,
+        batch_photons=10,
+        max_photons=60,
+    )
+    assert [result.num_photons for result in results.values()] == [10, 10, 0]
@@ -1,5 +1,19 @@
-from miniplant.solar_data import solar_data_for_place_and_time
-from miniplant.locations import LOCATIONS
+import datetime
+
+import numpy as np
+import pandas as pd
+import pytest
+
+from miniplant import solar_data
+from miniplant.solar_data import (
+    albedo,
+    solar_data_for_place_and_time,
+    solar_data_for_tilts,
+    solar_ephemeris,
+    solar_spectra_for_place_and_time,
+    solar_spectra_for_tilts,
+)
+from miniplant.locations import EINDHOVEN, LOCATIONS
 
 
 def test_solar_data_for_place_and_time():
@@ -21,3 +35,95 @@ def test_solar_data_for_place_and_time():
         test_df = solar_data_for_place_and_time(site, tilt[site.name], 60 * 60 * 12)
 
         assert test_df["azimuth"].count() == points[site.name]
+
+
+def test_solar_spectra_for_place_and_time():
+
+    solar_data, direct, diffuse, ground = solar_spectra_for_place_and_time(
+        EINDHOVEN, 40, 60 * 60
+    )
+
+    assert direct.wavelengths[0] == 360 and direct.wavelengths[-1] == 690
+    assert direct.values.shape == diffuse.values.shape
+    assert direct.values.shape == (len(solar_data), len(direct.wavelengths))
+    assert (direct.index == solar_data.index).all()
+    assert (solar_data["apparent_elevation"] > 0).all()
+    assert (solar_data["direct_irradiance"] > 0).all()
+    np.testing.assert_allclose(direct.integrate(), solar_data["direct_irradiance"])
+    np.testing.assert_allclose(ground.integrate(), solar_data["ground_irradiance"])
+
+
+def test_solar_data_cache(tmp_path, monkeypatch):
+
+    monkeypatch.setenv("MINIPLANT_CACHE_DIR", str(tmp_path / "cache"))
+    monkeypatch.chdir(tmp_path)
+
+    computed = solar_data.solar_data_for_place_and_time(EINDHOVEN, 40, 60 * 60 * 6)
+    assert len(list((tmp_path / "cache").glob("*.h5"))) == 1
+    assert not list(tmp_path.glob("*.csv"))  # CSV export is opt-in
+
+    def not_cached(*args, **kwargs):
+        raise AssertionError("Solar data should have been loaded from cache")
+
+    monkeypatch.setattr(solar_data, "solar_ephemeris", not_cached)
+    cached = solar_data.solar_data_for_place_and_time(EINDHOVEN, 40, 60 * 60 * 6)
+    pd.testing.assert_frame_equal(cached, computed)
+    np.testing.assert_array_equal(
+        cached.attrs["direct_spectrum"].values, computed.attrs["direct_spectrum"].values
+    )
+
+    # Different atmosphere, different cache entry
+    monkeypatch.setattr(solar_data, "ozone", 0.35)
+    with pytest.raises(AssertionError, match="loaded from cache"):
+        solar_data.solar_data_for_place_and_time(EINDHOVEN, 40, 60 * 60 * 6)
+
+
+def test_solar_data_for_tilts():
+
+    ephemeris = solar_ephemeris(EINDHOVEN, 60 * 60 * 3)
+    assert "aoi" not in ephemeris.columns
+    spectra = solar_spectra_for_tilts(ephemeris, [0, 40, 90])
+    assert list(spectra) == [0, 40, 90]
+    # Vertical reactor facing south: no direct light with the sun in the north
+    assert (np.abs(spectra[90][0]["azimuth"] - 180) < 90).all()
+    # No ground-reflected light on an horizontal reactor, half of the reflected global irradiance on a vertical one
+    assert (spectra[0][0]["ground_irradiance"] == 0).all()
+    # (sky diffuse on an horizontal reactor is the dhi, except for the Hay-Davies cos zenith clipping close to sunset)
+    vertical = spectra[90][0]["apparent_elevation"].to_numpy() > 2
+    times = spectra[90][0].index[vertical]
+    horizontal = spectra[0][1].take(spectra[0][1].index.get_indexer(times))
+    sky = spectra[0][2].take(spectra[0][2].index.get_indexer(times))
+    np.testing.assert_allclose(
+        spectra[90][3].take(vertical).values,
+        albedo * (horizontal.values + sky.values) / 2,
+    )
+
+    per_tilt = solar_data_for_tilts(EINDHOVEN, [40, 0], 60 * 60 * 3, use_cache=False)
+    assert list(per_tilt) == [40, 0]
+    np.testing.assert_array_equal(
+        per_tilt[40].attrs["direct_spectrum"].values, spectra[40][1].values
+    )
+
+
+def test_solar_data_time_range():
+
+    start = EINDHOVEN.pytz.localize(datetime.datetime(2020, 7, 15, 15, 0))
+    end = EINDHOVEN.pytz.localize(datetime.datetime(2020, 7, 15, 17, 30))
+    full_year = solar_data_for_place_and_time(EINDHOVEN, 40, 1800, use_cache=False)
+    window = solar_data_for_place_and_time(
+        EINDHOVEN, 40, 1800, start=start, end=end, use_cache=False
+    )
+
+    assert len(window) == 6
+    pd.testing.assert_frame_equal(window, full_year.loc[start:end], check_freq=False)
+    np.testing.assert_array_equal(
+        window.attrs["direct_spectrum"].values,
+        full_year.attrs["direct_spectrum"].between(start, end).values,
+    )
+
+    # Explicit time points, in other years too
+    times = pd.DatetimeIndex(["2019-06-21 13:00", "2024-02-29 12:00"])
+    explicit = solar_data_for_place_and_time(
+        EINDHOVEN, 40, times=times, use_cache=False
+    )
+    assert list(explicit.index) == list(times.tz_localize(EINDHOVEN.tz))
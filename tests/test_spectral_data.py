@@ -0,0 +1,50 @@
+import numpy as np
+import pytest
+
+from miniplant.scene_creator import create_direct_scene
+from miniplant.spectral_data import (
+    WAVELENGTH_GRID,
+    get_luminophore,
+    get_reactor_material,
+    get_resampled_spectrum,
+    get_spectrum,
+    register_spectrum,
+)
+
+
+def test_get_spectrum_is_parsed_once():
+    get_spectrum.cache_clear()
+    first = get_spectrum("LR305_ABS")
+    assert get_spectrum("LR305_ABS") is first
+    assert get_spectrum.cache_info().misses == 1
+    assert first.shape[1] == 2
+
+
+def test_get_resampled_spectrum():
+    resampled = get_resampled_spectrum("MB_ABS")
+    assert get_resampled_spectrum("MB_ABS") is resampled
+    assert resampled.shape == WAVELENGTH_GRID.shape
+    assert np.all(resampled >= 0)
+    data = get_spectrum("MB_ABS")
+    inside = (WAVELENGTH_GRID >= data[0, 0]) & (WAVELENGTH_GRID <= data[-1, 0])
+    np.testing.assert_allclose(
+        resampled[inside], np.interp(WAVELENGTH_GRID[inside], data[:, 0], data[:, 1])
+    )
+
+
+def test_materials_are_built_once():
+    assert get_luminophore() is get_luminophore()
+    assert get_reactor_material() is get_reactor_material()
+
+
+def test_register_spectrum():
+    register_spectrum("flat_test_dye", [[300, 10.0], [800, 10.0]])
+    assert get_spectrum("flat_test_dye").shape == (2, 2)
+    # Names cannot be reused
+    with pytest.raises(ValueError):
+        register_spectrum("flat_test_dye", [[300, 1.0], [800, 1.0]])
+    with pytest.raises(KeyError):
+        get_spectrum("not_registered")
+
+    scene = create_direct_scene(reactant_absorption="flat_test_dye")
+    assert scene is not None
@@ -0,0 +1,74 @@
+import numpy as np
+import pandas as pd
+import pytest
+
+from miniplant.simulation_runner import run_wavelength_resolved_simulation
+from miniplant.spectral_data import register_spectrum
+from miniplant.spectral_efficiency import SpectralEfficiency, folding_matrix
+from miniplant.spectral_series import SpectralSeries
+from pvtrace import Event
+
+
+def test_folding_matrix_is_exact():
+    wavelengths = np.array([360.0, 375.0, 400.0, 433.0, 480.0])
+    spectrum = np.array([1.0, 3.0, 2.0, 5.0, 0.5])
+    bin_edges = np.array([360.0, 380.0, 400.0, 450.0, 480.0])
+
+    fine = np.linspace(360, 480, 120001)
+    fine_spectrum = np.interp(fine, wavelengths, spectrum)
+    expected = [
+        np.trapz(
+            fine_spectrum[(fine >= low) & (fine <= high)],
+            fine[(fine >= low) & (fine <= high)],
+        )
+        for low, high in zip(bin_edges[:-1], bin_edges[1:], strict=True)
+    ]
+    np.testing.assert_allclose(
+        folding_matrix(wavelengths, bin_edges) @ spectrum, expected, rtol=1e-6
+    )
+
+    with pytest.raises(ValueError):
+        folding_matrix(wavelengths, [350.0, 400.0])
+
+
+def test_fold():
+    efficiency = SpectralEfficiency([400, 500, 600], emitted=[10, 10], reacted=[2, 6])
+    np.testing.assert_allclose(efficiency.efficiency, [0.2, 0.6])
+
+    index = pd.date_range("2020-06-01", periods=3, freq="H")
+    spectra = SpectralSeries(
+        index, [400, 500, 600], [[1.0, 1.0, 1.0], [1.0, 0.0, 0.0], [0.0, 1.0, 1.0]]
+    )
+    np.testing.assert_allclose(
+        efficiency.fold(spectra), [0.4, 0.2, (0.2 * 0.5 + 0.6 * 1.0) / 1.5]
+    )
+    assert efficiency.fold(([400, 600], [1.0, 1.0])) == pytest.approx(0.4)
+
+    # Registered spectra are folded on the shared wavelength grid
+    register_spectrum("flat_test_light", [[300, 1.0], [800, 1.0]])
+    assert efficiency.fold("flat_test_light") == pytest.approx(0.4)
+
+    combined = efficiency + SpectralEfficiency([400, 500, 600], [10, 0], [0, 0])
+    np.testing.assert_array_equal(combined.emitted, [20, 10])
+    with pytest.raises(ValueError):
+        SpectralEfficiency([400, 500, 600], [10, 0], [2, 0]).fold(spectra)
+
+
+def test_from_photons():
+    efficiency = SpectralEfficiency.from_photons(
+        [400, 500, 600],
+        [400.0, 450.0, 599.0, 600.0],
+        [Event.REACT, Event.ABSORB, Event.REACT, Event.EXIT],
+    )
+    np.testing.assert_array_equal(efficiency.emitted, [2, 2])
+    np.testing.assert_array_equal(efficiency.reacted, [1, 1])
+
+
+def test_run_wavelength_resolved_simulation():
+    result = run_wavelength_resolved_simulation(
+        "diffuse", tilt_angle=30, num_photons=20, wavelength_bins=[360, 500, 690]
+    )
+    # Stratified sampling: photons proportional to the bin width (+/- the stratum across the bin edge)
+    assert result.emitted.sum() == 20
+    assert 8 <= result.emitted[0] <= 9
+    assert (result.reacted <= result.emitted).all()
@@ -0,0 +1,51 @@
+import pickle
+
+import numpy as np
+import pandas as pd
+import pytest
+
+from miniplant.spectral_series import SpectralSeries
+from miniplant.utils import spectral_distribution_to_photon_distribution
+from pvtrace import Distribution
+
+
+@pytest.fixture
+def series():
+    index = pd.date_range("2020-06-01", periods=5, freq="H", tz="Europe/Amsterdam")
+    wavelengths = np.arange(400.0, 410.0)
+    irradiance = np.arange(50.0).reshape(5, 10) + 1
+    return SpectralSeries.from_irradiance(index, wavelengths, irradiance, 1800)
+
+
+def test_from_irradiance_matches_distribution_conversion(series):
+    irradiance = np.arange(10.0) + 11
+    expected = spectral_distribution_to_photon_distribution(
+        Distribution(series.wavelengths, irradiance), 1800
+    )
+    np.testing.assert_allclose(series.values[1], expected._y)
+
+
+def test_lookup_by_timestamp(series):
+    timestamp = series.index[2]
+    assert isinstance(series.at(timestamp), Distribution)
+    np.testing.assert_array_equal(series.at(timestamp)._y, series.values[2])
+    sampled = series.sampler(timestamp).batch(100)
+    assert sampled.min() >= 400 and sampled.max() <= 409
+
+
+def test_time_slices_are_views(series):
+    part = series.between("2020-06-01 01:00", "2020-06-01 03:00")
+    assert len(part) == 3
+    assert np.shares_memory(part.values, series.values)
+    assert part.index[0] == series.index[1]
+
+
+def test_pickle(series):
+    restored = pickle.loads(pickle.dumps(series))
+    np.testing.assert_array_equal(restored.values, series.values)
+    assert (restored.index == series.index).all()
+
+
+def test_shape_mismatch(series):
+    with pytest.raises(ValueError):
+        SpectralSeries(series.index[:2], series.wavelengths, series.values)
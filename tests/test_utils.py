@@ -0,0 +1,113 @@
+import numpy as np
+from scipy.stats import ks_2samp
+
+from pvtrace import Distribution
+
+from miniplant.scene_creator import (
+    create_diffuse_scene,
+    create_direct_scene,
+    get_scene_template,
+)
+from miniplant.spectral_data import WAVELENGTH_GRID
+from miniplant.utils import (
+    DirectPhotonGenerator,
+    GroundReflectedPhotonGenerator,
+    IsotropicPhotonGenerator,
+    SpectrumSampler,
+    emit_photons,
+    emit_photons_per_source,
+    sample_diffuse_directions,
+    tilt_rotation_matrix,
+)
+
+
+def test_direct_photon_generator_batch():
+    generator = DirectPhotonGenerator(
+        tilt_angle=30, solar_elevation=40, solar_azimuth=180
+    )
+    positions, directions = generator.batch(1000)
+    assert positions.shape == directions.shape == (1000, 3)
+    # All photons are parallel, pointing towards the reactor
+    assert np.allclose(directions, -generator.solar_light_vector)
+    # Once back on the reactor plane, positions are within the reactor front face
+    on_reactor = (positions - generator.solar_light_vector) @ tilt_rotation_matrix(30)
+    assert np.allclose(on_reactor[:, 2], 0)
+    assert np.all(np.abs(on_reactor[:, 0:2]) <= 0.47 / 2)
+
+
+def test_isotropic_photon_generator_batch():
+    positions, directions = IsotropicPhotonGenerator(tilt_angle=30).batch(1000)
+    assert np.allclose(np.linalg.norm(directions, axis=1), 1)
+    # Coming from above the horizon
+    assert np.all(directions[:, 2] <= 0)
+    # Hitting the reactor front face
+    normal = tilt_rotation_matrix(30) @ np.array([0, 0, 1])
+    assert np.all(directions @ normal <= 1e-12)
+
+
+def test_ground_reflected_photon_generator_batch():
+    positions, directions = GroundReflectedPhotonGenerator(tilt_angle=30).batch(1000)
+    assert np.allclose(np.linalg.norm(directions, axis=1), 1)
+    # Coming from below the horizon
+    assert np.all(directions[:, 2] >= 0)
+    # Hitting the reactor front face
+    normal = tilt_rotation_matrix(30) @ np.array([0, 0, 1])
+    assert np.all(directions @ normal <= 1e-12)
+
+
+def test_emit_photons():
+    assert len(list(emit_photons(create_direct_scene(), 100))) == 100
+    assert len(list(emit_photons(create_diffuse_scene(), 100))) == 100
+
+
+def test_emit_photons_per_source():
+    scene = get_scene_template(30).combined_scene(
+        dict(direct=dict(solar_elevation=40), diffuse={}, ground={})
+    )
+    rays = list(emit_photons_per_source(scene, dict(direct=7, ground=3)))
+    assert [ray.source for ray in rays] == ["direct"] * 7 + ["ground"] * 3
+
+
+def test_sample_diffuse_directions_matches_rejection_sampling():
+    np.random.seed(42)
+    tilt = 30
+    # Reference: uniform zenith/azimuth draws, rejecting those hitting the reactor back
+    zenith = np.deg2rad(np.random.rand(40000) * 90)
+    azimuth = np.deg2rad(np.random.rand(40000) * 360)
+    aoi_projection = np.cos(np.deg2rad(tilt)) * np.cos(zenith) + np.sin(
+        np.deg2rad(tilt)
+    ) * np.sin(zenith) * np.cos(azimuth)
+    reference_zenith = zenith[aoi_projection >= 0]
+
+    directions = sample_diffuse_directions(tilt, 20000)
+    sampled_zenith = np.arccos(directions[:, 2])
+
+    assert ks_2samp(reference_zenith, sampled_zenith).pvalue > 0.001
+
+
+def test_spectrum_sampler():
+    wavelengths = np.linspace(360, 690, 28)
+    spectrum = Distribution(wavelengths, np.exp(-(((wavelengths - 500) / 60) ** 2)))
+    sampler = SpectrumSampler(spectrum)
+
+    # Identical spectra share the same table
+    assert SpectrumSampler((wavelengths, spectrum._y)).cdf is sampler.cdf
+
+    # Same inverse CDF as pvtrace.Distribution
+    probability = np.linspace(0, 1, 101)
+    assert np.allclose(
+        np.interp(probability, sampler.cdf, sampler.wavelengths),
+        spectrum.sample(probability),
+    )
+
+    assert 360 <= sampler() <= 690
+    for stratified in (False, True):
+        sampler.stratified = stratified
+        samples = sampler.batch(10000)
+        assert samples.shape == (10000,)
+        assert abs(samples.mean() - 500) < 5
+
+    # Registered spectra are sampled on the shared wavelength grid
+    emission = SpectrumSampler("LR305_EMS")
+    np.testing.assert_array_equal(emission.wavelengths, WAVELENGTH_GRID)
+    assert WAVELENGTH_GRID[0] <= emission() <= WAVELENGTH_GRID[-1]